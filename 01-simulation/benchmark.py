@@ -0,0 +1,219 @@
+"""Performance benchmarks of the data simulation.
+
+Run all the benchmarks with `python3 benchmark.py` or the chosen ones with
+`python3 benchmark.py batch_size ...`.
+"""
+
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import List
+
+import numpy as np
+from pyatmosphere import simulations
+from pyatmosphere.theory.vacuum import vacuum_propagation
+
+import config
+from lib import fft
+from lib.batched import BatchedSimulation
+from lib.beam_moments import beam_moments
+from lib.phase_screens import channel_phase_screen, generate_phase_screen
+from lib.propagation import get_propagator, release_propagator
+from lib.results import create_results, create_simulation
+
+
+def _create_results(results_path: Path,
+                    iterations: int) -> List[simulations.Result]:
+    "Declare the results of the benchmark channel without aperture shifts."
+    channel_config = config.CHANNELS[config.BENCHMARK_CHANNEL]
+    return create_results(
+        config.BENCHMARK_CHANNEL, channel_config['channel'],
+        channel_config['aperture_range'],
+        [(0, 0)] * config.R0_VALUES_COUNT,
+        iterations, iterations, results_path=results_path)
+
+
+def batch_size():
+    "Print the simulation throughput against the batch size."
+    print(f"Batched simulation of '{config.BENCHMARK_CHANNEL}' channel:")
+    for size in config.BENCHMARK_BATCH_SIZES:
+        with tempfile.TemporaryDirectory() as results_path:
+            results = _create_results(Path(results_path),
+                                      config.BENCHMARK_ITERATIONS)
+            sim = BatchedSimulation(results, size,
+                                    config.SIMULATION_BATCH_MEMORY_LIMIT)
+            start_time = time.perf_counter()
+            sim.run()
+            elapsed = time.perf_counter() - start_time
+        print(f"    B = {sim.batch_size:>3}: "
+              f"{config.BENCHMARK_ITERATIONS / elapsed:.2f} iterations/s")
+
+
+def fft_backend():
+    "Print the vacuum propagation time of the FFT backends on CPU."
+    workers = config.FFT_WORKERS or fft.default_workers()
+    backends = sorted({fft.create_backend(name).name
+                       for name in fft.BACKENDS},
+                      key=fft.BACKENDS.index)
+    print(f"Vacuum propagation on CPU, {workers} FFT threads:")
+    for resolution in config.BENCHMARK_FFT_RESOLUTIONS:
+        rng = np.random.default_rng(0)
+        shape = (resolution, resolution)
+        field = (rng.standard_normal(shape) +
+                 1j * rng.standard_normal(shape)).astype(np.complex64)
+        f2 = rng.random(shape)
+        for name in backends:
+            fft.use_backend(name, workers, config.FFT_WISDOM_PATH)
+            # The first propagation plans the FFTs
+            vacuum_propagation(field, 1e3, 1e7, 1e-3, f2, 1.)
+            start_time = time.perf_counter()
+            for _ in range(config.BENCHMARK_FFT_REPEATS):
+                vacuum_propagation(field, 1e3, 1e7, 1e-3, f2, 1.)
+            elapsed = time.perf_counter() - start_time
+            print(f"    N = {resolution:>5}, {name:<6}: "
+                  f"{1e3 * elapsed / config.BENCHMARK_FFT_REPEATS:.1f} ms")
+    fft.use_backend('numpy')
+
+
+def propagation():
+    """Print the time and the peak allocated memory of a realization
+    propagated by pyatmosphere and with the cached transfer functions and
+    buffers.
+    """
+    channel = config.CHANNELS[config.BENCHMARK_CHANNEL]['channel']
+    fft.use_backend(config.FFT_BACKEND,
+                    config.FFT_WORKERS or fft.default_workers(),
+                    config.FFT_WISDOM_PATH,
+                    single=config.SIMULATION_SINGLE_PRECISION)
+    propagator = get_propagator(channel)
+    print(f"Propagation of '{config.BENCHMARK_CHANNEL}' channel, "
+          f"{fft.get_backend().name} FFTs:")
+    for name, generator in [('pyatmosphere', None),
+                            ('cached', propagator.generator)]:
+        if generator:
+            channel.path.generator = generator
+        # The first propagation plans the FFTs and fills the cache
+        channel.run(pupil=False)
+        allocations = propagator.allocations
+        start_time = time.perf_counter()
+        for _ in range(config.BENCHMARK_ITERATIONS):
+            channel.run(pupil=False)
+        elapsed = time.perf_counter() - start_time
+        tracemalloc.start()
+        channel.run(pupil=False)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        if generator:
+            del channel.path.generator
+        print(f"    {name:<12}: "
+              f"{1e3 * elapsed / config.BENCHMARK_ITERATIONS:.1f} ms, "
+              f"{peak / 2**20:.1f} MiB allocated at peak, "
+              f"{propagator.allocations - allocations} cached arrays "
+              "allocated")
+    release_propagator(channel)
+
+
+def phase_screens():
+    "Print the synthesis time of a sparse spectrum phase screen."
+    print(f"Sparse spectrum phase screens of '{config.BENCHMARK_CHANNEL}' "
+          "channel:")
+    for resolution in config.BENCHMARK_PHASE_SCREEN_RESOLUTIONS:
+        phase_screen = channel_phase_screen(
+            config.CHANNELS[config.BENCHMARK_CHANNEL]['channel'], resolution)
+        for name, generate in [('pyatmosphere', phase_screen.generate),
+                               ('fast', lambda: generate_phase_screen(
+                                   phase_screen))]:
+            # The first screen integrates the spectrum
+            generate()
+            start_time = time.perf_counter()
+            for _ in range(config.BENCHMARK_PHASE_SCREEN_REPEATS):
+                generate()
+            elapsed = time.perf_counter() - start_time
+            print(f"    N = {resolution:>5}, {name:<12}: "
+                  f"{elapsed / config.BENCHMARK_PHASE_SCREEN_REPEATS:.3f} s")
+
+
+def moments():
+    "Print the time of the beam moments of a realization."
+    channel = config.CHANNELS[config.BENCHMARK_CHANNEL]['channel']
+    output = channel.run(pupil=False)
+    result = simulations.BeamResult(channel)
+
+    def separate():
+        for measures in result.measures:
+            measures.iteration_data = measures.operations[0](
+                channel, output=output)
+
+    def fused():
+        beam_moments(abs(output)**2, *channel.grid.get_xy(),
+                     channel.grid.delta**2)
+
+    print(f"Beam moments of '{config.BENCHMARK_CHANNEL}' channel:")
+    for name, evaluate in [('separate', separate), ('fused', fused)]:
+        start_time = time.perf_counter()
+        for _ in range(config.BENCHMARK_ITERATIONS):
+            evaluate()
+        elapsed = time.perf_counter() - start_time
+        print(f"    {name:<8}: "
+              f"{1e3 * elapsed / config.BENCHMARK_ITERATIONS:.1f} ms")
+
+
+def _simulation_rate(**settings) -> float:
+    "The iterations/s of the simulation created with the config settings."
+    defaults = {name: getattr(config, name) for name in settings}
+    try:
+        for name, value in settings.items():
+            setattr(config, name, value)
+        with tempfile.TemporaryDirectory() as results_path:
+            sim = create_simulation(_create_results(
+                Path(results_path), config.BENCHMARK_ITERATIONS))
+            start_time = time.perf_counter()
+            sim.run()
+            elapsed = time.perf_counter() - start_time
+    finally:
+        for name, value in defaults.items():
+            setattr(config, name, value)
+    return config.BENCHMARK_ITERATIONS / elapsed
+
+
+def pipeline():
+    "Print the simulation throughput with the pipelined phase screens."
+    print(f"Pipelined phase screens of '{config.BENCHMARK_CHANNEL}' channel, "
+          f"depth {config.PHASE_SCREEN_PIPELINE_DEPTH}:")
+    for is_pipelined in (False, True):
+        rate = _simulation_rate(
+            SIMULATION_PIPELINED_PHASE_SCREENS=is_pipelined)
+        print(f"    {'pipelined' if is_pipelined else 'sequential':<10}: "
+              f"{rate:.2f} iterations/s")
+
+
+def measures():
+    "Print the simulation throughput against the measures threads."
+    print(f"Parallel measures of '{config.BENCHMARK_CHANNEL}' channel:")
+    for threads in config.BENCHMARK_MEASURE_THREADS:
+        rate = _simulation_rate(SIMULATION_PARALLEL_MEASURES=threads > 1,
+                                MEASURE_THREADS=threads)
+        print(f"    {threads:>3} threads: {rate:.2f} iterations/s")
+
+
+BENCHMARKS = {
+    'batch_size': batch_size,
+    'fft_backend': fft_backend,
+    'propagation': propagation,
+    'phase_screens': phase_screens,
+    'moments': moments,
+    'pipeline': pipeline,
+    'measures': measures,
+}
+
+
+def run(names: List[str]):
+    "Run the benchmarks by their names, all of them if no names are given."
+    for name in names or BENCHMARKS:
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    run(sys.argv[1:])
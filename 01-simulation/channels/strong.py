@@ -3,6 +3,8 @@ from pyatmosphere import (Channel, CirclePupil, GaussianSource,
                           IdenticalPhaseScreensPath, MVKModel,
                           RandLogPolarGrid, RectGrid, SSPhaseScreen)
 
+from lib.scaled_propagation import ScaledPhaseScreensPath
+
 
 strong_inf = Channel(
     grid=RectGrid(resolution=2**12, delta=0.001),
@@ -31,3 +33,35 @@ strong_inf = Channel(
         radius=1.8
         ),
     )
+
+
+# strong_inf on the grids scaled from 1 mm at the source to 2 mm at
+# the receiver (see lib/scaled_propagation.py)
+strong_inf_scaled = Channel(
+    grid=RectGrid(resolution=2**11, delta=0.002),
+        source=GaussianSource(
+        wvl=808e-9,
+        w0=0.06,
+        F0=50e3
+        ),
+    path=ScaledPhaseScreensPath(
+        phase_screen=SSPhaseScreen(
+            model=MVKModel(
+            Cn2=6e-16,
+            l0=1e-3,
+            L0=80,
+            ),
+        f_grid=RandLogPolarGrid(
+            points=2**10,
+            f_min=1 / 80 / 15,
+            f_max=1 / 1e-3 * 2
+            )
+        ),
+        length=50e3,
+        count=30,
+        source_delta=0.001
+        ),
+    pupil=CirclePupil(
+        radius=1.8
+        ),
+    )
@@ -1,13 +1,152 @@
 import numpy as np
 from channels.moderate import moderate_inf, moderate_zap
-from channels.strong import strong_inf
+from channels.strong import strong_inf, strong_inf_scaled
 from channels.weak import weak_inf, weak_zap
 from pyatmosphere import gpu
 
-gpu.config['use_gpu'] = True
+from lib.fft import gpu_available
+
+# simulate on GPU if cupy finds a CUDA device, on CPU otherwise
+gpu.config['use_gpu'] = gpu_available()
 
 DATA_PATH = './data'
 SIMULATION_SAVE_STEP = 500
+# run without the prompts and plots: SIGINT and SIGTERM stop the simulation
+# saving the results, SIGUSR1 writes the summary.json progress file, and
+# the interrupted run exits with the code 75 (see lib/signals.py)
+SIMULATION_HEADLESS = False
+
+# the number of worker processes simulating each channel in parallel
+# (1 - a single-process simulation)
+SIMULATION_PROCESSES = 1
+# the root entropy of the worker random streams (None - a random one)
+SIMULATION_SEED = None
+# simulate all the channels at once sharing SIMULATION_PROCESSES processes
+# between them in proportion to their remaining work
+SIMULATION_CONCURRENT_CHANNELS = False
+# the number of iterations in one shard of the concurrent simulation
+SIMULATION_TASK_ITERATIONS = 2000
+# the memory available for the worker processes in bytes (None - unlimited)
+SIMULATION_MEMORY_LIMIT = None
+
+# the FFT library of the propagation on CPU: 'numpy', 'scipy' (multithreaded),
+# 'pyfftw' (multithreaded with the stored FFTW plans) or 'auto' - pyfftw if
+# installed, scipy otherwise (see lib/fft.py)
+FFT_BACKEND = 'auto'
+# the number of threads of a transform (None - the CPU cores shared between
+# SIMULATION_PROCESSES)
+FFT_WORKERS = None
+# the file of the FFTW plans measured by the first run
+FFT_WISDOM_PATH = './data/fftw_wisdom.pickle'
+# compute the FFTs in the single precision (complex64), which halves their
+# memory, the fields, phase screens and intensities are single precision
+# anyway (check the accuracy with validate_precision.py)
+SIMULATION_SINGLE_PRECISION = False
+
+# propagate with the transfer functions cached for the whole simulation and
+# the work buffers reused by all the steps (see lib/propagation.py),
+# the batched simulation always does
+SIMULATION_CACHED_PROPAGATION = True
+# synthesize the sparse spectrum phase screens as a real matrix product
+# with half the operations (see lib/phase_screens.py), the batched simulation
+# always does
+SIMULATION_FAST_PHASE_SCREENS = True
+# synthesize the sparse spectrum phase screens of a path in a background
+# thread ahead of the propagation (see lib/phase_screens.py), the results are
+# the same
+SIMULATION_PIPELINED_PHASE_SCREENS = False
+# the number of the phase screens synthesized ahead
+PHASE_SCREEN_PIPELINE_DEPTH = 2
+# draw the sparse spectrum phase screens from the banks of the pregenerated
+# ones instead of synthesizing them (see lib/screen_bank.py), fill the banks
+# with generate_screen_bank.py
+SIMULATION_SCREEN_BANK = False
+# the folder of the banks
+SCREEN_BANK_PATH = './data/screen_bank'
+# the number of the phase screens generate_screen_bank.py fills a bank with
+SCREEN_BANK_SIZE = 10000
+# the margin of the stored screens around the grid, the screens are drawn
+# at (SCREEN_BANK_MARGIN + 1)^2 offsets, the draws of a stored screen at
+# the different offsets are correlated
+SCREEN_BANK_MARGIN = 0
+# draw the screens rotated by the right angles and reflected too, 8 draws
+# of a stored screen, which are correlated
+SCREEN_BANK_SYMMETRIES = False
+
+# the number of realizations propagated together as one (B, N, N) stack
+SIMULATION_BATCH_SIZE = 1
+# the memory available for one batch in bytes, caps the batch size
+SIMULATION_BATCH_MEMORY_LIMIT = 2**30
+
+# store the encircled energy profiles of each realization instead of
+# the transmittance through every aperture, the transmittance files are
+# read off the profiles (see lib/encircled_energy.py)
+SIMULATION_ENCIRCLED_ENERGY = False
+# the number of equally spaced profile radiuses (besides the aperture ones)
+ENCIRCLED_ENERGY_POINTS = 256
+ENCIRCLED_ENERGY_DTYPE = 'float32'
+
+# compute the shifted aperture transmittances with the FFT cross-correlation
+# of the intensity with the aperture discs (see lib/aperture_correlation.py),
+# every shifted aperture is applied to the output otherwise; the discs differ
+# from the pixelated pupil masks of the other transmittance results by
+# the pixels along the aperture edge (see tests/test_aperture_correlation.py)
+SHIFTED_APERTURE_CORRELATION = False
+
+# append the new rows of the results to the chunked binary tables on each
+# save instead of rewriting the CSV files (see lib/storage.py), the stored
+# CSV files are moved to the tables, which are converted back to the CSV
+# files with export_csv.py
+SIMULATION_CHUNKED_STORAGE = False
+# 'float64' or 'float32'
+STORAGE_DTYPE = 'float64'
+# store the chunks as compressed .npz files, they are not memory-mapped then
+STORAGE_COMPRESSION = False
+
+# write the results in a background thread while the simulation goes on
+# (see lib/writer.py)
+SIMULATION_BACKGROUND_SAVING = True
+# the number of save steps queued for writing before the simulation waits
+SIMULATION_PENDING_SAVES = 2
+
+# stop the channel simulation before the channel `iterations` once
+# the transmittance distributions of all the apertures converge, checked on
+# each save step (see lib/convergence.py)
+SIMULATION_ADAPTIVE_STOPPING = False
+# the required DKW bound of the transmittance CDF error
+CONVERGENCE_TOLERANCE = 0.005
+# the confidence of the DKW bound
+CONVERGENCE_CONFIDENCE = 0.95
+# or the required DKW bound relative to the KS distance of the best of
+# the lognormal and beta fits (None - not used)
+CONVERGENCE_KS_TOLERANCE = 0.1
+CONVERGENCE_MIN_ITERATIONS = 10000
+# the simulation time limit of a channel in seconds (None - unlimited)
+SIMULATION_TIME_BUDGET = None
+
+# store the row counts of the results, the random state and the aperture
+# shifts on each save, so the continued simulation is the same as
+# an uninterrupted one (see lib/checkpoint.py)
+SIMULATION_CHECKPOINT = True
+
+# compute the intensity and the other quantities of the output shared by
+# the measures once per realization (see lib/field_cache.py)
+SIMULATION_FIELD_CACHE = True
+# evaluate the measures of an iteration in a thread pool after
+# the propagation (see lib/parallel.py), the batched simulation evaluates
+# them as array operations instead
+SIMULATION_PARALLEL_MEASURES = False
+# the number of the measures threads (None - the CPU cores shared between
+# SIMULATION_PROCESSES)
+MEASURE_THREADS = None
+
+# record the time of the simulation stages and measures, the iterations/s
+# and the peak memory to profile.json and profile.csv next to params.json
+# (see lib/profiling.py)
+SIMULATION_PROFILING = False
+# print the profile summary every ... iterations (None - not printed)
+PROFILING_PRINT_STEP = 1000
+
 CHANNELS = {
     'weak_zap': {
         'channel': weak_zap,
@@ -36,6 +175,55 @@ CHANNELS = {
     },
 }
 
+# simulate the channels of a CHANNEL_GROUPS group together through the same
+# phase screens, which are synthesized once and give the paired samples of
+# the channels (see lib/channel_group.py), used by the single-process
+# simulation without batches
+SIMULATION_CHANNEL_GROUPS = False
+# the groups of the channels which differ only in the source
+CHANNEL_GROUPS = [
+    ['weak_zap', 'weak_inf'],
+    ['moderate_zap', 'moderate_inf'],
+]
+
+# simulate_time_series.py parameters: the time series of the channels
+# through the frozen flow turbulence (see lib/frozen_flow.py), stored to
+# the time_series folder of the channel data
+# the (x, y) wind velocities of the phase screens of a path in m/s, a single
+# one for all of them
+TIME_SERIES_WIND = [(10, 0)]
+# the time between the steps of a series, s, the screens are moved fast if
+# the wind carries them by whole grid points in a few steps (see
+# lib/frozen_flow.py)
+TIME_SERIES_TIME_STEP = 1e-4
+# the number of the time steps of a series
+TIME_SERIES_STEPS = 1000
+# the number of the independent series of a channel
+TIME_SERIES_COUNT = 10
+
+# plan_channels.py parameters: the coarsest grids and the fewest phase
+# screens of the channels satisfying the sampling criteria, and
+# the predicted time and memory of the configured and the planned ones
+# (see lib/planner.py)
+# the grid points per the beam radius at the source and at the receiver
+PLANNER_BEAM_POINTS = 20
+# the grid points per the Fried parameter r0 of the whole path
+PLANNER_R0_POINTS = 10
+# the grid points per the smallest aperture radius
+PLANNER_APERTURE_POINTS = 2
+# the grid side in the long-term beam radiuses at the receiver
+PLANNER_BEAM_RADIUSES = 4
+# the largest Rytov variance of the turbulence slab of a phase screen
+PLANNER_SLAB_RYTOV = 0.1
+# the configured grids with more points than the planned ones by this
+# factor are oversampled
+PLANNER_MAX_OVERSAMPLING = 2
+# exit with the code 1 if a configured channel is oversampled or
+# undersampled, only warn otherwise
+PLANNER_STRICT = False
+# the number of the timed repeats of the propagation step
+PLANNER_TIMING_REPEATS = 3
+
 SEMIANALYTICAL_ITERATIONS = 5000
 
 # to determine the beam wandering value
@@ -43,3 +231,41 @@ PRELIMINARY_SIMULATION_ITERATIONS = 1000
 
 # for the numerical total probability models
 R0_VALUES_COUNT = 1000
+
+# benchmark.py parameters
+BENCHMARK_CHANNEL = 'moderate_inf'
+BENCHMARK_ITERATIONS = 64
+BENCHMARK_BATCH_SIZES = [1, 2, 4, 8, 16, 32]
+BENCHMARK_FFT_RESOLUTIONS = [2**9, 2**12]
+BENCHMARK_FFT_REPEATS = 10
+BENCHMARK_PHASE_SCREEN_RESOLUTIONS = [2**9, 2**12]
+BENCHMARK_PHASE_SCREEN_REPEATS = 4
+BENCHMARK_MEASURE_THREADS = [1, 2, 4]
+
+# validate_precision.py parameters
+VALIDATION_ITERATIONS = 1000
+VALIDATION_SEED = 0
+# the largest acceptable two-sample KS distance of the single and double
+# precision transmittance samples and difference of their fits KS distances
+VALIDATION_KS_TOLERANCE = 0.01
+
+# validate_scaled_propagation.py parameters: the channels on the grids scaled
+# along the path (see lib/scaled_propagation.py) by the names of the CHANNELS
+# they can replace once validated
+VALIDATION_SCALED_CHANNELS = {
+    'strong_inf': strong_inf_scaled,
+}
+# the largest acceptable power fraction of the difference of the vacuum
+# output intensity and the Gaussian beam one
+VALIDATION_VACUUM_TOLERANCE = 1e-2
+# the largest acceptable two-sample KS distance of the transmittance samples
+# of the scaled and the replaced channels, about the 1% critical value of
+# VALIDATION_ITERATIONS independent samples
+VALIDATION_SCALED_KS_TOLERANCE = 0.075
+
+# validate_phase_screens.py parameters
+VALIDATION_PHASE_SCREENS = 100
+VALIDATION_PHASE_SCREEN_RESOLUTION = 2**8
+# the largest acceptable relative difference of the structure functions of
+# the fast and pyatmosphere phase screens synthesis
+VALIDATION_SF_TOLERANCE = 1e-3
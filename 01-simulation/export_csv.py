@@ -0,0 +1,33 @@
+"""Convert the chunked tables of the simulated data to the CSV files.
+
+Convert all the channels with `python3 export_csv.py` or the chosen ones with
+`python3 export_csv.py weak_inf ...`. Each `<name>.chunks` table of a result
+is written to the `<name>.csv` file next to it. The encircled energy profiles
+and the shards are not exported, the transmittance files of the profiles are
+written by the simulation and the shards are merged.
+"""
+
+import sys
+from pathlib import Path
+from typing import List
+
+import config
+from lib.encircled_energy import ENCIRCLED_ENERGY_FILE
+from lib.storage import export_csv, stored_tables
+
+
+def run(channel_names: List[str]):
+    "Export the tables of the channels, all of them if no names are given."
+    for channel_name in channel_names or config.CHANNELS:
+        channel_path = Path(config.DATA_PATH) / channel_name
+        for folder in [channel_path, channel_path / 'shifted_aperture']:
+            for path in stored_tables(folder):
+                if path.name == ENCIRCLED_ENERGY_FILE:
+                    continue
+                csv_path = path.with_suffix('.csv')
+                print(f"Exporting {csv_path}...")
+                export_csv(csv_path)
+
+
+if __name__ == "__main__":
+    run(sys.argv[1:])
@@ -0,0 +1,44 @@
+"""Pregeneration of the phase screen banks of the channels.
+
+The banks of the sparse spectrum phase screens of the channels (see
+`lib/screen_bank.py`) are filled up to `config.SCREEN_BANK_SIZE` screens
+extended by `config.SCREEN_BANK_MARGIN`, which the simulation draws with
+`config.SIMULATION_SCREEN_BANK`. The channels of the same phase screens
+statistics share a bank.
+
+Fill the banks of all the channels with `python3 generate_screen_bank.py` or
+of the chosen ones with `python3 generate_screen_bank.py weak_inf ...`.
+"""
+
+import sys
+from typing import Dict, List
+
+import pyatmosphere as pyatm
+
+import config
+from lib.screen_bank import PhaseScreenBank, bank_phase_screen
+
+
+def run(channel_names: List[str]):
+    "Fill the banks of the channels, all of them if no names are given."
+    banks: Dict[str, PhaseScreenBank] = {}
+    for channel_name in channel_names or config.CHANNELS:
+        channel = config.CHANNELS[channel_name]['channel']
+        for phase_screen in getattr(channel.path, 'phase_screens', []):
+            if type(phase_screen) is not pyatm.SSPhaseScreen:
+                continue
+            bank = PhaseScreenBank(config.SCREEN_BANK_PATH, bank_phase_screen(
+                channel, phase_screen, config.SCREEN_BANK_MARGIN))
+            if bank.key not in banks:
+                print(f"'{channel_name}' channel bank: {bank.path}, "
+                      f"{len(bank)} phase screens")
+            banks.setdefault(bank.key, bank)
+    for bank in banks.values():
+        count = config.SCREEN_BANK_SIZE - len(bank)
+        if count > 0:
+            print(f"Generating {count} phase screens to {bank.path}...")
+            bank.generate(count)
+
+
+if __name__ == "__main__":
+    run(sys.argv[1:])
@@ -0,0 +1,127 @@
+"""Transmittance through many shifted circular apertures at once.
+
+The power inside a disc of the radius `a` centered at `c` is the value of
+the cross-correlation of the output intensity with the disc at `c`, so
+the transmittance for all the aperture shifts comes from one FFT
+cross-correlation sampled at the shifted centers. The intensity spectrum of
+a realization is computed once and reused for all the aperture radiuses.
+
+The disc spectrum is the analytical one, `a J_1(2 pi a f) / f`, so
+the correlation is smooth and the sub-pixel shifts are read off it with
+the bicubic (Catmull-Rom) interpolation. Unlike the pixelated pupil mask,
+it does not depend on how the aperture edge falls on the grid.
+"""
+
+from typing import Dict, Hashable, Optional, Sequence
+
+import numpy as np
+import pyatmosphere as pyatm
+from pyatmosphere.gpu import get_xp
+from scipy.fft import next_fast_len
+from scipy.special import j1
+
+from lib import fft
+
+
+def _cubic_weights(xp, t):
+    "Catmull-Rom weights of the -1, 0, 1, 2 neighbours as a (4, ...) array."
+    return xp.stack([(-t**3 + 2 * t**2 - t) / 2,
+                     (3 * t**3 - 5 * t**2 + 2) / 2,
+                     (-3 * t**3 + 4 * t**2 + t) / 2,
+                     (t**3 - t**2) / 2])
+
+
+class ApertureCorrelation:
+    """FFT cross-correlation of the output intensity with aperture discs.
+
+    The intensity is zero padded by the largest disc radius, so
+    the correlation is free of the periodic wrap-around.
+    """
+    def __init__(self, grid: pyatm.RectGrid, radiuses: Sequence[float]):
+        self.grid = grid
+        self.pad = int(np.ceil(max(radiuses) / grid.delta)) + 2
+        resolution_x, resolution_y = grid.resolution
+        self.shape = (next_fast_len(resolution_y + 2 * self.pad),
+                      next_fast_len(resolution_x + 2 * self.pad))
+        self._kernels: Dict[float, object] = {}
+        self._key: Optional[Hashable] = None
+        self._spectrum = None
+
+    def _kernel_spectrum(self, radius: float):
+        "The real spectrum of the disc on the `rfft2` frequency grid."
+        if radius not in self._kernels:
+            f = np.hypot(
+                np.fft.fftfreq(self.shape[0], self.grid.delta)[:, None],
+                np.fft.rfftfreq(self.shape[1], self.grid.delta))
+            f[0, 0] = 1
+            kernel = radius * j1(2 * np.pi * radius * f) / f
+            kernel[0, 0] = np.pi * radius**2
+            self._kernels[radius] = get_xp().asarray(kernel,
+                                                     dtype=np.float32)
+        return self._kernels[radius]
+
+    def _intensity_spectrum(self, intensity, key: Optional[Hashable]):
+        """The intensity spectrum, cached for the same realization key.
+
+        The cached spectrum is a copy, the FFT backend may return a buffer
+        reused by its next transform.
+        """
+        if key is None or key != self._key:
+            self._spectrum = fft.rfft2(intensity, s=self.shape).copy()
+            self._key = key
+        return self._spectrum
+
+    def transmittance(self, intensity, radius: float, shift_x, shift_y,
+                      key: Optional[Hashable] = None):
+        """Return the power inside the shifted apertures.
+
+        Args:
+            intensity: an (..., N, N) array of the output intensities
+            radius: the aperture radius
+            shift_x: an (..., shifts) array of the aperture centers
+            shift_y: an (..., shifts) array of the aperture centers,
+                     both in the `pyatmosphere.CirclePupil` convention
+            key: identifies the realization for the intensity spectrum
+                 reuse, the spectrum is recomputed if None
+
+        Returns:
+            an (..., shifts) array
+        """
+        xp = get_xp()
+        spectrum = self._intensity_spectrum(intensity, key)
+        correlation = fft.irfft2(spectrum * self._kernel_spectrum(radius),
+                                 s=self.shape)
+        correlation = correlation.reshape(-1, *self.shape)
+
+        shift_x = xp.asarray(shift_x, dtype=float)
+        shift_y = xp.asarray(shift_y, dtype=float)
+        result_shape = shift_x.shape
+        columns = (shift_x.reshape(len(correlation), -1) / self.grid.delta -
+                   self.grid._left_bound)
+        rows = (-shift_y.reshape(len(correlation), -1) / self.grid.delta -
+                self.grid._top_bound)
+        realizations = xp.arange(len(correlation))[:, None]
+
+        column_0 = xp.floor(columns)
+        row_0 = xp.floor(rows)
+        column_weights = _cubic_weights(xp, columns - column_0)
+        row_weights = _cubic_weights(xp, rows - row_0)
+        column_0 = column_0.astype(int)
+        row_0 = row_0.astype(int)
+
+        power = xp.zeros(columns.shape)
+        for i in range(4):
+            for j in range(4):
+                power += (row_weights[i] * column_weights[j] * correlation[
+                    realizations, (row_0 + i - 1) % self.shape[0],
+                    (column_0 + j - 1) % self.shape[1]])
+
+        # The apertures beyond the padded area do not overlap the grid
+        resolution_x, resolution_y = self.grid.resolution
+        margin = self.pad - 2
+        is_outside = ((columns < -margin) |
+                      (columns > resolution_x + margin - 1) |
+                      (rows < -margin) |
+                      (rows > resolution_y + margin - 1))
+        power[is_outside] = 0
+        return power.reshape(result_shape)
@@ -0,0 +1,313 @@
+"""Batched simulation of several turbulence realizations at once.
+
+`BatchedSimulation` propagates a (B, N, N) stack of independent realizations
+through the channel with batched phase screens synthesis and FFTs, and
+evaluates the measures of the known results (`BeamResult`, `PDTResult`,
+`TrackedPDTResult`, `ShiftedTrackedPDTResult` and their chunked storage
+variants) for the whole stack with vectorized kernels. The measures of
+the other results are evaluated for each realization one by one.
+"""
+
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pyatmosphere as pyatm
+from pyatmosphere.gpu import get_xp
+
+from lib import fft
+from lib.beam_moments import FusedBeamResult, beam_moments
+from lib.encircled_energy import EncircledEnergyResult
+from lib.field_cache import TrackedPDTResult
+from lib.phase_screens import draw_spectra, synthesize
+from lib.propagation import get_propagator, release_propagator
+from lib.shifted_aperture import ShiftedTrackedPDTResult
+from lib.storage import (ChunkedBeamResult, ChunkedPDTResult,
+                         ChunkedShiftedTrackedPDTResult,
+                         ChunkedTrackedPDTResult)
+
+# The bytes per pixel of the largest temporaries of the measures of
+# a realization: the float32 squared distances and the two int64 circle
+# indexes of `BatchIntensity.encircled_power`, more than the distances,
+# the bool mask and the weighted intensity of `BatchIntensity.pupil_power`
+MEASURE_TEMPORARIES_SIZE = 20
+
+
+def realization_memory(channel: pyatm.Channel) -> int:
+    """Estimate the memory required by one realization of a batch in bytes.
+
+    It counts the complex64 field, phase and output buffers of
+    the propagation, two FFT temporaries in the precision of the FFT backend,
+    the phase screen and the intensity, the plane wave matrices of
+    the sparse spectrum phase screens synthesis, and the temporaries of
+    the measures (`MEASURE_TEMPORARIES_SIZE`).
+    """
+    resolution_x, resolution_y = channel.grid.resolution
+    points = getattr(channel.path.phase_screen, 'f_grid', None)
+    points = points.points if points else 0
+    fft_itemsize = fft.transform_dtype().itemsize
+    return ((32 + 2 * fft_itemsize + MEASURE_TEMPORARIES_SIZE) *
+            resolution_x * resolution_y +
+            16 * points * (resolution_x + resolution_y))
+
+
+def get_batch_size(channel: pyatm.Channel, batch_size: int,
+                   memory_limit: Optional[int] = None) -> int:
+    "Cap the batch size with the memory limit."
+    if not memory_limit:
+        return batch_size
+    return max(1, min(batch_size, memory_limit // realization_memory(channel)))
+
+
+def generate_phase_screens(phase_screen: pyatm.PhaseScreen, batch_size: int):
+    "Generate a (B, N, N) stack of independent phase screens."
+    if not isinstance(phase_screen, pyatm.SSPhaseScreen):
+        xp = get_xp()
+        return xp.stack([phase_screen.generate()
+                         for _ in range(batch_size)])
+    return synthesize(*draw_spectra(phase_screen, batch_size))
+
+
+def propagate(channel: pyatm.Channel, batch_size: int,
+              generate: Callable = generate_phase_screens):
+    """Return a (B, N, N) stack of the channel outputs without the pupil.
+
+    The phase screens stacks are synthesized by `generate(phase_screen,
+    batch_size)`.
+    """
+    steps = get_propagator(channel).steps(
+        get_xp().asarray(channel.source.output()),
+        (batch_size, *channel.grid.shape[::-1]),
+        lambda phase_screen: generate(phase_screen, batch_size))
+    while True:
+        try:
+            next(steps)
+        except StopIteration as stop:
+            return stop.value
+
+
+class BatchIntensity:
+    "A stack of output intensities with the grid quantities of the channel."
+    def __init__(self, channel: pyatm.Channel, output):
+        xp = get_xp()
+        self.xp = xp
+        self.intensity = abs(output)**2
+        self.x = channel.grid.get_x()
+        self.y = channel.grid.get_y()
+        self.delta2 = channel.grid.delta**2
+
+    def moment(self, weight):
+        "Integrate the intensity with the weight over each realization."
+        return (self.intensity * weight).sum(axis=(-1, -2)) * self.delta2
+
+    def _distance2(self, shift_x, shift_y):
+        "Squared distances to the shifted centers as a (B, N, N) array."
+        xp = self.xp
+        batch_size = self.intensity.shape[0]
+        shift_x = xp.broadcast_to(xp.asarray(shift_x, dtype=self.x.dtype),
+                                  (batch_size,))
+        shift_y = xp.broadcast_to(xp.asarray(shift_y, dtype=self.y.dtype),
+                                  (batch_size,))
+        return ((self.x[None] - shift_x[:, None, None])**2 +
+                (self.y[None] + shift_y[:, None, None])**2)
+
+    def pupil_power(self, radius: float, shift_x=0, shift_y=0):
+        "Return the power in the circle of the radius for each realization."
+        pupil = self._distance2(shift_x, shift_y) <= radius**2
+        return self.moment(pupil)
+
+    def encircled_power(self, radiuses: List[float], shift_x=0, shift_y=0):
+        """Return the power in the circles of the radiuses for each
+        realization as a (B, radiuses) array.
+
+        The shifts are given in the `pyatmosphere.CirclePupil` convention
+        and can be (B,) arrays.
+        """
+        xp = self.xp
+        batch_size = self.intensity.shape[0]
+        distance2 = self._distance2(shift_x, shift_y)
+        order = np.argsort(radiuses)
+        radiuses2 = xp.asarray(np.asarray(radiuses)[order]**2,
+                               dtype=distance2.dtype)
+
+        # A pixel is inside all the circles starting from `index`
+        index = xp.searchsorted(radiuses2, distance2.ravel(), side='left')
+        index = index.reshape(batch_size, -1) + \
+            (len(radiuses) + 1) * xp.arange(batch_size)[:, None]
+        power = xp.bincount(
+            index.ravel(), weights=self.intensity.ravel(),
+            minlength=batch_size * (len(radiuses) + 1)
+            ).reshape(batch_size, -1)[:, :-1]
+        power = xp.cumsum(power, axis=1) * self.delta2
+        result = xp.empty_like(power)
+        result[:, xp.asarray(order)] = power
+        return result
+
+
+def _beam_columns(result: pyatm.simulations.BeamResult,
+                  batch: BatchIntensity) -> List:
+    return list(beam_moments(batch.intensity, batch.x, batch.y,
+                             batch.delta2))
+
+
+def _pdt_columns(result: pyatm.simulations.PDTResult,
+                 batch: BatchIntensity) -> List:
+    power = batch.encircled_power(
+        [pupil.radius for pupil in result.pupils], *result.pupil_shift)
+    return list(power.T)
+
+
+def _tracked_pdt_columns(result: pyatm.simulations.TrackedPDTResult,
+                         batch: BatchIntensity) -> List:
+    mean_x = batch.moment(batch.x)
+    mean_y = batch.moment(-batch.y)
+    power = batch.encircled_power(
+        [pupil.radius for pupil in result.pupils], mean_x, mean_y)
+    return [mean_x, mean_y, *power.T]
+
+
+def _shifted_tracked_pdt_columns(result: ShiftedTrackedPDTResult,
+                                 batch: BatchIntensity) -> List:
+    mean_x = batch.moment(batch.x)
+    mean_y = batch.moment(-batch.y)
+    radius = (result.aperture or result.channel.pupil).radius
+    shifts = batch.xp.asarray(result.aperture_shifts, dtype=float)
+    shift_x = mean_x[:, None] + shifts[None, :, 0]
+    shift_y = mean_y[:, None] + shifts[None, :, 1]
+    if result.correlation:
+        power = result.correlation.transmittance(
+            batch.intensity, radius, shift_x, shift_y, key=batch)
+    else:
+        power = batch.xp.stack([
+            batch.pupil_power(radius, shift_x[:, i], shift_y[:, i])
+            for i in range(len(shifts))], axis=1)
+    return [mean_x, mean_y, power]
+
+
+def _encircled_energy_columns(result: EncircledEnergyResult,
+                              batch: BatchIntensity) -> List:
+    mean_x = batch.moment(batch.x)
+    mean_y = batch.moment(-batch.y)
+    return [mean_x, mean_y,
+            batch.encircled_power(result.radiuses),
+            batch.encircled_power(result.radiuses, mean_x, mean_y)]
+
+
+def _crossed(step: Optional[int], start: int, stop: int) -> Optional[int]:
+    "Return the step if one of its multiples is in the (start, stop] range."
+    return step if step and stop // step > start // step else None
+
+
+BATCHED_RESULTS: Dict[type, Callable] = {
+    pyatm.simulations.BeamResult: _beam_columns,
+    FusedBeamResult: _beam_columns,
+    pyatm.simulations.PDTResult: _pdt_columns,
+    pyatm.simulations.TrackedPDTResult: _tracked_pdt_columns,
+    TrackedPDTResult: _tracked_pdt_columns,
+    ShiftedTrackedPDTResult: _shifted_tracked_pdt_columns,
+    EncircledEnergyResult: _encircled_energy_columns,
+    ChunkedBeamResult: _beam_columns,
+    ChunkedPDTResult: _pdt_columns,
+    ChunkedTrackedPDTResult: _tracked_pdt_columns,
+    ChunkedShiftedTrackedPDTResult: _shifted_tracked_pdt_columns,
+}
+
+
+class BatchedSimulation(pyatm.simulations.Simulation):
+    """Simulation of `batch_size` realizations per iteration.
+
+    Only the "atmosphere" measures of a single channel are supported.
+    """
+    def __init__(self, results_list: List[pyatm.simulations.Result],
+                 batch_size: int, memory_limit: Optional[int] = None):
+        super().__init__(results_list)
+        channels = list(self.measures)
+        if len(channels) != 1:
+            raise ValueError("Batched simulation supports a single channel")
+        self.channel = channels[0]
+        for measures in self.flattened_measures():
+            if measures.measure_type != "atmosphere" or measures.time:
+                raise ValueError("Batched simulation supports only "
+                                 "'atmosphere' measures without time")
+        self.batch_size = get_batch_size(self.channel, batch_size,
+                                         memory_limit)
+
+    def _remaining(self) -> int:
+        return max((measures.max_size - len(measures)
+                    for measures in self.flattened_measures()
+                    if measures.max_size is not None), default=0)
+
+    def _append_columns(self, result: pyatm.simulations.Result, columns):
+        for measures, column in zip(result.measures, columns):
+            if measures.is_done:
+                continue
+            column = pyatm.gpu.get_array(column)
+            size = len(column)
+            if measures.max_size is not None:
+                size = min(size, measures.max_size - len(measures))
+            column = column[:size]
+            measures.data.extend(column.tolist() if column.ndim == 1
+                                 else list(column))
+
+    def _process_realizations(self, result: pyatm.simulations.Result,
+                              outputs):
+        "Evaluate the measures of the result for each realization."
+        operations_measures: Dict = {}
+        for measures in result.measures:
+            operations_measures.setdefault(measures.operations,
+                                           []).append(measures)
+        columns = [[] for _ in result.measures]
+        for output in outputs:
+            self.init_measures_iteration_data()
+            self.process_operations(output, operations_measures, 0)
+            for column, measures in zip(columns, result.measures):
+                column.append(measures.iteration_data)
+        return [np.asarray(column) for column in columns]
+
+    def generate_phase_screens(self, phase_screen: pyatm.PhaseScreen,
+                               batch_size: int):
+        return generate_phase_screens(phase_screen, batch_size)
+
+    def propagate(self, batch_size: int):
+        return propagate(self.channel, batch_size,
+                         self.generate_phase_screens)
+
+    def result_columns(self, result: pyatm.simulations.Result,
+                       batch: BatchIntensity, outputs) -> List:
+        "Evaluate the measures of the result for the batch."
+        columns_function = BATCHED_RESULTS.get(type(result))
+        if columns_function:
+            return columns_function(result, batch)
+        return self._process_realizations(result, outputs)
+
+    def iter(self):
+        batch_size = min(self.batch_size, self._remaining())
+        if batch_size <= 0:
+            return
+        outputs = self.propagate(batch_size)
+        batch = BatchIntensity(self.channel, outputs)
+        for result in self.results_list:
+            if self.is_measures_done(result.measures):
+                continue
+            self._append_columns(
+                result, self.result_columns(result, batch, outputs))
+
+    def run(self, *args, plot_step: int = None, save_step: int = None,
+            **kwargs):
+        "Run the simulation, the steps are given in realizations."
+        try:
+            iteration = 0
+            while not self.is_measures_done():
+                previous_iteration = iteration
+                self.iter()
+                iteration += self.batch_size
+                self.process_output(
+                    0,
+                    plot_step=_crossed(plot_step, previous_iteration,
+                                       iteration),
+                    save_step=_crossed(save_step, previous_iteration,
+                                       iteration))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.process_output(0, plot_step=plot_step, save_step=save_step)
+            release_propagator(self.channel)
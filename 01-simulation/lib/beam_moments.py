@@ -0,0 +1,97 @@
+"""Single-pass beam moments of the output intensity.
+
+`pyatmosphere.simulations.BeamResult` integrates the intensity with x, y,
+x^2, x y, y^2 and the squared rotated coordinate, a full pass over the grid
+for each moment. The weights are separable, so the moments are sums of
+the row marginals of the intensity
+
+    I @ [1, x, x^2]
+
+which one matrix product computes in one pass over the intensity: the row
+power, the first and the second x moments of every row. The x moments are
+their sums, and the y and the cross moments are their products with the y
+coordinates. `beam_moments` computes all the `BeamResult` measures from
+them. The measures of `FusedBeamResult` share one operation, which
+the simulation evaluates once per realization, and each of them takes its
+moment from the moments it returns.
+"""
+
+from typing import Tuple
+
+import pyatmosphere as pyatm
+from pyatmosphere.gpu import get_xp
+
+from lib import field_cache
+
+BEAM_MOMENTS = ('mean_x', 'mean_y', 'mean_x2', 'mean_xy', 'mean_y2',
+                'mean_x2_r')
+
+
+def beam_moments(intensity, x, y, delta2: float) -> Tuple:
+    """The `BeamResult` measures of the intensities.
+
+    Args:
+        intensity: an (..., Ny, Nx) array of the intensities
+        x: a (1, Nx) array of the grid coordinates
+        y: an (Ny, 1) array of the grid coordinates
+        delta2: the squared grid step
+
+    Returns:
+        the (...) arrays of the `BEAM_MOMENTS`
+    """
+    xp = get_xp()
+    x = x.ravel()
+    # The y axis of the measures points up
+    y = -y.ravel()
+    weights = xp.stack([xp.ones_like(x), x, x**2], axis=1)
+    rows = intensity @ weights
+    row_power, row_x, row_x2 = rows[..., 0], rows[..., 1], rows[..., 2]
+    mean_x = row_x.sum(axis=-1) * delta2
+    mean_y = (row_power @ y) * delta2
+    mean_x2 = row_x2.sum(axis=-1) * delta2
+    mean_xy = (row_x @ y) * delta2
+    mean_y2 = (row_power @ y**2) * delta2
+    r0 = xp.sqrt(mean_x**2 + mean_y**2)
+    cos_xi = mean_x / r0
+    sin_xi = mean_y / r0
+    mean_x2_r = (cos_xi**2 * mean_x2 + sin_xi**2 * mean_y2 +
+                 2 * cos_xi * sin_xi * mean_xy)
+    return mean_x, mean_y, mean_x2, mean_xy, mean_y2, mean_x2_r
+
+
+class MomentMeasure(pyatm.simulations.Measure):
+    """`pyatmosphere.simulations.Measure` of one of the `BEAM_MOMENTS`
+    returned by its operation.
+    """
+    def __init__(self, *args, moment: str, **kwargs):
+        self._moments = None
+        super().__init__(*args, name=moment, **kwargs)
+        self.index = BEAM_MOMENTS.index(moment)
+
+    @property
+    def iteration_data(self):
+        if self._moments is None:
+            return None
+        return self._moments[self.index]
+
+    @iteration_data.setter
+    def iteration_data(self, moments):
+        self._moments = moments
+
+
+class FusedBeamResult(pyatm.simulations.BeamResult):
+    """`pyatmosphere.simulations.BeamResult` with the measures evaluated by
+    `beam_moments`.
+    """
+    def __init__(self, channel: pyatm.Channel, **kwargs):
+        # The measures of `BeamResult.__init__` are replaced
+        pyatm.simulations.Result.__init__(self, channel, [
+            MomentMeasure(channel, "atmosphere", self.moments, moment=name)
+            for name in BEAM_MOMENTS], **kwargs)
+
+    def moments(self, channel: pyatm.Channel, output) -> Tuple:
+        "The `BEAM_MOMENTS` of the output."
+        return tuple(moment.item() for moment in beam_moments(
+            field_cache.intensity(channel, output),
+            *field_cache.coordinates(channel, output),
+            channel.grid.delta**2))
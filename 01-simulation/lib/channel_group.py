@@ -0,0 +1,122 @@
+"""Channels simulated through the same turbulence realizations.
+
+The channels which differ only in the source, like `weak_inf` and
+`weak_zap`, have the same phase screens statistics. Simulated together,
+they can be propagated through the same phase screens: `SharedPhaseScreens`
+generates the phase screens of the first channel of such a group, and
+the other channels of the group reuse them in the same iteration. The phase
+screens are synthesized once for all the channels of the group, and
+the samples of the channels are paired, so the differences between them are
+not blurred by the independent turbulence.
+
+The reused phase screens of an iteration are copied, which takes
+the memory of all the phase screens of a path.
+"""
+
+from functools import partial
+from typing import Dict, List, Sequence, Tuple
+
+import pyatmosphere as pyatm
+
+
+def _parameters(obj) -> Tuple:
+    "The type and the scalar attributes of the object."
+    return (type(obj), *sorted(
+        (name, value) for name, value in vars(obj).items()
+        if isinstance(value, (bool, int, float, str))))
+
+
+def turbulence_key(channel: pyatm.Channel) -> Tuple:
+    "The parameters of the channel the phase screens depend on."
+    path = channel.path
+    return (
+        type(path), path.length, tuple(path.positions),
+        channel.grid.resolution, channel.grid.delta,
+        getattr(path, 'source_delta', None), channel.source.wvl,
+        tuple((type(phase_screen), phase_screen.thickness,
+               _parameters(phase_screen.model),
+               _parameters(phase_screen.f_grid))
+              for phase_screen in getattr(path, 'phase_screens', [])))
+
+
+def group_channels(
+        channels: Sequence[pyatm.Channel]) -> List[List[pyatm.Channel]]:
+    "Group the channels with the same phase screens keeping their order."
+    groups: Dict[Tuple, List[pyatm.Channel]] = {}
+    for channel in channels:
+        if getattr(channel.path, 'phase_screens', None):
+            groups.setdefault(turbulence_key(channel), []).append(channel)
+    return list(groups.values())
+
+
+def channel_groups(channel_names: Sequence[str],
+                   groups: Sequence[Sequence[str]],
+                   channels: Dict[str, pyatm.Channel]) -> List[List[str]]:
+    """Split the channels into the groups simulated together.
+
+    Args:
+        channel_names: the names of the simulated channels
+        groups: the configured groups of the channel names
+        channels: the channels by their names
+
+    Returns:
+        the groups of the channels in the `channel_names` order, a group
+        for every channel not in the configured groups
+    """
+    group_of: Dict[str, int] = {}
+    for i, group in enumerate(groups):
+        names = [name for name in group if name in channel_names]
+        keys = {turbulence_key(channels[name]) for name in names}
+        if len(keys) > 1:
+            raise ValueError(f"The channels {names} have different "
+                             "phase screens and can not be grouped")
+        group_of.update((name, i) for name in names)
+    result: Dict[object, List[str]] = {}
+    for name in channel_names:
+        result.setdefault(group_of.get(name, name), []).append(name)
+    return list(result.values())
+
+
+def _record(screens: Dict, index: int, generate, *args, **kwargs):
+    screen = generate(*args, **kwargs)
+    # The phase screen may be overwritten by the next one
+    screens[index] = (args, kwargs, screen.copy())
+    return screen
+
+
+def _reuse(screens: Dict, index: int, generate, *args, **kwargs):
+    screen_args, screen_kwargs, screen = screens.get(index, (None,) * 3)
+    if screen is None or (args, kwargs) != (screen_args, screen_kwargs):
+        return generate(*args, **kwargs)
+    return screen
+
+
+class SharedPhaseScreens:
+    """Mixin of `pyatmosphere.simulations.Simulation` propagating
+    the channels with the same phase screens statistics through
+    the phase screens of the first of them.
+    """
+    def run(self, *args, **kwargs):
+        # The phase screens and their own `generate_phase_screen`
+        patched = []
+        for leader, *followers in group_channels(list(self.measures)):
+            if not followers:
+                continue
+            # The phase screens of the iteration by their indexes
+            screens: Dict[int, Tuple] = {}
+            for channel, share in [(leader, _record),
+                                   *[(follower, _reuse)
+                                     for follower in followers]]:
+                for i, phase_screen in enumerate(channel.path.phase_screens):
+                    patched.append((phase_screen, vars(phase_screen).get(
+                        'generate_phase_screen')))
+                    phase_screen.generate_phase_screen = partial(
+                        share, screens, i, phase_screen.generate_phase_screen)
+        try:
+            super().run(*args, **kwargs)
+        finally:
+            for phase_screen, generate in reversed(patched):
+                if generate is None:
+                    del phase_screen.generate_phase_screen
+                else:
+                    phase_screen.generate_phase_screen = generate
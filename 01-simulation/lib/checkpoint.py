@@ -0,0 +1,228 @@
+"""Exact checkpoints of the channel simulations.
+
+On each save the `Checkpoint` result writes the `checkpoint.json` file next
+to the results with the number of the stored rows of every result, the state
+of the numpy random generator, the aperture radiuses and shifts and
+the channel parameters. It is written after the results, so it never counts
+the rows which are not stored.
+
+On resume the results loaded with more rows than the checkpoint counts are
+truncated to them, and the random state is restored when the simulation
+starts, so the continued simulation produces the same realizations as
+an uninterrupted one. `Checkpointing` rolls back the iteration interrupted by
+`KeyboardInterrupt`, so the checkpoint written on interruption is exact too.
+The row counts of the checkpoint are read instead of counting the rows of
+the stored files.
+
+The random state of cupy is not stored, so on GPU the continued simulation
+is only statistically equivalent to an uninterrupted one.
+"""
+
+import json
+import os
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pyatmosphere as pyatm
+
+from lib.shifted_aperture import ApertureShifts
+from lib.storage import count_rows
+
+CHECKPOINT_FILE = 'checkpoint.json'
+
+
+def channel_parameters(channel: pyatm.Channel) -> Dict:
+    "The parameters of the channel stored with the results."
+    return {
+        "source": {"W0": channel.source.w0,
+                   "wvl": channel.source.wvl,
+                   "F0": channel.source.F0},
+        "path": {"Cn2": channel.path.phase_screen.model.Cn2,
+                 "l0": channel.path.phase_screen.model.l0,
+                 "L0": channel.path.phase_screen.model.L0,
+                 "length": channel.path.length},
+        "aperture": {"radius": channel.pupil.radius},
+    }
+
+
+def get_random_state() -> Dict:
+    "The state of the global numpy random generator as a JSON object."
+    state = np.random.get_state(legacy=False)
+    state['state']['key'] = state['state']['key'].tolist()
+    return state
+
+
+def set_random_state(state: Dict):
+    state = dict(state, state=dict(
+        state['state'], key=np.asarray(state['state']['key'],
+                                       dtype=np.uint32)))
+    np.random.set_state(state)
+
+
+def _write_json(data: Dict, path: Path):
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(data, file, indent=4)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(folder: Path) -> Dict:
+    "Load the checkpoint stored in the folder, an empty one if there is none."
+    try:
+        with open(Path(folder) / CHECKPOINT_FILE, 'r',
+                  encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def stored_rows(folder: Path, name: str) -> int:
+    """Return the number of the stored rows of the result stored in the
+    `name` file of the folder.
+    """
+    rows = load_checkpoint(folder).get('rows', {})
+    if name in rows:
+        return rows[name]
+    return count_rows(Path(folder) / name)
+
+
+def truncate_result(result: pyatm.simulations.Result, rows: int):
+    "Drop the rows of the result after the first `rows` ones."
+    for measures in result.measures:
+        del measures.data[rows:]
+    if hasattr(result, 'truncate_output'):
+        result.truncate_output(rows)
+
+
+class Checkpoint(pyatm.simulations.Result):
+    """A result without measures, which stores the checkpoint of
+    the `results` in the `save_path` JSON file.
+
+    Args:
+        channel: the simulated channel
+        results: the results of the simulation
+        aperture_radiuses: list of aperture radiuses
+        aperture_shifts: list of r_0 values for
+                         the numerical total probability PDT models
+    """
+    def __init__(self,
+                 channel: pyatm.Channel,
+                 results: List[pyatm.simulations.Result],
+                 aperture_radiuses: List[float],
+                 aperture_shifts: ApertureShifts,
+                 **kwargs):
+        self.results = results
+        self.aperture_radiuses = list(aperture_radiuses)
+        self.aperture_shifts = [list(shift) for shift in aperture_shifts]
+        # The random state to be restored on start
+        self.random_state: Optional[Dict] = None
+        super().__init__(channel, [], **kwargs)
+
+    def _named_results(self) -> Iterator[Tuple[str,
+                                               pyatm.simulations.Result]]:
+        folder = Path(self.save_path).parent
+        for result in self.results:
+            if result.measures and result.save_path:
+                yield (Path(result.save_path).relative_to(folder).as_posix(),
+                       result)
+
+    def rows(self) -> Dict[str, int]:
+        return {name: min(len(measures) for measures in result.measures)
+                for name, result in self._named_results()}
+
+    def report(self) -> Dict:
+        return {
+            'rows': self.rows(),
+            'random_state': get_random_state(),
+            'aperture_radiuses': self.aperture_radiuses,
+            'aperture_shifts': self.aperture_shifts,
+            'channel': channel_parameters(self.channel),
+        }
+
+    def restore(self):
+        "Restore the random state of the loaded checkpoint once."
+        if self.random_state is not None:
+            set_random_state(self.random_state)
+            self.random_state = None
+
+    def snapshot_output(self) -> Optional[Callable[[], None]]:
+        if not self.save_path:
+            return None
+        return partial(_write_json, self.report(), Path(self.save_path))
+
+    def save_output(self):
+        write = self.snapshot_output()
+        if write:
+            write()
+
+    def load_output(self):
+        checkpoint = load_checkpoint(Path(self.save_path).parent)
+        if not checkpoint:
+            raise FileNotFoundError(self.save_path)
+        is_exact = True
+        for name, result in self._named_results():
+            rows = checkpoint['rows'].get(name, 0)
+            loaded_rows = min(len(measures) for measures in result.measures)
+            if loaded_rows > rows:
+                truncate_result(result, rows)
+            elif loaded_rows < rows:
+                is_exact = False
+        if is_exact:
+            self.random_state = checkpoint['random_state']
+        else:
+            print(f"The results are behind the {self.save_path} checkpoint, "
+                  "the random state is not restored")
+
+    def print_output(self):
+        print(f"Checkpoint of {sum(self.rows().values())} rows")
+
+
+def merge_checkpoints(paths: List[Path], merged_path: Path):
+    """Sum up the rows of the shard checkpoints.
+
+    The merged checkpoint has no random state, each shard continues its own
+    random stream.
+    """
+    checkpoints = [checkpoint for checkpoint in
+                   (load_checkpoint(Path(path).parent) for path in paths)
+                   if checkpoint]
+    if not checkpoints:
+        return
+    rows: Dict[str, int] = {}
+    for checkpoint in checkpoints:
+        for name, count in checkpoint['rows'].items():
+            rows[name] = rows.get(name, 0) + count
+    # The shifts are chosen after the first rows of the first shard
+    last = max(checkpoints,
+               key=lambda checkpoint: len(checkpoint['aperture_shifts']))
+    _write_json({**last, 'rows': rows, 'random_state': None}, merged_path)
+
+
+class Checkpointing:
+    """Mixin of `pyatmosphere.simulations.Simulation` rolling back
+    the iteration interrupted by `KeyboardInterrupt` and restoring the random
+    state of the `Checkpoint` of the results on start.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkpoint = next(
+            (result for result in self.results_list
+             if isinstance(result, Checkpoint)), None)
+
+    def iter(self):
+        lengths = [len(measures) for measures in self.flattened_measures()]
+        state = np.random.get_state()
+        try:
+            super().iter()
+        except KeyboardInterrupt:
+            for measures, length in zip(self.flattened_measures(), lengths):
+                del measures.data[length:]
+            np.random.set_state(state)
+            raise
+
+    def run(self, *args, **kwargs):
+        if self.checkpoint is not None:
+            self.checkpoint.restore()
+        super().run(*args, **kwargs)
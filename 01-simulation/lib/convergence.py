@@ -0,0 +1,267 @@
+"""Adaptive stopping of the channel simulation.
+
+The channel `iterations` become the upper limit: `ConvergenceMonitor` checks
+the transmittance distributions on each save step and stops the simulation
+of the beam and transmittance results once every aperture has converged or
+the time budget is spent.
+
+The error of the empirical transmittance CDF is bounded by the
+Dvoretzky-Kiefer-Wolfowitz inequality, `sup |F_n - F| <= eps` with
+the confidence `1 - 2 exp(-2 n eps^2)`. An aperture has converged when
+the bound is below the absolute tolerance or below the relative tolerance
+of the Kolmogorov-Smirnov distance of the best of the lognormal and beta
+fits, i.e. when the KS values the models are compared by are resolved.
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pyatmosphere as pyatm
+from scipy.stats import beta, lognorm
+
+from lib.encircled_energy import EncircledEnergyResult
+from lib.shifted_aperture import ShiftedTrackedPDTResult
+
+CONVERGENCE_FILE = 'convergence.json'
+
+
+def dkw_bound(iterations: int, confidence: float) -> float:
+    "The half-width of the DKW confidence band of the empirical CDF."
+    if not iterations:
+        return math.inf
+    return math.sqrt(math.log(2 / (1 - confidence)) / (2 * iterations))
+
+
+def _ks_distance(samples: np.ndarray, cdf: np.ndarray) -> float:
+    "KS distance of the sorted samples to the model CDF at the samples."
+    n = len(samples)
+    return max(np.max(np.arange(1, n + 1) / n - cdf),
+               np.max(cdf - np.arange(n) / n))
+
+
+def fits_ks_distance(transmittance: np.ndarray) -> float:
+    """Return the smallest KS distance of the lognormal and beta models
+    with the sample moments of the transmittance.
+    """
+    samples = np.sort(transmittance)
+    eta_mean = samples.mean()
+    eta2_mean = (samples**2).mean()
+    eta_std2 = eta2_mean - eta_mean**2
+    if eta_std2 <= 0 or not 0 < eta_mean < 1:
+        return 0
+    sigma = np.sqrt(np.log(eta2_mean / eta_mean**2))
+    lognorm_model = lognorm(sigma, scale=eta_mean**2 / np.sqrt(eta2_mean))
+    distances = [_ks_distance(samples, np.minimum(
+        lognorm_model.cdf(samples) / lognorm_model.cdf(1), 1))]
+    beta_a = (eta_mean**2 - eta_mean**3 - eta_mean * eta_std2) / eta_std2
+    if beta_a > 0:
+        beta_b = beta_a * (1 / eta_mean - 1)
+        distances.append(_ks_distance(samples,
+                                      beta.cdf(samples, beta_a, beta_b)))
+    return min(distances)
+
+
+def result_transmittance(
+        result: pyatm.simulations.Result) -> Dict[str, np.ndarray]:
+    "The transmittance samples of the result by the aperture names."
+    if isinstance(result, EncircledEnergyResult):
+        return {
+            f"{prefix}{radius}": column
+            for prefix, tracked in [('', False), ('tracked_', True)]
+            for radius, column in zip(
+                result.aperture_radiuses,
+                result.transmittance(result.aperture_radiuses, tracked).T)}
+    if isinstance(result, pyatm.simulations.TrackedPDTResult):
+        return {f"tracked_{measures.name}": np.asarray(measures.data)
+                for measures in result.measures[2:]}
+    if isinstance(result, pyatm.simulations.PDTResult):
+        return {f"{measures.name}": np.asarray(measures.data)
+                for measures in result.measures}
+    return {}
+
+
+class ConvergenceMonitor(pyatm.simulations.Result):
+    """A result without measures, which stops the simulation of
+    the `results` on convergence.
+
+    The convergence and the elapsed time are stored in the `save_path` JSON
+    file, so the time budget holds over the continued simulations.
+    The snapshot of the monitor copies the transmittance samples, and
+    the convergence of the copies is checked with the writing of the file,
+    in the background with `lib.writer.BackgroundSaving`. The check only
+    requests the stop, the results are stopped by `sync_output` on
+    the simulation thread between the iterations.
+
+    Args:
+        channel: the simulated channel
+        results: the results of the simulation
+        tolerance: the absolute tolerance of the transmittance CDF
+        confidence: the confidence of the DKW bound
+        ks_tolerance: the relative tolerance of the KS distance of the fits,
+                      not used if None
+        min_iterations: the number of iterations before the first check
+        time_budget: the simulation time limit in seconds, unlimited if None
+        shards: the number of the shards the channel simulation is split
+                into, each shard is checked for the total number of
+                iterations of all the shards
+    """
+    def __init__(self,
+                 channel: pyatm.Channel,
+                 results: List[pyatm.simulations.Result],
+                 tolerance: float,
+                 confidence: float,
+                 ks_tolerance: Optional[float] = None,
+                 min_iterations: int = 0,
+                 time_budget: Optional[float] = None,
+                 shards: int = 1,
+                 **kwargs):
+        self.results = results
+        self.tolerance = tolerance
+        self.confidence = confidence
+        self.ks_tolerance = ks_tolerance
+        self.min_iterations = min_iterations
+        self.time_budget = time_budget
+        self.shards = shards
+        self.seconds = 0.
+        self.is_converged = False
+        self.is_timeout = False
+        # The stop requested by the check, the shifted aperture results
+        # are stopped too if True, nothing to stop if None
+        self.pending_stop: Optional[bool] = None
+        self._stop_lock = threading.Lock()
+        # The required DKW bound by the aperture names
+        self.tolerances: Dict[str, float] = {}
+        super().__init__(channel, [], **kwargs)
+        self._start_time = time.perf_counter()
+        self.check()
+        self.sync_output()
+
+    @property
+    def elapsed(self) -> float:
+        return self.seconds + time.perf_counter() - self._start_time
+
+    @property
+    def iterations(self) -> int:
+        return min((len(result.measures[0]) for result in self.results
+                    if isinstance(result, (EncircledEnergyResult,
+                                           pyatm.simulations.PDTResult))),
+                   default=0)
+
+    def transmittance(self) -> Dict[str, np.ndarray]:
+        "The copies of the transmittance samples by the aperture names."
+        samples = {}
+        for result in self.results:
+            samples.update(result_transmittance(result))
+        return samples
+
+    def check(self, samples: Optional[Dict[str, np.ndarray]] = None,
+              iterations: Optional[int] = None):
+        """Check the convergence of the transmittance samples of
+        the iterations, the current ones if None, and the time budget,
+        request the stop of the results if done.
+        """
+        if samples is None:
+            samples, iterations = self.transmittance(), self.iterations
+        if not self.is_converged:
+            iterations = iterations * self.shards
+            bound = dkw_bound(iterations, self.confidence)
+            self.tolerances = {}
+            if iterations >= self.min_iterations:
+                for name, transmittance in samples.items():
+                    self.tolerances[name] = self.tolerance
+                    # The fits are needed only if the bound is not enough
+                    if self.ks_tolerance and bound > self.tolerance:
+                        self.tolerances[name] = max(
+                            self.tolerance, self.ks_tolerance *
+                            fits_ks_distance(transmittance))
+            self.is_converged = bool(self.tolerances) and all(
+                bound <= tolerance for tolerance in self.tolerances.values())
+            if self.is_converged:
+                with self._stop_lock:
+                    self.pending_stop = bool(self.pending_stop)
+        if (not self.is_timeout and self.time_budget is not None and
+                self.elapsed >= self.time_budget):
+            self.is_timeout = True
+            with self._stop_lock:
+                self.pending_stop = True
+
+    def sync_output(self):
+        "Stop the results if requested, on the simulation thread."
+        with self._stop_lock:
+            shifted, self.pending_stop = self.pending_stop, None
+        if shifted is not None:
+            self.stop(shifted)
+
+    def stop(self, shifted: bool = False):
+        """Limit the results to the simulated iterations.
+
+        All the running results are limited to their common number of rows,
+        the shifted aperture results are stopped only if `shifted`.
+        """
+        results = [
+            result for result in self.results
+            if result.measures and not all(
+                measures.is_done for measures in result.measures) and (
+                shifted or not isinstance(result, ShiftedTrackedPDTResult))]
+        if not results:
+            return
+        rows = min(len(measures) for result in results
+                   for measures in result.measures)
+        for result in results:
+            result.set_max_size(rows)
+
+    def snapshot_output(self) -> Callable[[], None]:
+        "Copy the samples and return the function checking and storing them."
+        return partial(self._write_output, self.transmittance(),
+                       self.iterations)
+
+    def _write_output(self, samples: Dict[str, np.ndarray], iterations: int):
+        self.check(samples, iterations)
+        if not self.save_path:
+            return
+        save_path = Path(self.save_path)
+        tmp_path = save_path.with_name(save_path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({
+                'iterations': iterations,
+                'seconds': self.elapsed,
+                'dkw_bound': dkw_bound(iterations * self.shards,
+                                       self.confidence),
+                'tolerances': self.tolerances,
+                'converged': self.is_converged,
+                'timeout': self.is_timeout,
+            }, file, indent=4)
+        os.replace(tmp_path, save_path)
+
+    def save_output(self):
+        self.snapshot_output()()
+        self.sync_output()
+
+    def load_output(self):
+        self.seconds = load_convergence(Path(self.save_path).parent).get(
+            'seconds', 0.)
+
+    def print_output(self):
+        bound = dkw_bound(self.iterations * self.shards, self.confidence)
+        tolerance = min(self.tolerances.values(), default=self.tolerance)
+        print(f"DKW bound is {bound:.1e} for {tolerance:.1e} required, "
+              f"{self.elapsed:.0f} s elapsed")
+
+
+def load_convergence(path: Path) -> Dict:
+    """Load the convergence record stored in the folder, an empty one if
+    the adaptive stopping is not used.
+    """
+    try:
+        with open(Path(path) / CONVERGENCE_FILE, 'r',
+                  encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
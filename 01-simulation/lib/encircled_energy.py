@@ -0,0 +1,249 @@
+"""Encircled energy profiles of the simulated beams.
+
+For each realization `EncircledEnergyResult` stores the power inside circles
+of a fixed set of radiuses about the origin and about the beam centroid.
+The transmittance through an aperture of any radius is then read off the
+profiles, so the `transmittance.csv` and `tracked_transmittance.csv` files
+are derived from them, and a new aperture range does not require a new
+simulation.
+
+The profiles are stored in the `encircled_energy.chunks` table (see
+lib/storage.py), each save appends the new rows to it and then to
+the derived files. The derived files are written anew from the table when
+it is loaded or truncated and at the first save of a new table, so they
+follow the table after an interrupted save, a truncation on resume and
+a change of the aperture range.
+"""
+
+import os
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+import pyatmosphere as pyatm
+from pyatmosphere.gpu import get_array, get_xp
+
+from lib import field_cache
+from lib.storage import ChunkedStorage, ChunkedTable, table_path
+
+ENCIRCLED_ENERGY_FILE = 'encircled_energy.chunks'
+PROFILES = ('origin', 'centroid')
+
+
+def profile_radiuses(channel: pyatm.Channel, aperture_radiuses: List[float],
+                     points: int) -> np.ndarray:
+    """Radiuses of the profile circles.
+
+    They are the `points` equally spaced radiuses up to the half of the grid
+    size and the aperture radiuses, for which the profile is exact.
+    """
+    max_radius = np.min(channel.grid.size) / 2
+    return np.unique(np.concatenate([
+        np.linspace(max_radius / points, max_radius, points),
+        np.asarray(aperture_radiuses, dtype=float)]))
+
+
+def encircled_power(channel: pyatm.Channel, output, radiuses: np.ndarray,
+                    shift=(0, 0), distance_index=None) -> np.ndarray:
+    """Return the power inside the circles of the sorted radiuses.
+
+    The shift is given in the `pyatmosphere.CirclePupil` convention.
+    The precalculated indexes of the circles (`circle_index`) can be passed
+    as `distance_index`.
+    """
+    xp = get_xp()
+    if distance_index is None:
+        distance_index = circle_index(channel, radiuses, shift)
+    intensity = field_cache.intensity(channel, output)
+    power = xp.bincount(distance_index, weights=intensity.ravel(),
+                        minlength=len(radiuses) + 1)[:-1]
+    return get_array(xp.cumsum(power) * channel.grid.delta**2)
+
+
+def circle_index(channel: pyatm.Channel, radiuses: np.ndarray, shift=(0, 0),
+                 out=None, output=None):
+    """Index of the smallest circle each grid pixel is inside.
+
+    The squared distances are summed up of the squared x and y distances
+    into the `out` (Ny, Nx) array if given. The coordinates are cached by
+    the field cache bound to the `output`.
+    """
+    xp = get_xp()
+    x, y = field_cache.coordinates(channel, output)
+    distance2 = xp.add((x - shift[0])**2, (y + shift[1])**2, out=out)
+    return xp.searchsorted(xp.asarray(radiuses**2, dtype=distance2.dtype),
+                           distance2.ravel(), side='left')
+
+
+def profile_columns(radiuses: np.ndarray) -> List[str]:
+    "The columns of the table of the profiles of the radiuses."
+    return ['mean_x', 'mean_y', *[f"{name}_{float(radius)!r}"
+                                  for name in PROFILES
+                                  for radius in radiuses]]
+
+
+def column_radiuses(columns: List[str]) -> np.ndarray:
+    "The radiuses of the profiles of the table columns."
+    prefix = PROFILES[0] + '_'
+    return np.asarray([float(column[len(prefix):]) for column in columns
+                       if column.startswith(prefix)])
+
+
+def interpolate_profile(radiuses: np.ndarray, profile: np.ndarray,
+                        aperture_radiuses: Sequence[float]) -> np.ndarray:
+    """Read the power inside the apertures off the (iterations, radiuses)
+    profile array.
+
+    The profile is linearly interpolated in the circle area, so the values
+    for the profile radiuses are exact.
+    """
+    area = np.concatenate([[0], radiuses**2])
+    profile = np.concatenate([np.zeros((len(profile), 1)), profile], axis=1)
+    columns = []
+    for aperture_radius in aperture_radiuses:
+        aperture_area = min(aperture_radius**2, area[-1])
+        i = min(np.searchsorted(area, aperture_area, side='left'),
+                len(area) - 1)
+        i = max(i, 1)
+        weight = (aperture_area - area[i - 1]) / (area[i] - area[i - 1])
+        columns.append(profile[:, i - 1] +
+                       weight * (profile[:, i] - profile[:, i - 1]))
+    if not columns:
+        return np.empty((len(profile), 0))
+    return np.stack(columns, axis=1)
+
+
+class EncircledEnergyResult(ChunkedStorage, pyatm.simulations.Result):
+    """Represents the encircled energy profiles about the origin and about
+    the beam centroid of the samples, replaces `PDTResult` and
+    `TrackedPDTResult` with all the aperture radiuses.
+    """
+    def __init__(self,
+                 channel: pyatm.Channel,
+                 aperture_radiuses: List[float],
+                 points: int = 256,
+                 dtype: str = 'float32',
+                 **kwargs):
+        self.aperture_radiuses = list(aperture_radiuses)
+        self.radiuses = profile_radiuses(channel, aperture_radiuses, points)
+        self._origin_index = None
+        # The squared distances to the centroid of a realization
+        self._distance2 = None
+        # Whether the derived files follow the table
+        self._is_exported = False
+        measures = [
+            pyatm.simulations.Measure(
+                channel, "atmosphere", field_cache.mean_x),
+            pyatm.simulations.Measure(
+                channel, "atmosphere", field_cache.mean_y),
+            pyatm.simulations.Measure(
+                channel, "atmosphere", self.origin_profile, name="origin"),
+            pyatm.simulations.Measure(
+                channel, "atmosphere", self.centroid_profile,
+                name="centroid"),
+            ]
+        super().__init__(channel, measures, dtype=dtype, **kwargs)
+
+    def origin_profile(self, channel, output):
+        if self._origin_index is None:
+            self._origin_index = circle_index(channel, self.radiuses)
+        return encircled_power(channel, output, self.radiuses,
+                               distance_index=self._origin_index)
+
+    def centroid_profile(self, channel, output):
+        shift = (self.measures[0].iteration_data,
+                 self.measures[1].iteration_data)
+        if self._distance2 is None:
+            x, y = field_cache.coordinates(channel, output)
+            self._distance2 = get_xp().empty(
+                (y.shape[0], x.shape[1]), dtype=x.dtype)
+        return encircled_power(
+            channel, output, self.radiuses,
+            distance_index=circle_index(channel, self.radiuses, shift,
+                                        out=self._distance2, output=output))
+
+    def transmittance(self, aperture_radiuses: Sequence[float],
+                      tracked: bool = False) -> np.ndarray:
+        "Transmittance through the apertures, (iterations, apertures) array."
+        profile = np.asarray(self.measures[3 if tracked else 2].data,
+                             dtype=float).reshape(-1, len(self.radiuses))
+        return interpolate_profile(self.radiuses, profile, aperture_radiuses)
+
+    def table_columns(self) -> List[str]:
+        return profile_columns(self.radiuses)
+
+    def set_table_data(self, data: np.ndarray):
+        count = len(self.radiuses)
+        self.measures[0].data = data[:, 0].tolist()
+        self.measures[1].data = data[:, 1].tolist()
+        self.measures[2].data = list(data[:, 2:2 + count])
+        self.measures[3].data = list(data[:, 2 + count:])
+
+    def _export(self, rows: Optional[np.ndarray] = None):
+        export_transmittance(self.save_path, self.aperture_radiuses,
+                             float_format=self.save_float_format, rows=rows)
+        self._is_exported = True
+
+    def _append(self, rows: np.ndarray):
+        super()._append(rows)
+        self._export(rows if self._is_exported else None)
+
+    def truncate_output(self, rows: int):
+        super().truncate_output(rows)
+        if self.table.exists:
+            self._export()
+
+    def load_output(self):
+        table = ChunkedTable(table_path(self.save_path))
+        if not table.exists:
+            raise FileNotFoundError(table.path)
+        # The profiles are continued with the stored radiuses
+        self.radiuses = column_radiuses(table.columns)
+        super().load_output()
+        self._origin_index = None
+        self._export()
+
+    def print_output(self):
+        print(f"Count of measures: {len(self.measures[0])}")
+
+
+def export_transmittance(
+        path: Path,
+        aperture_radiuses: List[float],
+        float_format=pyatm.simulations.Result.save_float_format,
+        rows: Optional[np.ndarray] = None):
+    """Write the `transmittance.csv` and `tracked_transmittance.csv` files
+    read off the stored encircled energy profiles.
+
+    Args:
+        path: the path of the encircled energy result, the files are
+              stored in the same folder
+        aperture_radiuses: list of aperture radiuses
+        float_format: the format of the stored values
+        rows: the (rows, columns) array of the new rows of the table to
+              append to the files, all the rows of the table are written if
+              None
+    """
+    path = Path(path)
+    table = ChunkedTable(table_path(path))
+    radiuses = column_radiuses(table.columns)
+    data = np.asarray(table.read() if rows is None else rows, dtype=float)
+    count = len(radiuses)
+    columns = [f"{radius}" for radius in aperture_radiuses]
+    for file_name, profile in zip(
+            ['transmittance.csv', 'tracked_transmittance.csv'],
+            [data[:, 2:2 + count], data[:, 2 + count:]]):
+        df = pd.DataFrame(interpolate_profile(radiuses, profile,
+                                              aperture_radiuses),
+                          columns=columns)
+        if file_name == 'tracked_transmittance.csv':
+            df.insert(0, 'mean_x', data[:, 0])
+            df.insert(1, 'mean_y', data[:, 1])
+        if rows is None:
+            tmp_path = path.parent / (file_name + '.tmp')
+            df.to_csv(tmp_path, index=False, float_format=float_format)
+            os.replace(tmp_path, path.parent / file_name)
+        else:
+            df.to_csv(path.parent / file_name, mode='a', header=False,
+                      index=False, float_format=float_format)
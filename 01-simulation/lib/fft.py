@@ -0,0 +1,323 @@
+"""FFT backends of the vacuum propagation on CPU.
+
+The propagation FFTs of the channels (`pyatmosphere.theory.vacuum`) and of
+the batched simulation (`lib.batched`) are computed by the backend chosen
+with `use_backend`:
+
+- 'numpy' - the single-threaded `numpy.fft`, the pyatmosphere default;
+- 'scipy' - the multithreaded `scipy.fft`, which transforms the temporary
+  arrays in place;
+- 'pyfftw' - FFTW plans measured once for every array shape and threads
+  count, with their aligned input and output buffers reused by all
+  the transforms of the shape. The measured plans (the FFTW wisdom) are
+  stored in a file and loaded by the next runs, so the slow planning is
+  done once. pyFFTW is an optional dependency.
+
+In the single precision the backends transform complex64 arrays, which
+halves the memory of the FFT temporaries and the memory traffic. numpy
+computes the transforms in the double precision and casts them.
+
+On GPU the FFTs are computed by cupy whatever the backend is.
+"""
+
+import os
+import pickle
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from pyatmosphere import gpu
+from pyatmosphere.theory import vacuum
+
+try:
+    import scipy.fft
+except ModuleNotFoundError:
+    scipy = None
+
+try:
+    import pyfftw
+except ModuleNotFoundError:
+    pyfftw = None
+
+BACKENDS = ('numpy', 'scipy', 'pyfftw')
+
+
+def gpu_available() -> bool:
+    "Whether cupy is installed and finds a CUDA device."
+    try:
+        import cupy
+        return cupy.cuda.runtime.getDeviceCount() > 0
+    except Exception:  # no cupy, no CUDA driver or no device
+        return False
+
+
+def default_workers(processes: int = 1) -> int:
+    "Share the CPU cores between the simulation processes."
+    return max(1, (os.cpu_count() or 1) // processes)
+
+
+class FFTBackend:
+    """The numpy FFTs over the last two axes.
+
+    Args:
+        workers: the number of threads of a transform
+        single: transform in the single precision
+    """
+    name = 'numpy'
+
+    def __init__(self, workers: int = 1, single: bool = False):
+        self.workers = workers
+        self.single = single
+        self.dtype = np.dtype(np.complex64 if single else np.complex128)
+        self.real_dtype = np.dtype(np.float32 if single else np.float64)
+
+    def fft2(self, x, overwrite_x: bool = False):
+        """The forward FFT of the array.
+
+        `overwrite_x` allows the backend to transform a temporary array in
+        place.
+        """
+        return np.fft.fft2(x).astype(self.dtype, copy=False)
+
+    def ifft2(self, x, overwrite_x: bool = False):
+        "The normalized inverse FFT of the array."
+        return np.fft.ifft2(x).astype(self.dtype, copy=False)
+
+    def rfft2(self, x, s: Tuple[int, int]):
+        "The FFT of the real array zero padded to the `s` shape."
+        return np.fft.rfft2(x, s=s).astype(self.dtype, copy=False)
+
+    def irfft2(self, x, s: Tuple[int, int]):
+        "The real inverse FFT of the `s` shape."
+        return np.fft.irfft2(x, s=s).astype(self.real_dtype, copy=False)
+
+
+class ScipyFFTBackend(FFTBackend):
+    "The multithreaded `scipy.fft` FFTs."
+    name = 'scipy'
+
+    def fft2(self, x, overwrite_x: bool = False):
+        x = np.asarray(x, dtype=self.dtype)
+        return scipy.fft.fft2(x, workers=self.workers,
+                              overwrite_x=overwrite_x)
+
+    def ifft2(self, x, overwrite_x: bool = False):
+        x = np.asarray(x, dtype=self.dtype)
+        return scipy.fft.ifft2(x, workers=self.workers,
+                               overwrite_x=overwrite_x)
+
+    def rfft2(self, x, s: Tuple[int, int]):
+        x = np.asarray(x, dtype=self.real_dtype)
+        return scipy.fft.rfft2(x, s=s, workers=self.workers)
+
+    def irfft2(self, x, s: Tuple[int, int]):
+        x = np.asarray(x, dtype=self.dtype)
+        return scipy.fft.irfft2(x, s=s, workers=self.workers)
+
+
+class PyFFTWBackend(FFTBackend):
+    """FFTW plans cached by the array shapes.
+
+    A transform copies the array into the aligned input buffer of the plan
+    and returns its output buffer, which is valid until the next transform
+    of the same shape. The plans are cached for every thread, so
+    the transforms of the different threads do not share the buffers.
+
+    Args:
+        workers: the number of threads of a transform
+        single: transform in the single precision
+        wisdom_path: the file of the stored FFTW wisdom, not stored if None
+        planner_effort: the FFTW planner flag
+    """
+    name = 'pyfftw'
+
+    def __init__(self, workers: int = 1, single: bool = False,
+                 wisdom_path: Optional[str] = None,
+                 planner_effort: str = 'FFTW_MEASURE'):
+        if pyfftw is None:
+            raise ModuleNotFoundError("pyfftw is not installed")
+        super().__init__(workers, single)
+        self.wisdom_path = Path(wisdom_path) if wisdom_path else None
+        self.planner_effort = planner_effort
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.load_wisdom()
+
+    @property
+    def _plans(self) -> Dict[Tuple, object]:
+        "The plans of the thread by the transforms, the shapes and s."
+        if not hasattr(self._local, 'plans'):
+            self._local.plans = {}
+        return self._local.plans
+
+    def load_wisdom(self):
+        if self.wisdom_path is None:
+            return
+        try:
+            with open(self.wisdom_path, 'rb') as file:
+                pyfftw.import_wisdom(pickle.load(file))
+        except FileNotFoundError:
+            pass
+
+    def save_wisdom(self):
+        if self.wisdom_path is None:
+            return
+        self.wisdom_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.wisdom_path.with_name(self.wisdom_path.name + '.tmp')
+        with open(tmp_path, 'wb') as file:
+            pickle.dump(pyfftw.export_wisdom(), file)
+        os.replace(tmp_path, self.wisdom_path)
+
+    def _plan(self, transform: str, x, s: Optional[Tuple[int, int]] = None):
+        key = (transform, np.shape(x), s)
+        if key not in self._plans:
+            dtype = self.real_dtype if transform == 'rfft2' else self.dtype
+            # The FFTW planner is not thread-safe
+            with self._lock:
+                self._plans[key] = getattr(pyfftw.builders, transform)(
+                    pyfftw.empty_aligned(np.shape(x), dtype=dtype), s=s,
+                    axes=(-2, -1), threads=self.workers,
+                    planner_effort=self.planner_effort, avoid_copy=False)
+                self.save_wisdom()
+        return self._plans[key]
+
+    def fft2(self, x, overwrite_x: bool = False):
+        return self._plan('fft2', x)(x)
+
+    def ifft2(self, x, overwrite_x: bool = False):
+        return self._plan('ifft2', x)(x)
+
+    def rfft2(self, x, s: Tuple[int, int]):
+        return self._plan('rfft2', x, s)(x)
+
+    def irfft2(self, x, s: Tuple[int, int]):
+        return self._plan('irfft2', x, s)(x)
+
+
+_backend = FFTBackend()
+
+
+def get_backend() -> FFTBackend:
+    return _backend
+
+
+def create_backend(name: str = 'auto', workers: int = 1,
+                   wisdom_path: Optional[str] = None,
+                   single: bool = False) -> FFTBackend:
+    """Create the backend by its name, 'auto' for the fastest installed one.
+
+    The missing libraries fall back to the installed ones.
+    """
+    if name not in ('auto', *BACKENDS):
+        raise ValueError(f"Unknown FFT backend '{name}', "
+                         f"expected one of {BACKENDS}")
+    if name in ('auto', 'pyfftw') and pyfftw is not None:
+        return PyFFTWBackend(workers, single, wisdom_path)
+    if name in ('auto', 'pyfftw', 'scipy') and scipy is not None:
+        return ScipyFFTBackend(workers, single)
+    return FFTBackend(workers, single)
+
+
+def use_backend(name: str = 'auto', workers: int = 1,
+                wisdom_path: Optional[str] = None,
+                single: bool = False) -> FFTBackend:
+    """Compute the propagation FFTs with the backend.
+
+    The current backend and its plans are kept if it is the same.
+    """
+    global _backend
+    backend = create_backend(name, workers, wisdom_path, single)
+    if (type(backend) is not type(_backend) or
+            backend.workers != _backend.workers or
+            backend.single != _backend.single or
+            getattr(backend, 'wisdom_path', None) !=
+            getattr(_backend, 'wisdom_path', None)):
+        _backend = backend
+    # The pyatmosphere propagation looks the FFTs up in its module
+    vacuum.fft2, vacuum.ifft2 = centered_fft2, centered_ifft2
+    return _backend
+
+
+def transform_dtype() -> np.dtype:
+    "The complex dtype of the transforms of the complex64 fields."
+    if gpu.config['use_gpu']:
+        # cupy transforms complex64 in the single precision
+        return np.dtype(np.complex64)
+    return _backend.dtype
+
+
+def fft2_inplace(x):
+    """The FFT of the array over the last two axes without the shifts.
+
+    The array of the `transform_dtype` is transformed in place if
+    the backend can, it is overwritten anyway.
+    """
+    if gpu.config['use_gpu']:
+        return gpu.get_xp().fft.fft2(x)
+    return _backend.fft2(x, overwrite_x=True)
+
+
+def ifft2_inplace(x):
+    "The inverse of `fft2_inplace`, which overwrites the array too."
+    if gpu.config['use_gpu']:
+        return gpu.get_xp().fft.ifft2(x)
+    return _backend.ifft2(x, overwrite_x=True)
+
+
+def _gpu_input(x, real: bool = False):
+    "Cast the array to the single precision on GPU if required."
+    if not _backend.single:
+        return x
+    return gpu.get_xp().asarray(
+        x, dtype=_backend.real_dtype if real else _backend.dtype)
+
+
+def fft2(x, axes=(-2, -1)):
+    """`fftshift(fft2(fftshift(x)))` over the axes by the backend.
+
+    The shifted copy of the array is transformed in place.
+    """
+    xp = gpu.get_xp()
+    if gpu.config['use_gpu']:
+        x = _gpu_input(x)
+        return xp.fft.fftshift(xp.fft.fft2(xp.fft.fftshift(x, axes=axes)),
+                               axes=axes)
+    return np.fft.fftshift(_backend.fft2(np.fft.fftshift(x, axes=axes),
+                                         overwrite_x=True), axes=axes)
+
+
+def ifft2(x, axes=(-2, -1)):
+    "`ifftshift(ifft2(ifftshift(x)))` over the axes by the backend."
+    xp = gpu.get_xp()
+    if gpu.config['use_gpu']:
+        x = _gpu_input(x)
+        return xp.fft.ifftshift(xp.fft.ifft2(xp.fft.ifftshift(x, axes=axes)),
+                                axes=axes)
+    return np.fft.ifftshift(_backend.ifft2(np.fft.ifftshift(x, axes=axes),
+                                           overwrite_x=True), axes=axes)
+
+
+def centered_fft2(x, delta):
+    "`pyatmosphere.utils.fft2` by the backend."
+    return fft2(x) * delta**2
+
+
+def centered_ifft2(x, delta):
+    "`pyatmosphere.utils.ifft2` by the backend."
+    N = x.shape[0]
+    return ifft2(x) * (N * delta)**2
+
+
+def rfft2(x, s: Tuple[int, int]):
+    "The FFT of the real array zero padded to the `s` shape by the backend."
+    if gpu.config['use_gpu']:
+        return gpu.get_xp().fft.rfft2(_gpu_input(x, real=True), s=s)
+    return _backend.rfft2(x, s)
+
+
+def irfft2(x, s: Tuple[int, int]):
+    "The real inverse FFT of the `s` shape by the backend."
+    if gpu.config['use_gpu']:
+        return gpu.get_xp().fft.irfft2(_gpu_input(x), s=s)
+    return _backend.irfft2(x, s)
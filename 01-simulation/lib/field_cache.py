@@ -0,0 +1,238 @@
+"""Shared cache of the quantities derived from the output of an iteration.
+
+The measures of a realization compute the same quantities of the output
+field again and again: every `pyatmosphere.measures` function and
+the encircled energy and shifted aperture measures take its intensity
+`|E|^2`, and the measures need the grid coordinates, the total power and
+the beam centroid. `FieldCache` computes each quantity of the output once
+and counts the hits and the misses of every quantity. A quantity is computed
+outside the lock of the cache, and the threads asking for it meanwhile wait
+for it, so the measures evaluated in parallel (see lib/parallel.py) compute
+the different quantities at the same time.
+
+The quantities are cached for the output the cache is bound to, and they
+are cleared when it is bound again: the propagation reuses the field
+buffers, so the same array is the output of several steps. With
+the `SharedFieldCache` mixin the simulation binds the cache to the output
+of the measures and clears it at the start of every iteration. The measures
+pull the quantities with `intensity`, `centroid` and `coordinates`, or
+cache their own ones with `cached`, and compute them without the cache if
+it is not bound to their output. The quantities of the grid, as
+the coordinates, are kept for the whole simulation run. The `mean_x` and
+`mean_y` measures of the results tracking the beam read the cached
+centroid. The functions of `pyatmosphere.measures` do not use the cache.
+
+The cached arrays are shared, so the measures must not modify them. With
+the cache the operations of the measures get the output itself instead of
+its copy, so they must not modify it in place either (the pupils return
+new arrays).
+"""
+
+import threading
+from collections import Counter
+from concurrent.futures import Future
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+import pyatmosphere as pyatm
+from pyatmosphere import measures
+
+from lib.parallel import ParallelMeasures, evaluate_measures
+
+
+class FieldCache:
+    "The quantities of the bound output by their names and keys."
+    def __init__(self):
+        self.hits: Counter = Counter()
+        self.misses: Counter = Counter()
+        self._output = None
+        # Counts the bindings, identifies the bound output
+        self._binding = 0
+        self._values: Dict[Hashable, Future] = {}
+        # The quantities of the grids with the grids
+        self._grid_values: Dict[Hashable, Tuple] = {}
+        self._lock = threading.Lock()
+
+    def bind(self, output):
+        "Cache the quantities of the output, the cached ones are cleared."
+        with self._lock:
+            self._values.clear()
+            _unregister(self)
+            self._output = output
+            self._binding += 1
+            _bound_caches[id(output)] = self
+
+    def clear(self):
+        "Clear the quantities and unbind the output."
+        with self._lock:
+            self._values.clear()
+            _unregister(self)
+            self._output = None
+
+    def reset(self):
+        "Clear the quantities of the output and of the grids, and the counts."
+        self.clear()
+        with self._lock:
+            self._grid_values.clear()
+            self.hits.clear()
+            self.misses.clear()
+
+    def is_bound(self, output) -> bool:
+        "Whether the cache is bound to the output."
+        return output is self._output
+
+    def output_key(self, output) -> Optional[int]:
+        """The key of the output the cache is bound to, a new one on
+        every binding, None if the cache is not bound to the output.
+        """
+        with self._lock:
+            return self._binding if output is self._output else None
+
+    def get(self, name: str, key: Hashable, compute: Callable[[], object]):
+        "The cached quantity of the name and key, computed on the miss."
+        with self._lock:
+            future = self._values.get((name, key))
+            is_miss = future is None
+            if is_miss:
+                self.misses[name] += 1
+                future = self._values[name, key] = Future()
+            else:
+                self.hits[name] += 1
+        if is_miss:
+            try:
+                future.set_result(compute())
+            except BaseException as error:
+                future.set_exception(error)
+        return future.result()
+
+    def get_grid(self, name: str, grid: pyatm.RectGrid,
+                 compute: Callable[[], object]):
+        "The cached quantity of the grid, kept until the reset."
+        with self._lock:
+            entry = self._grid_values.get((name, id(grid)))
+            if entry is not None and entry[0] is grid:
+                self.hits[name] += 1
+                return entry[1]
+            self.misses[name] += 1
+        # The quantity does not change, a concurrent miss computes it again
+        value = compute()
+        with self._lock:
+            self._grid_values[name, id(grid)] = (grid, value)
+        return value
+
+    def counts(self) -> Dict[str, Tuple[int, int]]:
+        "The hits and the lookups of the quantities by their names."
+        return {name: (self.hits[name], self.hits[name] + self.misses[name])
+                for name in sorted(self.hits.keys() | self.misses.keys())}
+
+
+# The caches by the ids of the outputs they are bound to
+_bound_caches: Dict[int, FieldCache] = {}
+
+
+def _unregister(cache: FieldCache):
+    if _bound_caches.get(id(cache._output)) is cache:
+        del _bound_caches[id(cache._output)]
+
+
+def get_cache(output) -> Optional[FieldCache]:
+    "The cache bound to the output, None if there is no such cache."
+    cache = _bound_caches.get(id(output))
+    return cache if cache is not None and cache.is_bound(output) else None
+
+
+def intensity(channel: pyatm.Channel, output):
+    "The intensity of the output, cached for the bound output."
+    return cached('intensity', None, output, lambda: abs(output)**2)
+
+
+def coordinates(channel: pyatm.Channel, output=None) -> Tuple:
+    """The x and y coordinates of the channel grid, cached by the cache
+    bound to the output.
+    """
+    cache = get_cache(output)
+    if cache is None:
+        return channel.grid.get_xy()
+    return cache.get_grid('coordinates', channel.grid, channel.grid.get_xy)
+
+
+def cached(name: str, key: Hashable, output, compute: Callable[[], object]):
+    "The quantity of the output, cached if a cache is bound to it."
+    cache = get_cache(output)
+    if cache is None:
+        return compute()
+    return cache.get(name, key, compute)
+
+
+def centroid(channel: pyatm.Channel, output) -> Tuple[float, float]:
+    """The beam centroid of the output as `pyatmosphere.measures.mean_x`
+    and `mean_y`.
+    """
+    def compute():
+        field_intensity = intensity(channel, output)
+        x, y = coordinates(channel, output)
+        delta2 = channel.grid.delta**2
+        return ((field_intensity * x).sum(axis=(-1, -2)).item() * delta2,
+                (field_intensity * (-1) * y).sum(axis=(-1, -2)).item() *
+                delta2)
+    return cached('centroid', id(channel.grid), output, compute)
+
+
+def mean_x(channel: pyatm.Channel, output) -> float:
+    "`pyatmosphere.measures.mean_x` of the cached centroid."
+    if get_cache(output) is None:
+        return measures.mean_x(channel, output=output)
+    return centroid(channel, output)[0]
+
+
+def mean_y(channel: pyatm.Channel, output) -> float:
+    "`pyatmosphere.measures.mean_y` of the cached centroid."
+    if get_cache(output) is None:
+        return measures.mean_y(channel, output=output)
+    return centroid(channel, output)[1]
+
+
+class TrackedPDTResult(pyatm.simulations.TrackedPDTResult):
+    """`pyatmosphere.simulations.TrackedPDTResult` with the beam centroid
+    of the field cache.
+    """
+    def __init__(self, channel: pyatm.Channel, **kwargs):
+        super().__init__(channel, **kwargs)
+        self.measures[0].operations = (mean_x,)
+        self.measures[1].operations = (mean_y,)
+
+
+class SharedFieldCache:
+    """Mixin of `pyatmosphere.simulations.Simulation` sharing
+    the quantities of the output between the measures of an iteration.
+    Every simulation has its own cache, which the measures find by
+    the output. The hits of the quantities are recorded by the profile of
+    `lib.profiling.Profiling`.
+    """
+    # The operations of the measures get the bound output itself
+    copy_output = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.field_cache = FieldCache()
+
+    def iter(self):
+        self.field_cache.clear()
+        super().iter()
+
+    def process_operations(self, output, operations_measures, time_id,
+                           propagation_id=None):
+        self.field_cache.bind(output)
+        if isinstance(self, ParallelMeasures):
+            # It evaluates the operations without the copies
+            super().process_operations(output, operations_measures,
+                                       time_id, propagation_id)
+        else:
+            evaluate_measures(operations_measures, output, time_id,
+                              propagation_id, copy_output=False)
+
+    def run(self, *args, **kwargs):
+        self.field_cache.reset()
+        try:
+            super().run(*args, **kwargs)
+        finally:
+            self.field_cache.clear()
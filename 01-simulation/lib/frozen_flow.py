@@ -0,0 +1,223 @@
+"""Time series of the channels through the frozen flow turbulence.
+
+The independent realizations of the simulation give the statistics of
+the transmittance, but not its time correlations. In the frozen flow model
+the turbulence of a layer does not change in time and is carried across
+the beam by the wind, so the phase screen of a layer at the time t is
+the screen of the time 0 shifted by the wind velocity times t.
+
+The sparse spectrum phase screen is a sum of plane waves, so it can be
+evaluated at any coordinates: `FrozenFlowScreen` draws the spectrum of
+a layer once for a series and synthesizes its screen at the coordinates
+the wind has carried it to on every time step (see
+`lib.phase_screens.synthesize`). If the wind carries the screen by whole
+grid points per step, the screen is shifted by them and only the strip of
+the new points entering the grid is synthesized. The shift of a time step
+is rarely whole grid points, but the shift of a few steps often is: with
+the wind of 10 m/s and the time step of 0.1 ms the screen moves 10 points
+every 3 steps on the 0.3 mm grid. So the screens of the last `period`
+steps are kept, and the screen of a step is the one of `period` steps ago
+shifted by the whole grid points, with the strip synthesized at the exact
+offset. Only if the shift of no `MAX_SHIFT_PERIOD` steps is whole,
+the screen is synthesized anew on every step.
+
+With the `FrozenFlow` mixin each iteration of the simulation is a time
+step: the rows of the results are the consecutive time steps of a series,
+and the phase screens are drawn anew every `series_steps` rows. A continued
+simulation drops the rows of the incomplete series, which can not be
+restored, and starts a new one.
+"""
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pyatmosphere as pyatm
+from pyatmosphere.gpu import get_xp
+
+from lib.checkpoint import truncate_result
+from lib.phase_screens import synthesize
+
+TIME_SERIES_FOLDER = 'time_series'
+TIME_SERIES_FILE = 'time_series.json'
+
+Velocity = Tuple[float, float]
+
+# The difference from the whole grid points of a shift per time step
+# taken as whole, in the grid points
+WHOLE_SHIFT_TOLERANCE = 1e-6
+# The most time steps to find the whole shift in, the number of the kept
+# screens of a layer
+MAX_SHIFT_PERIOD = 8
+
+
+def shift_period(shift: Tuple[float, float],
+                 max_period: int = MAX_SHIFT_PERIOD) -> Optional[int]:
+    """The fewest time steps the shift of which is whole grid points, None
+    if there are more than `max_period`.
+    """
+    for period in range(1, max_period + 1):
+        if all(abs(period * value - round(period * value)) <=
+               WHOLE_SHIFT_TOLERANCE for value in shift):
+            return period
+    return None
+
+
+class FrozenFlowScreen:
+    """The phase screen of a turbulence layer carried by the wind.
+
+    Args:
+        phase_screen: the sparse spectrum phase screen of the layer
+        grid: the grid of the phase screen
+        velocity: the (x, y) wind velocity of the layer, m/s
+        time_step: the time between the screens, s
+    """
+    def __init__(self, phase_screen: pyatm.SSPhaseScreen,
+                 grid: pyatm.RectGrid, velocity: Velocity, time_step: float):
+        self.phase_screen = phase_screen
+        xp = get_xp()
+        # The coordinates of the far shifted screens need the double precision
+        self.x = xp.asarray(grid.get_x(), dtype=np.float64)
+        self.y = xp.asarray(grid.get_y(), dtype=np.float64)
+        steps = (float(grid.delta), float(grid.delta))
+        # The screen moves against the coordinates of the frozen turbulence,
+        # the shift of a time step in the grid points
+        self.shift = tuple(-v * time_step / step
+                           for v, step in zip(velocity, steps))
+        self.steps = steps
+        self.period = shift_period(self.shift)
+        self.screen = None
+        self._spectrum: Optional[Tuple] = None
+        # The kept screens with their steps by the steps modulo the period
+        self._screens: Dict[int, Tuple[int, object]] = {}
+
+    def _synthesize(self, offset: Tuple[float, float], columns=slice(None),
+                    rows=slice(None)):
+        value, fx, fy = self._spectrum
+        return synthesize(value, fx, fy,
+                          self.x[:, columns] + offset[0] * self.steps[0],
+                          self.y[rows] + offset[1] * self.steps[1]
+                          ).astype(np.float32)
+
+    def start(self):
+        "Draw the turbulence of a new series."
+        spectrum = self.phase_screen._get_spectrum(use_cached_spectrum=False)
+        fx, fy = self.phase_screen.f_grid.get_xy(spectrum.rho, spectrum.theta)
+        self._spectrum = (spectrum.value, fx.ravel(), fy.ravel())
+        self._screens = {}
+        self.move(0)
+
+    def move(self, step: int):
+        "Move the screen to the time step of the series."
+        offset = tuple(shift * step for shift in self.shift)
+        if self.period is None:
+            self.screen = self._synthesize(offset)
+            return
+        kept_step, screen = self._screens.get(step % self.period,
+                                              (None, None))
+        if kept_step is None:
+            screen = self._synthesize(offset)
+            self._screens[step % self.period] = (step, screen)
+            self.screen = screen
+            return
+        # The shift from the kept screen of the step is whole grid points
+        dx, dy = (round(shift * (step - kept_step)) for shift in self.shift)
+        Ny, Nx = screen.shape
+        if abs(dx) >= Nx or abs(dy) >= Ny:
+            screen = self._synthesize(offset)
+        elif dx or dy:
+            screen = get_xp().roll(screen, (-dy, -dx), axis=(0, 1))
+            if dx:
+                columns = slice(Nx - dx, None) if dx > 0 else slice(None, -dx)
+                screen[:, columns] = self._synthesize(offset, columns=columns)
+            if dy:
+                rows = slice(Ny - dy, None) if dy > 0 else slice(None, -dy)
+                screen[rows] = self._synthesize(offset, rows=rows)
+        self._screens[step % self.period] = (step, screen)
+        self.screen = screen
+
+    def __call__(self, *args, **kwargs):
+        return self.screen
+
+
+def layer_velocities(wind: Sequence[Velocity], count: int) -> List[Velocity]:
+    "The wind velocities of the `count` layers, the same one for all."
+    if len(wind) == 1:
+        return list(wind) * count
+    if len(wind) != count:
+        raise ValueError(f"{len(wind)} wind velocities for {count} layers")
+    return list(wind)
+
+
+class FrozenFlow:
+    """Mixin of `pyatmosphere.simulations.Simulation` simulating the time
+    series of the channels through the `SSPhaseScreen` phase screens carried
+    by the wind, an iteration for a time step.
+
+    Args:
+        wind: the (x, y) wind velocities of the layers of the paths in m/s,
+              a single one for all the layers
+        time_step: the time between the iterations, s
+        series_steps: the number of the time steps of a series
+    """
+    def __init__(self, *args, wind: Sequence[Velocity] = ((10, 0),),
+                 time_step: float = 1e-4, series_steps: int = 1000,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wind = [tuple(velocity) for velocity in wind]
+        self.time_step = time_step
+        self.series_steps = series_steps
+        self._layers: List[FrozenFlowScreen] = []
+        self._step = 0
+
+    def _start_step(self) -> int:
+        "Drop the rows of the incomplete series, return the next step."
+        rows = min((len(measures) for measures in self.flattened_measures()),
+                   default=0)
+        step = rows - rows % self.series_steps
+        for result in self.results_list:
+            if result.measures and min(map(len, result.measures)) > step:
+                truncate_result(result, step)
+        return step
+
+    def iter(self):
+        step = self._step % self.series_steps
+        for layer in self._layers:
+            if step == 0:
+                layer.start()
+            else:
+                layer.move(step)
+        super().iter()
+        self._step += 1
+
+    def run(self, *args, **kwargs):
+        for channel in self.measures:
+            phase_screens = getattr(channel.path, 'phase_screens', [])
+            if any(type(phase_screen) is not pyatm.SSPhaseScreen
+                   for phase_screen in phase_screens):
+                raise ValueError("The frozen flow needs the sparse spectrum "
+                                 "phase screens")
+            # The phase screens take the wavelength and the grid from
+            # the channel or the scaled path
+            channel.path.init_phase_screens()
+            for phase_screen, velocity in zip(
+                    phase_screens,
+                    layer_velocities(self.wind, len(phase_screens))):
+                self._layers.append(FrozenFlowScreen(
+                    phase_screen, phase_screen.grid, velocity, self.time_step))
+        for layer in self._layers:
+            if layer.period is None:
+                print(f"Warning: the frozen flow shift of "
+                      f"({layer.shift[0]:.4g}, {layer.shift[1]:.4g}) grid "
+                      f"points per time step is not whole in "
+                      f"{MAX_SHIFT_PERIOD} steps, the phase screens are "
+                      f"synthesized anew on every step")
+                break
+        for layer in self._layers:
+            layer.phase_screen.generate_phase_screen = layer
+        self._step = self._start_step()
+        try:
+            super().run(*args, **kwargs)
+        finally:
+            for layer in self._layers:
+                del layer.phase_screen.generate_phase_screen
+            self._layers = []
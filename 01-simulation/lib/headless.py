@@ -0,0 +1,76 @@
+"""Summary of the simulation progress for the unattended runs.
+
+The summary is written to the `summary.json` file in the data folder and
+printed on SIGUSR1 (see `lib.signals`). It lists the stored rows of every
+result of the channels, their convergence and throughput. In the sharded
+simulations the stored rows are counted in the shard folders, so the rows
+simulated by the workers since their last save are not included.
+"""
+
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict
+
+import config
+from lib.convergence import load_convergence
+from lib.profiling import PROFILE_FILE
+from lib.sharding import SHARDS_FOLDER
+from lib.storage import count_rows, stored_results
+
+SUMMARY_FILE = 'summary.json'
+# the exit code of the interrupted runs, EX_TEMPFAIL of sysexits.h
+INTERRUPTED_EXIT_CODE = 75
+
+
+def stored_rows(channel_path: Path) -> Dict[str, int]:
+    "The stored rows of the results of the channel by their CSV paths."
+    rows: Dict[str, int] = {}
+    for path in (sorted((channel_path / SHARDS_FOLDER).glob('*')) or
+                 [channel_path]):
+        for folder in [path, path / 'shifted_aperture']:
+            for result_path in stored_results(folder):
+                name = str(result_path.relative_to(path))
+                rows[name] = rows.get(name, 0) + count_rows(result_path)
+    return rows
+
+
+def channel_summary(channel_name: str) -> Dict:
+    channel_path = Path(config.DATA_PATH) / channel_name
+    summary = {
+        'iterations': config.CHANNELS[channel_name]['iterations'],
+        'stored': stored_rows(channel_path),
+    }
+    convergence = load_convergence(channel_path)
+    if convergence:
+        summary['converged'] = convergence['converged']
+        summary['timeout'] = convergence['timeout']
+    try:
+        with open(channel_path / PROFILE_FILE, 'r', encoding='utf-8') as file:
+            summary['iterations_per_second'] = \
+                json.load(file)['iterations_per_second']
+    except FileNotFoundError:
+        pass
+    return summary
+
+
+def write_summary():
+    "Write the summary of all the channels and print it."
+    summary = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'channels': {channel_name: channel_summary(channel_name)
+                     for channel_name in config.CHANNELS},
+    }
+    path = Path(config.DATA_PATH) / SUMMARY_FILE
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(summary, file, indent=4)
+    os.replace(tmp_path, path)
+
+    print(f"\nSummary at {summary['time']}:")
+    for channel_name, channel in summary['channels'].items():
+        beam_rows = channel['stored'].get('beam.csv', 0)
+        print(f"    {channel_name}: {beam_rows} of {channel['iterations']} "
+              "iterations stored")
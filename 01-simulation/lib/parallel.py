@@ -0,0 +1,142 @@
+"""Evaluation of the measures of an iteration in a thread pool.
+
+After the propagation `pyatmosphere.simulations.Simulation` evaluates
+the operations of the measures one by one, although they only read
+the output field and NumPy releases the GIL in the array operations.
+`ParallelMeasures` evaluates the operations of the measures of each
+measure type on the threads of a pool and waits for them.
+
+The operations bound to a result may read the iteration data of the other
+measures of the result: `TrackedPDTResult.set_pupil_position` and
+`ShiftedTrackedPDTResult.shifted_transmittance` read the beam centroid of
+the `mean_x` and `mean_y` measures. So the plain measure functions are
+evaluated first and the operations of the results after them.
+
+`PDTResult.append_pupil` sets the pupil of the channel for the time of
+the operation, so every operation gets a shallow copy of the channel,
+which shares the grid, the source and the path with it.
+
+The operations get a copy of the output as in the simulation, unless
+the `copy_output` of the simulation is False: the operations of
+the measures of `lib.field_cache.SharedFieldCache` read the output itself.
+"""
+
+import copy
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+
+import pyatmosphere as pyatm
+
+
+def _function(operation):
+    while isinstance(operation, partial):
+        operation = operation.func
+    return operation
+
+
+def is_result_operation(operation) -> bool:
+    "Whether the operation is a method of a result."
+    return isinstance(getattr(_function(operation), '__self__', None),
+                      pyatm.simulations.Result)
+
+
+def evaluate(operations: Tuple, channel: pyatm.Channel, output,
+             copy_output: bool = True):
+    """Apply the operations to the output as the simulation does, to
+    the output itself if not `copy_output`.
+    """
+    channel = copy.copy(channel)
+    measures_output = output.copy() if copy_output else output
+    for operation in operations:
+        measures_output = operation(channel, output=measures_output)
+    return measures_output
+
+
+def store(measures_list: List[pyatm.simulations.Measure], measures_output,
+          time_id: int, propagation_id: Optional[int] = None):
+    "Set the iteration data of the measures as the simulation does."
+    for measures in measures_list:
+        if measures.is_done:
+            continue
+        if measures.time is not None:
+            if propagation_id is not None:
+                measures.iteration_data[time_id][propagation_id] = \
+                    measures_output
+            else:
+                measures.iteration_data[time_id] = measures_output
+        elif propagation_id is not None:
+            measures.iteration_data[propagation_id] = measures_output
+        else:
+            measures.iteration_data = measures_output
+
+
+def evaluate_measures(operations_measures: Dict, output, time_id: int,
+                      propagation_id: Optional[int] = None,
+                      executor: Optional[ThreadPoolExecutor] = None,
+                      copy_output: bool = True):
+    """Evaluate and store the measures which are not done, the plain
+    measure functions first and the operations of the results after them,
+    on the threads of the executor if given.
+    """
+    groups = [(operations, measures_list) for operations, measures_list
+              in operations_measures.items()
+              if not all(measures.is_done for measures in measures_list)]
+    for is_dependent in (False, True):
+        stage = [(operations, measures_list)
+                 for operations, measures_list in groups
+                 if any(map(is_result_operation, operations)) ==
+                 is_dependent]
+        if executor is None:
+            outputs = [evaluate(operations, measures_list[0].channel, output,
+                                copy_output)
+                       for operations, measures_list in stage]
+        else:
+            outputs = [future.result() for future in [
+                executor.submit(evaluate, operations,
+                                measures_list[0].channel, output, copy_output)
+                for operations, measures_list in stage]]
+        for (_, measures_list), measures_output in zip(stage, outputs):
+            store(measures_list, measures_output, time_id, propagation_id)
+
+
+class ParallelMeasures:
+    """Mixin of `pyatmosphere.simulations.Simulation` evaluating
+    the measures of an iteration in a thread pool.
+
+    Args:
+        measure_threads: the number of the threads
+    """
+    # Whether the operations get a copy of the output
+    copy_output = True
+
+    def __init__(self, *args, measure_threads: int = 1, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.measure_threads = measure_threads
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def process_operations(self, output, operations_measures: Dict,
+                           time_id, propagation_id=None):
+        if self._executor is None and self.copy_output:
+            return super().process_operations(
+                output, operations_measures, time_id, propagation_id)
+        if self.is_measures_done(operations_measures):
+            return
+        profile = getattr(self, 'profile', None)
+        with profile.stage('measures') if profile else nullcontext():
+            evaluate_measures(operations_measures, output, time_id,
+                              propagation_id, self._executor,
+                              self.copy_output)
+
+    def run(self, *args, **kwargs):
+        if self.measure_threads > 1:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.measure_threads,
+                thread_name_prefix='measures')
+        try:
+            super().run(*args, **kwargs)
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
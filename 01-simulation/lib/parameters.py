@@ -1,54 +1,76 @@
 import json
+import zlib
 from pathlib import Path
 from typing import List, Optional, Tuple
 
 import numpy as np
-import pyatmosphere as pyatm
 
 import config
+from lib.checkpoint import channel_parameters, load_checkpoint
+from lib.results import create_results, create_simulation
+from lib.sharding import simulate_first_shard
+from lib.storage import read_columns, stored_results
 
 
-def _simulate_bw(channel: pyatm.Channel, iterations: int) -> float:
-    """Starts a simulation of the beam wandering value for the channel
+def _simulate_bw(channel_name: str, aperture_radiuses: List[float],
+                 iterations: int) -> float:
+    """Simulate the first iterations of the channel to estimate
+    the beam wandering value.
+
+    The iterations are the beginning of the channel data, so they are not
+    simulated again in the main simulation.
 
     Args:
-        channel: a channel to simulate
-        iterationa: the number of iterations in the simulation
+        channel_name: the name of the channel in `config.CHANNELS`
+        aperture_radiuses: list of aperture radiuses
+        iterations: the number of iterations in the simulation
 
     Returns:
         float: a simulated beam wandering value for this channel in meters
     """
-    beam_result = pyatm.simulations.BeamResult(channel, max_size=iterations)
-    sim = pyatm.simulations.Simulation([beam_result])
     print("Preliminary simulation...")
-    sim.run()
+    if (config.SIMULATION_PROCESSES > 1 or
+            config.SIMULATION_CONCURRENT_CHANNELS):
+        beam_result = simulate_first_shard(channel_name, aperture_radiuses,
+                                           iterations)
+    else:
+        results = create_results(
+            channel_name, config.CHANNELS[channel_name]['channel'],
+            aperture_radiuses, [], iterations, 0)
+        create_simulation(results).run(save_step=config.SIMULATION_SAVE_STEP)
+        beam_result = results[0]
     print(f"Beam wandering value is {beam_result.bw[0]:.1e} m.")
     return beam_result.bw[0]
 
 
 def load_aperture_radiuses(channel_name: str) -> Optional[List[float]]:
-    "Load aperture radiuses from the transmittance data file if exists."
+    "Load aperture radiuses from the checkpoint or the data file if exist."
+    checkpoint = load_checkpoint(Path(config.DATA_PATH) / channel_name)
+    if checkpoint.get('aperture_radiuses'):
+        return checkpoint['aperture_radiuses']
     try:
         path = Path(config.DATA_PATH) / channel_name / 'transmittance.csv'
-        with open(path, "r", encoding='utf-8') as file:
-            return [float(r) for r in file.readline().split(",")]
+        return [float(r) for r in read_columns(path)]
     except FileNotFoundError:
         return None
 
 
 def load_aperture_shifts(channel_name) -> Optional[List[Tuple[float, float]]]:
     "Load aperture shifts for the numerical total probability models if exist."
-    shited_aperture_paths = list((Path(config.DATA_PATH) / channel_name /
-                                 "shifted_aperture").glob("transmittance_*.csv"))
+    checkpoint = load_checkpoint(Path(config.DATA_PATH) / channel_name)
+    if checkpoint.get('aperture_shifts'):
+        return [tuple(shift) for shift in checkpoint['aperture_shifts']]
+    shited_aperture_paths = stored_results(
+        Path(config.DATA_PATH) / channel_name / "shifted_aperture",
+        "transmittance_*")
     if not shited_aperture_paths:
         return None
 
     # Pick the first arbitrary file. The parameters must be the same.
-    with open(shited_aperture_paths[0], "r", encoding='utf-8') as file:
-        return [
-            tuple(float(x) for x in c.split('_'))
-            for c in file.readline().split(",")[2:]
-            ]
+    return [
+        tuple(float(x) for x in c.split('_'))
+        for c in read_columns(shited_aperture_paths[0])[2:]
+        ]
 
 
 def default_aperture_radiuses(channel_name) -> List[float]:
@@ -56,29 +78,27 @@ def default_aperture_radiuses(channel_name) -> List[float]:
     return config.CHANNELS[channel_name]['aperture_range']
 
 
-def default_aperture_shifts(channel) -> List[Tuple[float, float]]:
+def default_aperture_shifts(
+        channel_name: str,
+        aperture_radiuses: List[float]) -> List[Tuple[float, float]]:
     "Generate aperture shifts for the numerical total probability models."
     def e_round(value: float) -> float:
         "Round a float value to 3 significant digits"
         return float(f'{value:.3e}')
 
-    bw_value = _simulate_bw(channel, config.PRELIMINARY_SIMULATION_ITERATIONS)
-    shifts_x = np.random.normal(0, bw_value, config.R0_VALUES_COUNT)
-    shifts_y = np.random.normal(0, bw_value, config.R0_VALUES_COUNT)
+    bw_value = _simulate_bw(channel_name, aperture_radiuses,
+                            config.PRELIMINARY_SIMULATION_ITERATIONS)
+    # A separate random stream, the simulation one continues from
+    # the checkpoint of the preliminary iterations
+    rng = np.random.default_rng(
+        None if config.SIMULATION_SEED is None else
+        [config.SIMULATION_SEED, zlib.crc32(channel_name.encode())])
+    shifts_x = rng.normal(0, bw_value, config.R0_VALUES_COUNT)
+    shifts_y = rng.normal(0, bw_value, config.R0_VALUES_COUNT)
     return [(e_round(x), e_round(y)) for x, y in zip(shifts_x, shifts_y)]
 
 def save_channel_parameters(channel_name, channel):
     results_path = Path(config.DATA_PATH) / channel_name
     results_path.mkdir(exist_ok=True)
-    params = {
-        "source": {"W0": channel.source.w0,
-                   "wvl": channel.source.wvl,
-                   "F0": channel.source.F0},
-        "path": {"Cn2": channel.path.phase_screen.model.Cn2,
-                 "l0": channel.path.phase_screen.model.l0,
-                 "L0": channel.path.phase_screen.model.L0,
-                 "length": channel.path.length},
-        "aperture": {"radius": channel.pupil.radius},
-    }
     with open(results_path / "params.json", "w", encoding="utf-8") as file:
-        json.dump(params, file, indent=4)
+        json.dump(channel_parameters(channel), file, indent=4)
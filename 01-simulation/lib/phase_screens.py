@@ -0,0 +1,347 @@
+"""Fast synthesis of the sparse spectrum phase screens.
+
+`pyatmosphere.SSPhaseScreen` sums M plane waves over the N x N grid as
+the complex product `(c * exp(2 pi i y fy)) @ exp(2 pi i fx x)` of the
+(N, M) and (M, N) matrices of the separable exponentials, and keeps its real
+part. The real part is the real product
+
+    [Re A, Im A] @ [Re B; -Im B]
+
+of the (N, 2M) and (2M, N) matrices, which takes half the multiplications of
+the complex one, runs as a float32 GEMM and never forms the complex N x N
+screen. The temporaries are the O(N M) exponentials.
+
+`synthesize` evaluates the sum for the same random spectrum as pyatmosphere
+draws, so the screens are the same up to the float32 rounding (check it with
+validate_phase_screens.py). `FastPhaseScreens` generates the `SSPhaseScreen`
+phase screens of a simulation with it, the complex screens and the time
+series screen cache of pyatmosphere are not available then.
+
+The random spectra are cheap to draw, the synthesis is not, and it does not
+depend on the field. `ScreenPipeline` draws the spectra of all the screens
+of a path when the first one is requested, in the order of the sequential
+generation, so the random stream and the screens are the same, and
+synthesizes them in a background thread a few screens ahead of
+the propagation into a ring of reused buffers, through the end of
+the iteration into the screens of the next one. `PipelinedPhaseScreens`
+generates the phase screens of a simulation with it.
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pyatmosphere as pyatm
+from pyatmosphere.gpu import get_xp
+
+
+def synthesize(value, fx, fy, x, y, out=None):
+    """Return the real part of the plane waves sum
+    `(value * exp(2 pi i y fy)) @ exp(2 pi i fx x)`.
+
+    Args:
+        value: an (..., M) array of the complex amplitudes
+        fx: an (..., M) array of the frequencies along x
+        fy: an (..., M) array of the frequencies along y
+        x: a (1, Nx) array of the grid coordinates
+        y: an (Ny, 1) array of the grid coordinates
+        out: the float32 array of the result
+
+    Returns:
+        an (..., Ny, Nx) float32 array
+    """
+    xp = get_xp()
+    rows = value[..., None, :] * xp.exp(2j * np.pi * y * fy[..., None, :])
+    columns = xp.exp(2j * np.pi * fx[..., :, None] * x)
+    return xp.matmul(xp.concatenate([rows.real, rows.imag], axis=-1),
+                     xp.concatenate([columns.real, -columns.imag], axis=-2),
+                     out=out)
+
+
+def draw_spectrum(phase_screen: pyatm.SSPhaseScreen,
+                  shift: Tuple[float, float] = (0, 0),
+                  wind: bool = False) -> Tuple:
+    """Draw the random spectrum of the phase screen as in
+    `pyatmosphere.SSPhaseScreen.generate_phase_screen`.
+
+    Returns:
+        the `synthesize` arguments
+    """
+    spectrum = phase_screen._get_spectrum(use_cached_spectrum=wind)
+    fx, fy = phase_screen.f_grid.get_xy(spectrum.rho, spectrum.theta)
+    return (spectrum.value, fx.ravel(), fy.ravel(),
+            phase_screen.grid.get_x() + shift[0],
+            phase_screen.grid.get_y() + shift[1])
+
+
+def draw_spectra(phase_screen: pyatm.SSPhaseScreen,
+                 batch_size: int) -> Tuple:
+    """Draw the random spectra of a stack of independent phase screens.
+
+    Returns:
+        the `synthesize` arguments
+    """
+    xp = phase_screen.grid.get_array_module()
+    f_grid = phase_screen.f_grid
+    rho = xp.stack([f_grid.get_rho() for _ in range(batch_size)])
+    theta = xp.stack([f_grid.get_theta() for _ in range(batch_size)])
+    value = (xp.array([1, 1j]) @ xp.random.normal(
+        size=(batch_size, 2, f_grid.points))).astype(np.complex64) * \
+        xp.sqrt(phase_screen._get_psd())
+    return (value, rho * xp.cos(theta), rho * xp.sin(theta),
+            phase_screen.grid.get_x(), phase_screen.grid.get_y())
+
+
+def generate_phase_screen(phase_screen: pyatm.SSPhaseScreen,
+                          shift: Tuple[float, float] = (0, 0),
+                          wind: bool = False):
+    """`pyatmosphere.SSPhaseScreen.generate_phase_screen` by `synthesize`.
+
+    Returns the real phase screen, the spectrum is cached with `wind` as in
+    pyatmosphere.
+    """
+    return synthesize(*draw_spectrum(phase_screen, shift, wind))
+
+
+def channel_phase_screen(channel: pyatm.Channel,
+                         resolution: int) -> pyatm.SSPhaseScreen:
+    """A standalone phase screen of the channel path on the grid of
+    the resolution.
+    """
+    phase_screen = channel.path.phase_screen
+    return pyatm.SSPhaseScreen(
+        model=phase_screen.model, f_grid=phase_screen.f_grid,
+        thickness=channel.path.length / len(channel.path.phase_screens),
+        wvl=channel.source.wvl,
+        grid=pyatm.RectGrid(resolution=resolution, delta=channel.grid.delta))
+
+
+class FastPhaseScreens:
+    """Mixin of `pyatmosphere.simulations.Simulation` generating
+    the `SSPhaseScreen` phase screens of the channels by `synthesize`.
+    """
+    def run(self, *args, **kwargs):
+        phase_screens = list({
+            id(phase_screen): phase_screen for channel in self.measures
+            for phase_screen in getattr(channel.path, 'phase_screens', [])
+            if type(phase_screen) is pyatm.SSPhaseScreen and
+            'generate_phase_screen' not in vars(phase_screen)}.values())
+        for phase_screen in phase_screens:
+            phase_screen.generate_phase_screen = partial(
+                generate_phase_screen, phase_screen)
+        try:
+            super().run(*args, **kwargs)
+        finally:
+            for phase_screen in phase_screens:
+                del phase_screen.generate_phase_screen
+
+
+def _same_state(state, other) -> bool:
+    "Whether the states of the numpy random generator are the same."
+    return (state[0] == other[0] and np.array_equal(state[1], other[1]) and
+            state[2:] == other[2:])
+
+
+class ScreenPipeline:
+    """Synthesizes the phase screens of a path in a background thread.
+
+    Called with a phase screen of the path and the arguments of `draw`,
+    it returns the phase screen synthesized in the background. The spectra
+    of all the screens are drawn when the first one is requested, the other
+    ones are expected in the path order with the same arguments and are
+    generated at once otherwise. A returned screen is valid until the next
+    request.
+
+    The synthesis runs across the passes over the path: when it reaches
+    the end of a pass, the spectra of the next pass are drawn with the same
+    arguments, and the random state and the cached spectra of the phase
+    screens are restored after the draws. The next pass takes them if it
+    starts with the same arguments, the same random state and no cached
+    spectra, i.e. if the sequential draws would give the same spectra, and
+    draws its own ones otherwise. So the random stream is the one of
+    the sequential generation. The random state of cupy is not compared, so
+    on GPU the spectra are not drawn ahead.
+
+    Args:
+        phase_screens: the phase screens of the path
+        draw: draws the spectrum of a phase screen, returns the `synthesize`
+              arguments
+        depth: the number of the screens synthesized ahead
+    """
+    def __init__(self, phase_screens: List[pyatm.SSPhaseScreen],
+                 draw: Callable[..., Tuple], depth: int = 2):
+        self.phase_screens = list(phase_screens)
+        self.draw = draw
+        self.depth = max(1, depth)
+        self._indices = {id(phase_screen): i for i, phase_screen
+                         in enumerate(self.phase_screens)}
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='phase-screens')
+        # The spectra of the pass and of the next one if drawn ahead
+        self._spectra: List[Optional[Tuple]] = []
+        self._futures: Dict[int, Future] = {}
+        self._arguments: Optional[Tuple] = None
+        self._next = 0
+        # The random states before and after the draws of the next pass and
+        # the spectra it cached in the phase screens
+        self._ahead: Optional[Tuple] = None
+        # The ring of the screens buffers, taken in the order of submission
+        self._buffers: List = [None] * (self.depth + 1)
+        self._submitted = 0
+
+    def _synthesize(self, spectrum: Tuple, slot: int):
+        value, fx, fy, x, y = spectrum
+        shape = (*value.shape[:-1], y.shape[0], x.shape[1])
+        buffer = self._buffers[slot]
+        if buffer is None or buffer.shape != shape:
+            buffer = self._buffers[slot] = get_xp().empty(shape,
+                                                          dtype=np.float32)
+        return synthesize(value, fx, fy, x, y, out=buffer)
+
+    def _submit(self, index: int):
+        "Submit the screen of the index, the next pass ones follow the pass."
+        if index >= len(self._spectra) == len(self.phase_screens):
+            self._draw_ahead()
+        if index < len(self._spectra):
+            spectrum, self._spectra[index] = self._spectra[index], None
+            slot = self._submitted % len(self._buffers)
+            self._submitted += 1
+            self._futures[index] = self._executor.submit(self._synthesize,
+                                                         spectrum, slot)
+
+    def _cached_spectra(self) -> List:
+        return [getattr(phase_screen, '_cached_spectrum', None)
+                for phase_screen in self.phase_screens]
+
+    def _set_cached_spectra(self, spectra: List):
+        for phase_screen, spectrum in zip(self.phase_screens, spectra):
+            if hasattr(phase_screen, '_cached_spectrum'):
+                phase_screen._cached_spectrum = spectrum
+
+    def _draw_ahead(self):
+        "Draw the spectra of the next pass with the arguments of this one."
+        if get_xp() is not np:
+            return
+        args, kwargs = self._arguments
+        state = np.random.get_state()
+        cached_spectra = self._cached_spectra()
+        self._set_cached_spectra([None] * len(self.phase_screens))
+        try:
+            spectra = [self.draw(phase_screen, *args, **kwargs)
+                       for phase_screen in self.phase_screens]
+            self._ahead = (state, np.random.get_state(),
+                           self._cached_spectra())
+        finally:
+            self._set_cached_spectra(cached_spectra)
+            np.random.set_state(state)
+        self._spectra.extend(spectra)
+
+    def _take_ahead(self, arguments: Tuple) -> bool:
+        """Continue with the pass drawn ahead if the sequential draws would
+        give the same spectra.
+        """
+        count = len(self.phase_screens)
+        if self._ahead is None or arguments != self._arguments or any(
+                index < count for index in self._futures) or any(
+                spectrum is not None for spectrum in self._cached_spectra()):
+            return False
+        state, ahead_state, ahead_spectra = self._ahead
+        if not _same_state(state, np.random.get_state()):
+            return False
+        np.random.set_state(ahead_state)
+        self._set_cached_spectra(ahead_spectra)
+        self._ahead = None
+        self._spectra = self._spectra[count:]
+        self._futures = {index - count: future
+                         for index, future in self._futures.items()}
+        return True
+
+    def _cancel(self):
+        for future in self._futures.values():
+            future.cancel()
+        wait(list(self._futures.values()))
+        self._futures = {}
+        self._ahead = None
+
+    def __call__(self, phase_screen: pyatm.SSPhaseScreen, *args, **kwargs):
+        index = self._indices[id(phase_screen)]
+        arguments = (args, kwargs)
+        if index == 0:
+            if not self._take_ahead(arguments):
+                self._cancel()
+                self._spectra = [self.draw(phase_screen, *args, **kwargs)
+                                 for phase_screen in self.phase_screens]
+                self._arguments = arguments
+            for i in range(self.depth):
+                if i not in self._futures:
+                    self._submit(i)
+        elif index != self._next or arguments != self._arguments:
+            return synthesize(*self.draw(phase_screen, *args, **kwargs))
+        self._next = index + 1
+        self._submit(index + self.depth)
+        return self._futures.pop(index).result()
+
+    def close(self):
+        self._cancel()
+        self._executor.shutdown()
+
+
+def _is_pipelined(path) -> bool:
+    "Whether all the phase screens of the path are sparse spectrum ones."
+    phase_screens = getattr(path, 'phase_screens', [])
+    return bool(phase_screens) and all(
+        type(phase_screen) is pyatm.SSPhaseScreen
+        for phase_screen in phase_screens)
+
+
+class PipelinedPhaseScreens:
+    """Mixin of `pyatmosphere.simulations.Simulation` and
+    `lib.batched.BatchedSimulation` synthesizing the `SSPhaseScreen` phase
+    screens of the channels by `ScreenPipeline`.
+
+    Args:
+        pipeline_depth: the number of the screens synthesized ahead
+    """
+    def __init__(self, *args, pipeline_depth: int = 2, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pipeline_depth = pipeline_depth
+        self._pipelines: Dict[int, ScreenPipeline] = {}
+
+    def _pipeline(self, path, draw: Callable[..., Tuple]) -> ScreenPipeline:
+        if id(path) not in self._pipelines:
+            self._pipelines[id(path)] = ScreenPipeline(
+                path.phase_screens, draw, self.pipeline_depth)
+        return self._pipelines[id(path)]
+
+    def generate_phase_screens(self, phase_screen: pyatm.PhaseScreen,
+                               batch_size: int):
+        "`lib.batched.BatchedSimulation.generate_phase_screens`."
+        path = self.channel.path
+        if not _is_pipelined(path):
+            return super().generate_phase_screens(phase_screen, batch_size)
+        return self._pipeline(path, draw_spectra)(phase_screen, batch_size)
+
+    def run(self, *args, **kwargs):
+        phase_screens = []
+        if not hasattr(super(), 'generate_phase_screens'):
+            paths = {id(channel.path): channel.path
+                     for channel in self.measures}
+            for path in paths.values():
+                if not _is_pipelined(path) or any(
+                        'generate_phase_screen' in vars(phase_screen)
+                        for phase_screen in path.phase_screens):
+                    continue
+                pipeline = self._pipeline(path, draw_spectrum)
+                for phase_screen in path.phase_screens:
+                    phase_screen.generate_phase_screen = partial(
+                        pipeline, phase_screen)
+                    phase_screens.append(phase_screen)
+        try:
+            super().run(*args, **kwargs)
+        finally:
+            for phase_screen in phase_screens:
+                del phase_screen.generate_phase_screen
+            for pipeline in self._pipelines.values():
+                pipeline.close()
+            self._pipelines.clear()
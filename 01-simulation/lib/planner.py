@@ -0,0 +1,242 @@
+"""Grid and phase screens planner of the channels.
+
+`plan_channel` derives the coarsest grid and the fewest phase screens of
+a channel which satisfy the sampling criteria:
+
+- the grid step resolves the beam radius at the source and at the receiver,
+  the Fried parameter r0 of the turbulence of the whole path and
+  the smallest aperture radius, each by a number of points,
+- the grid side holds the long-term beam radius at the receiver
+  `W_LT = W (1 + 1.33 sigma_R^2 Lambda^(5/6))^(1/2)`, the source beam and
+  the largest aperture,
+- the vacuum step between the phase screens `dz` is short enough for
+  the Fresnel spread of the grid step to stay on the grid,
+  `dz <= N delta^2 / wvl`,
+- the turbulence of the slab of a phase screen is weak, its Rytov variance
+  `1.23 Cn2 k^(7/6) dz^(11/6)` is below a bound.
+
+The resolution is rounded up to a power of two. `IterationCost` predicts
+the time of an iteration from the times of the propagation step and
+the intensity pass on the grid measured with the FFT backend in use, and
+the memory of a realization by `lib.batched.realization_memory`.
+`check_plan` compares the configured grid with the planned one, and
+the configured phase screens with the ones `screens_count` requires on
+the configured grid.
+"""
+
+import copy
+import math
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pyatmosphere as pyatm
+from pyatmosphere.gpu import get_xp
+from pyatmosphere.theory.atmosphere import get_r0, get_rytov2
+from pyatmosphere.theory.sources import GaussianBeam
+
+from lib import fft
+from lib.batched import realization_memory
+from lib.phase_screens import synthesize
+
+
+@dataclass
+class GridPlan:
+    "The grid and the number of the phase screens of a channel path."
+    resolution: int
+    delta: float
+    count: int
+    # the smallest grid side satisfying the criteria
+    field_of_view: float = 0
+
+    @property
+    def side(self) -> float:
+        return self.resolution * self.delta
+
+
+def configured_plan(channel: pyatm.Channel) -> GridPlan:
+    "The grid and the number of the phase screens of the channel."
+    return GridPlan(max(channel.grid.resolution), channel.grid.delta,
+                    len(channel.path.phase_screens))
+
+
+def long_term_radius(channel: pyatm.Channel) -> float:
+    "The long-term beam radius at the receiver in the weak turbulence."
+    source = channel.source
+    beam = GaussianBeam(source.wvl, source.w0, source.F0)
+    length = channel.path.length
+    rytov2 = get_rytov2(channel.path.phase_screen.model.Cn2, beam.k, length)
+    return beam.get_w(length) * math.sqrt(
+        1 + 1.33 * rytov2 * beam.get_Lambda(length)**(5 / 6))
+
+
+def screens_count(channel: pyatm.Channel, resolution: int, delta: float,
+                  slab_rytov: float = 0.1) -> int:
+    """The fewest phase screens of the channel on the grid satisfying
+    the Fresnel and the slab Rytov variance criteria.
+    """
+    source = channel.source
+    length = channel.path.length
+    k = 2 * math.pi / source.wvl
+    fresnel_count = source.wvl * length / (resolution * delta**2)
+    rytov_count = length / (slab_rytov / (
+        1.23 * channel.path.phase_screen.model.Cn2 * k**(7 / 6)))**(6 / 11)
+    return max(1, math.ceil(fresnel_count), math.ceil(rytov_count))
+
+
+def plan_channel(channel: pyatm.Channel, aperture_radiuses: Sequence[float],
+                 beam_points: float = 20, r0_points: float = 10,
+                 aperture_points: float = 2, beam_radiuses: float = 4,
+                 slab_rytov: float = 0.1) -> GridPlan:
+    """Plan the grid and the phase screens of the channel.
+
+    Args:
+        channel: the channel with the `MVKModel` phase screens
+        aperture_radiuses: the aperture radiuses of the channel results
+        beam_points: the grid points per the beam radius
+        r0_points: the grid points per the Fried parameter
+        aperture_points: the grid points per the smallest aperture radius
+        beam_radiuses: the grid side in the long-term beam radiuses
+        slab_rytov: the largest Rytov variance of the slab of a phase screen
+
+    Returns:
+        the coarsest grid and the fewest phase screens satisfying
+        the sampling criteria
+    """
+    source = channel.source
+    beam = GaussianBeam(source.wvl, source.w0, source.F0)
+    length = channel.path.length
+    Cn2 = channel.path.phase_screen.model.Cn2
+    beam_radius = long_term_radius(channel)
+    delta = min(min(source.w0, beam.get_w(length)) / beam_points,
+                get_r0(Cn2, beam.k, length) / r0_points,
+                min(aperture_radiuses) / aperture_points)
+    side = max(beam_radiuses * max(source.w0, beam_radius),
+               2 * max(aperture_radiuses))
+    resolution = 2**math.ceil(math.log2(side / delta))
+    return GridPlan(resolution, delta,
+                    screens_count(channel, resolution, delta, slab_rytov),
+                    side)
+
+
+def planned_channel(channel: pyatm.Channel, plan: GridPlan) -> pyatm.Channel:
+    "A copy of the channel with the planned grid and phase screens."
+    phase_screen = channel.path.phase_screen
+    return pyatm.Channel(
+        grid=pyatm.RectGrid(resolution=plan.resolution, delta=plan.delta),
+        source=copy.deepcopy(channel.source),
+        path=pyatm.IdenticalPhaseScreensPath(
+            phase_screen=pyatm.SSPhaseScreen(
+                model=copy.deepcopy(phase_screen.model),
+                f_grid=copy.deepcopy(phase_screen.f_grid)),
+            length=channel.path.length, count=plan.count),
+        pupil=copy.deepcopy(channel.pupil))
+
+
+def _best_time(function, repeats: int) -> float:
+    function()
+    times = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start_time)
+    return min(times)
+
+
+class IterationCost:
+    """Predicts the time and the memory of the iterations.
+
+    The time of an iteration is the time of a propagation step, a vacuum
+    propagation and the phase screen synthesis, for every phase screen and
+    the time of the intensity passes of the measures, two for every aperture
+    and a few for the beam moments. The step and the pass times are measured
+    once for every resolution.
+
+    Args:
+        repeats: the number of the timed repeats of the step and the pass
+    """
+    def __init__(self, repeats: int = 3):
+        self.repeats = repeats
+        # The step and the pass times by the resolution and the points
+        self._times: Dict[Tuple[int, int], Tuple[float, float]] = {}
+
+    def _measure(self, resolution: int, points: int) -> Tuple[float, float]:
+        xp = get_xp()
+        shape = (resolution, resolution)
+        work = xp.zeros(shape, dtype=fft.transform_dtype())
+        transfer_function = xp.ones(shape, dtype=np.complex64)
+        field = xp.ones(shape, dtype=np.complex64)
+        value = xp.ones(points, dtype=np.complex64)
+        frequencies = xp.linspace(-1, 1, points, dtype=np.float32)
+        x = xp.linspace(-1, 1, resolution, dtype=np.float32)
+
+        def step():
+            spectrum = fft.fft2_inplace(work)
+            spectrum *= transfer_function
+            field[...] = fft.ifft2_inplace(spectrum)
+            xp.multiply(field, xp.exp(-1j * synthesize(
+                value, frequencies, frequencies, x[None, :], x[:, None])),
+                out=field)
+
+        def intensity_pass():
+            return (abs(field)**2 * transfer_function.real).sum()
+
+        return (_best_time(step, self.repeats),
+                _best_time(intensity_pass, self.repeats))
+
+    def times(self, resolution: int, points: int) -> Tuple[float, float]:
+        "The times of a propagation step and an intensity pass, s."
+        if (resolution, points) not in self._times:
+            self._times[resolution, points] = self._measure(resolution,
+                                                            points)
+        return self._times[resolution, points]
+
+    def iteration_time(self, channel: pyatm.Channel,
+                       apertures_count: int) -> float:
+        "The predicted time of an iteration of the channel, s."
+        plan = configured_plan(channel)
+        step_time, pass_time = self.times(
+            plan.resolution, channel.path.phase_screen.f_grid.points)
+        return (plan.count * step_time +
+                (2 * apertures_count + 3) * pass_time)
+
+    @staticmethod
+    def memory(channel: pyatm.Channel, batch_size: int = 1) -> int:
+        """The predicted peak memory of the simulation in bytes, the batch
+        and the two cached transfer functions.
+        """
+        resolution_x, resolution_y = channel.grid.resolution
+        return (batch_size * realization_memory(channel) +
+                16 * resolution_x * resolution_y)
+
+
+def oversampling(configured: GridPlan, planned: GridPlan) -> float:
+    "The ratio of the configured grid points to the planned ones."
+    return (configured.resolution / planned.resolution)**2
+
+
+def check_plan(configured: GridPlan, planned: GridPlan,
+               max_oversampling: float = 2,
+               required_count: Optional[int] = None) -> List[str]:
+    """The problems of the configured grid compared with the planned one.
+
+    The phase screens are compared with the `required_count` of
+    the configured grid, see `screens_count`, the planned ones if None.
+    """
+    if required_count is None:
+        required_count = planned.count
+    problems = []
+    if oversampling(configured, planned) > max_oversampling:
+        problems.append(f"oversampled: {oversampling(configured, planned):g} "
+                        f"times the planned grid points")
+    if configured.delta > planned.delta * (1 + 1e-9):
+        problems.append(f"undersampled: the grid step {configured.delta:g} "
+                        f"is above {planned.delta:.3g}")
+    if configured.side < planned.field_of_view:
+        problems.append(f"undersampled: the grid side {configured.side:g} "
+                        f"is below {planned.field_of_view:.3g}")
+    if configured.count < required_count:
+        problems.append(f"undersampled: {configured.count} phase screens "
+                        f"are fewer than {required_count}")
+    return problems
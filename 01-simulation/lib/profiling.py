@@ -0,0 +1,393 @@
+"""Per-stage timing of the simulation loop.
+
+`Profiling` records the wall and CPU time of the stages of each iteration:
+the phase screens synthesis, the propagation (the vacuum propagation FFTs
+and the phase screens application), every measure, the pupil application
+(`append_pupil`) inside the measures and the saving of the results. The time
+of a stage excludes the time of the stages nested in it, and the rest of
+the iteration is recorded as the `other` stage, so the stage times add up to
+the simulation time.
+
+The records are kept by the `SimulationProfile` result, which stores them
+with the iterations/s, the peak resident memory and the hits of the field
+cache (see lib/field_cache.py) in the `profile.json` and `profile.csv` files
+next to `params.json`. The records of the continued simulations are
+accumulated.
+
+The CPU time is the time of the whole process, including the FFT and writer
+threads. With the background saving the `save` stage is the time the loop
+spends on copying the results and waiting for the writer. On GPU the device
+is synchronized at the stage bounds, which slows the simulation down.
+
+The stages are recorded on the simulation thread: the measures evaluated by
+the threads of `lib.parallel.ParallelMeasures` are recorded as the single
+`measures` stage.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+import pyatmosphere as pyatm
+from pyatmosphere import gpu
+
+try:
+    import resource
+except ModuleNotFoundError:  # Windows
+    resource = None
+
+PROFILE_FILE = 'profile.json'
+PROFILE_TABLE = 'profile.csv'
+
+
+def peak_rss() -> Optional[int]:
+    "The peak resident memory of the process in bytes if known."
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def _synchronize():
+    if gpu.config['use_gpu']:
+        gpu.get_xp().cuda.Device().synchronize()
+
+
+class SimulationProfile(pyatm.simulations.Result):
+    """A result without measures, which keeps the stage times of
+    the simulation and stores them in the `save_path` JSON file and
+    the CSV file next to it.
+    """
+    def __init__(self, channel: Optional[pyatm.Channel] = None, **kwargs):
+        # Calls, wall and CPU seconds by the stage names
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.iterations = 0
+        self.seconds = 0.
+        self.cpu_seconds = 0.
+        self.peak_rss: Optional[int] = None
+        # The hits and the lookups of the field cache by the quantities
+        self.field_cache: Dict[str, List[int]] = {}
+        self._stack: List[List] = []
+        # The thread the stages are recorded on
+        self._thread = threading.get_ident()
+        self._start_times: Optional[List[float]] = None
+        super().__init__(channel, [], **kwargs)
+
+    @contextmanager
+    def stage(self, name: str):
+        """Record the time of the block as the stage.
+
+        A stage nested in the stage of the same name is a part of it, and
+        the stages of the other threads are a part of the stage they are
+        waited in.
+        """
+        if (threading.get_ident() != self._thread or
+                self._stack and self._stack[-1][0] == name):
+            yield
+            return
+        _synchronize()
+        # The name and the wall and CPU time of the nested stages
+        self._stack.append([name, 0., 0.])
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            _synchronize()
+            wall = time.perf_counter() - start_wall
+            cpu = time.process_time() - start_cpu
+            _, nested_wall, nested_cpu = self._stack.pop()
+            record = self.stages.setdefault(
+                name, {'calls': 0, 'wall': 0., 'cpu': 0.})
+            record['calls'] += 1
+            record['wall'] += wall - nested_wall
+            record['cpu'] += cpu - nested_cpu
+            if self._stack:
+                self._stack[-1][1] += wall
+                self._stack[-1][2] += cpu
+
+    def timed(self, name: str, function):
+        "Wrap the function to record its calls as the stage."
+        @wraps(function)
+        def timed_function(*args, **kwargs):
+            with self.stage(name):
+                return function(*args, **kwargs)
+        return timed_function
+
+    def timed_generator(self, name: str, function):
+        "Wrap the generator function to record its steps as the stage."
+        @wraps(function)
+        def timed_function(*args, **kwargs):
+            generator = function(*args, **kwargs)
+            while True:
+                with self.stage(name):
+                    try:
+                        value = next(generator)
+                    except StopIteration as stop:
+                        return stop.value
+                yield value
+        return timed_function
+
+    def add_field_cache(self, counts: Dict[str, Tuple[int, int]]):
+        "Add the hits and the lookups of the field cache of a run."
+        for name, (hits, lookups) in counts.items():
+            record = self.field_cache.setdefault(name, [0, 0])
+            record[0] += hits
+            record[1] += lookups
+
+    def start(self):
+        self._thread = threading.get_ident()
+        self._start_times = [time.perf_counter(), time.process_time()]
+
+    def stop(self):
+        self.seconds, self.cpu_seconds = self.elapsed
+        self._start_times = None
+
+    @property
+    def elapsed(self):
+        "The wall and CPU seconds of the simulations."
+        if self._start_times is None:
+            return self.seconds, self.cpu_seconds
+        return (self.seconds + time.perf_counter() - self._start_times[0],
+                self.cpu_seconds + time.process_time() - self._start_times[1])
+
+    @property
+    def rate(self) -> float:
+        "The simulated iterations per second."
+        seconds = self.elapsed[0]
+        return self.iterations / seconds if seconds else 0.
+
+    def report(self) -> Dict:
+        rss = peak_rss()
+        if rss is not None:
+            self.peak_rss = max(rss, self.peak_rss or 0)
+        seconds, cpu_seconds = self.elapsed
+        return {
+            'iterations': self.iterations,
+            'seconds': seconds,
+            'cpu_seconds': cpu_seconds,
+            'iterations_per_second': self.rate,
+            'peak_rss': self.peak_rss,
+            'stages': self.stages,
+            'field_cache': self.field_cache,
+        }
+
+    def snapshot_output(self):
+        self.save_output()
+
+    def save_output(self):
+        if not self.save_path:
+            return
+        save_report(self.report(), Path(self.save_path))
+
+    def load_output(self):
+        with open(self.save_path, 'r', encoding='utf-8') as file:
+            report = json.load(file)
+        self.iterations = report['iterations']
+        self.seconds = report['seconds']
+        self.cpu_seconds = report['cpu_seconds']
+        self.peak_rss = report['peak_rss']
+        self.stages = report['stages']
+        self.field_cache = report.get('field_cache', {})
+
+    def print_output(self):
+        report = self.report()
+        name = Path(self.save_path).parent if self.save_path else ''
+        rss = (f", peak RSS {report['peak_rss'] / 2**20:.0f} MiB"
+               if report['peak_rss'] else '')
+        print(f"{name}: {report['iterations']} iterations, "
+              f"{report['iterations_per_second']:.2f} iterations/s{rss}")
+        # The measures are summed up by the results
+        stages: Dict[str, List[float]] = {}
+        for stage, record in self.stages.items():
+            stage = stage.split('.', 1)[0]
+            stages.setdefault(stage, [0., 0.])
+            stages[stage][0] += record['wall']
+            stages[stage][1] += record['cpu']
+        total = sum(wall for wall, _ in stages.values()) or 1
+        for stage, (wall, cpu) in sorted(stages.items(),
+                                         key=lambda item: -item[1][0]):
+            print(f"    {stage:<40} {wall:>9.2f} s {cpu:>9.2f} s CPU "
+                  f"{100 * wall / total:>5.1f}%")
+        if self.field_cache:
+            print("    field cache hits: " + ', '.join(
+                f"{name} {hits}/{lookups}"
+                for name, (hits, lookups) in self.field_cache.items()))
+
+    def plot_output(self):
+        self.print_output()
+
+
+def save_report(report: Dict, path: Path):
+    "Store the profile report in the JSON file and the CSV file next to it."
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=4)
+    os.replace(tmp_path, path)
+
+    table_path = path.with_name(PROFILE_TABLE)
+    tmp_path = table_path.with_name(table_path.name + '.tmp')
+    df = pd.DataFrame([
+        {'stage': stage, **record,
+         'wall_per_iteration': (record['wall'] / report['iterations']
+                                if report['iterations'] else 0.)}
+        for stage, record in report['stages'].items()],
+        columns=['stage', 'calls', 'wall', 'cpu', 'wall_per_iteration'])
+    df.sort_values('wall', ascending=False).to_csv(
+        tmp_path, index=False, float_format='{:.4e}'.format)
+    os.replace(tmp_path, table_path)
+
+
+def merge_profiles(paths: List[Path], merged_path: Path):
+    """Sum up the profile reports of the shards.
+
+    The shards are simulated in parallel, so the merged iterations/s is
+    the sum of the shard ones.
+    """
+    reports = []
+    for path in paths:
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                reports.append(json.load(file))
+        except FileNotFoundError:
+            pass
+    if not reports:
+        return
+    stages: Dict[str, Dict[str, float]] = {}
+    field_cache: Dict[str, List[int]] = {}
+    for report in reports:
+        for stage, record in report['stages'].items():
+            merged = stages.setdefault(
+                stage, {'calls': 0, 'wall': 0., 'cpu': 0.})
+            for key in merged:
+                merged[key] += record[key]
+        for name, counts in report.get('field_cache', {}).items():
+            merged_counts = field_cache.setdefault(name, [0, 0])
+            merged_counts[0] += counts[0]
+            merged_counts[1] += counts[1]
+    rss = [report['peak_rss'] for report in reports if report['peak_rss']]
+    save_report({
+        'iterations': sum(report['iterations'] for report in reports),
+        'seconds': max(report['seconds'] for report in reports),
+        'cpu_seconds': sum(report['cpu_seconds'] for report in reports),
+        'iterations_per_second': sum(report['iterations_per_second']
+                                     for report in reports),
+        'peak_rss': max(rss, default=None),
+        'stages': stages,
+        'field_cache': field_cache,
+    }, merged_path)
+
+
+class Profiling:
+    """Mixin of `pyatmosphere.simulations.Simulation` recording the stage
+    times in the `SimulationProfile` of the results.
+
+    Args:
+        print_step: print the summary of the profile every `print_step`
+                    iterations, not printed if None
+    """
+    def __init__(self, *args, print_step: Optional[int] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.print_step = print_step
+        self.profile = next(
+            (result for result in self.results_list
+             if isinstance(result, SimulationProfile)), None
+            ) or SimulationProfile()
+        # The stage names of the measures
+        self._measure_stages = {
+            id(measures): f"measure {type(result).__name__}.{measures.name}"
+            for result in self.results_list
+            for measures in result.measures}
+
+    def _instrument(self):
+        "Wrap the phase screens, the propagation and the pupils."
+        self._wrapped = []
+        objects = []
+        for channel in self.measures:
+            objects += [(channel, 'generator', self.profile.timed_generator,
+                        'propagation')]
+            objects += [(phase_screen, 'generate', self.profile.timed,
+                         'phase screens')
+                        for phase_screen in channel.path.phase_screens]
+        for result in self.results_list:
+            pupils = [*getattr(result, 'pupils', []),
+                      getattr(result, 'aperture', None)]
+            objects += [(pupil, 'output', self.profile.timed,
+                         'append_pupil') for pupil in pupils if pupil]
+        for obj, attribute, wrap, name in objects:
+            if attribute not in vars(obj):
+                setattr(obj, attribute, wrap(name, getattr(obj, attribute)))
+                self._wrapped.append((obj, attribute))
+
+    def _uninstrument(self):
+        for obj, attribute in self._wrapped:
+            delattr(obj, attribute)
+        self._wrapped = []
+
+    def process_operations(self, output, operations_measures, time_id,
+                           propagation_id=None):
+        for operations, measures_list in operations_measures.items():
+            if self.is_measures_done(measures_list):
+                continue
+            with self.profile.stage(
+                    self._measure_stages.get(id(measures_list[0]),
+                                             'measure')):
+                super().process_operations(
+                    output, {operations: measures_list}, time_id,
+                    propagation_id)
+
+    def iter(self):
+        lengths = [len(measures) for measures in self.flattened_measures()]
+        with self.profile.stage('other'):
+            super().iter()
+        iterations = self.profile.iterations
+        self.profile.iterations += max(
+            (len(measures) - length for measures, length
+             in zip(self.flattened_measures(), lengths)), default=0)
+        if (self.print_step and self.profile.iterations // self.print_step >
+                iterations // self.print_step):
+            self.profile.print_output()
+
+    def propagate(self, *args, **kwargs):
+        with self.profile.stage('propagation'):
+            return super().propagate(*args, **kwargs)
+
+    def generate_phase_screens(self, *args, **kwargs):
+        with self.profile.stage('phase screens'):
+            return super().generate_phase_screens(*args, **kwargs)
+
+    def result_columns(self, result, *args, **kwargs):
+        with self.profile.stage(f"measure {type(result).__name__}"):
+            return super().result_columns(result, *args, **kwargs)
+
+    def process_output(self, iteration, plot_step, save_step):
+        if save_step and iteration % save_step == 0:
+            with self.profile.stage('save'):
+                super().process_output(iteration, plot_step=plot_step,
+                                       save_step=save_step)
+        else:
+            super().process_output(iteration, plot_step=plot_step,
+                                   save_step=save_step)
+
+    def run(self, *args, **kwargs):
+        self._instrument()
+        self.profile.start()
+        try:
+            super().run(*args, **kwargs)
+        finally:
+            self._uninstrument()
+            self.profile.stop()
+            # The cache of `lib.field_cache.SharedFieldCache`
+            field_cache = getattr(self, 'field_cache', None)
+            if field_cache is not None:
+                self.profile.add_field_cache(field_cache.counts())
+            self.profile.save_output()
+            if self.print_step:
+                self.profile.print_output()
@@ -0,0 +1,251 @@
+"""Propagation through the phase screens with the cached transfer functions.
+
+The phase screens of a path are usually equally spaced on the same grid, so
+the vacuum steps between them share the transfer function, which does not
+change from one iteration to another either. The `Propagator` of a channel
+keeps the transfer functions of its step lengths and propagates the fields
+through the work buffers allocated once for every fields shape: the FFTs and
+the products are computed in place, so the step loop allocates no large
+arrays with the 'scipy' FFT backend (see lib/fft.py). With an even
+resolution the fftshifts of the centered pyatmosphere FFTs cancel, and
+a step is just `ifft2(H * fft2(field))` with the transfer function `H` in
+the FFT order.
+
+The paths with the `plane_deltas` of the source, the phase screen and
+the receiver planes, as `lib.scaled_propagation.ScaledPhaseScreensPath`,
+are propagated by the scaled steps: a step from the plane of the grid step
+`delta` to the plane of `m * delta` over `dz` has the transfer function
+`exp(i k dz - i pi wvl dz f^2 / m) / m`. With the grid step linear in
+the distance, the scaled field differs from the field by the quadratic phase
+`exp(-i k b r^2 / (2 delta_0))` of the source plane coordinates,
+`b = (delta_n - delta_0) / L`, which is applied to the source output and
+removed from the output (see J. D. Schmidt, Numerical simulation of optical
+wave propagation, ch. 8). The fields between the steps carry this phase.
+
+The transfer functions and the buffers are counted in `allocations`, and
+they are released by `release_propagator` at the end of a simulation.
+"""
+
+import weakref
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pyatmosphere as pyatm
+from pyatmosphere import gpu
+
+from lib import fft
+
+_propagators: 'weakref.WeakKeyDictionary[pyatm.Channel, Propagator]' = \
+    weakref.WeakKeyDictionary()
+
+
+class Propagator:
+    """The vacuum steps of the channel path with the cached transfer
+    functions and work buffers.
+
+    The cache is cleared if the grid, the wavelength or the FFT precision of
+    the channel change.
+    """
+    def __init__(self, channel: pyatm.Channel):
+        self.channel = channel
+        # The number of the computed transfer functions and buffers
+        self.allocations = 0
+        self._transfer_functions: Dict[Tuple, object] = {}
+        self._quadratic_phases: Dict[Tuple, object] = {}
+        self._buffers: Dict[Tuple, object] = {}
+        self._key: Tuple = ()
+
+    def _check_cache(self):
+        grid = self.channel.grid
+        key = (grid.resolution, grid.delta,
+               getattr(self.channel.path, 'source_delta', None),
+               self.channel.source.wvl, fft.transform_dtype(),
+               gpu.config['use_gpu'])
+        if key != self._key:
+            self.clear()
+            self._key = key
+
+    def clear(self):
+        "Release the transfer functions and the buffers."
+        self._transfer_functions.clear()
+        self._quadratic_phases.clear()
+        self._buffers.clear()
+        self._key = ()
+
+    @property
+    def is_centered(self) -> bool:
+        "Whether the FFTs are shifted, which is the case of odd resolutions."
+        return any(size % 2 for size in self.channel.grid.shape)
+
+    def plane_deltas(self) -> List[float]:
+        """The grid steps of the source, the phase screen and the receiver
+        planes of the path, all of them the channel grid step unless
+        the path is scaled.
+        """
+        path = self.channel.path
+        if hasattr(path, 'plane_deltas'):
+            return path.plane_deltas()
+        return [self.channel.grid.delta] * (len(path.phase_screens) + 2)
+
+    def transfer_function(self, length: float, delta: Optional[float] = None,
+                          scale: float = 1):
+        """The transfer function of the vacuum step over the length with
+        the normalization factors of the pyatmosphere FFTs, from the grid
+        step `delta`, the channel grid step by default, to `scale` times it.
+        """
+        self._check_cache()
+        grid = self.channel.grid
+        delta = grid.delta if delta is None else delta
+        # The differences of the screen positions differ in the last digits
+        key = tuple(float(f"{value:.12g}") for value in (length, delta, scale))
+        if key not in self._transfer_functions:
+            xp = gpu.get_xp()
+            f_grid = pyatm.RectGrid(resolution=grid.resolution,
+                                    delta=delta).get_f_grid()
+            k = self.channel.source.k
+            f2 = xp.asarray(f_grid.get_rho2(), dtype=np.float64)
+            normalization = (delta * f2.shape[0] * f_grid.delta)**2
+            transfer_function = (
+                normalization * np.exp(1j * k * length) / scale *
+                xp.exp(-1j * np.pi * length * (2 * np.pi / k) * f2 / scale))
+            if not self.is_centered:
+                transfer_function = xp.fft.ifftshift(transfer_function)
+            self._transfer_functions[key] = transfer_function.astype(
+                fft.transform_dtype())
+            self.allocations += 1
+        return self._transfer_functions[key]
+
+    def quadratic_phase(self, delta: float, curvature: float):
+        "The phase factor `exp(i k curvature r^2 / 2)` on the grid step."
+        self._check_cache()
+        key = (delta, curvature)
+        if key not in self._quadratic_phases:
+            xp = gpu.get_xp()
+            rho2 = xp.asarray(pyatm.RectGrid(
+                resolution=self.channel.grid.resolution,
+                delta=delta).get_rho2(), dtype=np.float64)
+            self._quadratic_phases[key] = xp.exp(
+                0.5j * self.channel.source.k * curvature * rho2).astype(
+                    np.complex64)
+            self.allocations += 1
+        return self._quadratic_phases[key]
+
+    def buffer(self, name: str, shape: Tuple[int, ...], dtype):
+        "The work buffer of the name, shape and dtype."
+        self._check_cache()
+        key = (name, tuple(shape), np.dtype(dtype))
+        if key not in self._buffers:
+            self._buffers[key] = gpu.get_xp().empty(shape, dtype=dtype)
+            self.allocations += 1
+        return self._buffers[key]
+
+    def vacuum(self, field, length: float, out,
+               delta: Optional[float] = None, scale: float = 1):
+        """Propagate the fields in vacuum over the length into `out`, from
+        the grid step `delta` to `scale` times it.
+        """
+        if length <= 0:
+            out[...] = field
+            return out
+        transfer_function = self.transfer_function(length, delta, scale)
+        if self.is_centered:
+            out[...] = fft.ifft2(transfer_function * fft.fft2(field))
+            return out
+        work = self.buffer('work', field.shape, fft.transform_dtype())
+        work[...] = field
+        spectrum = fft.fft2_inplace(work)
+        spectrum *= transfer_function
+        out[...] = fft.ifft2_inplace(spectrum)
+        return out
+
+    def steps(self, input, shape: Tuple[int, ...],
+              generate: Callable[[pyatm.PhaseScreen], object]):
+        """Propagate the input broadcast to the fields shape through
+        the path.
+
+        Args:
+            input: the source output, the one on the source grid is taken
+                   for a scaled path
+            shape: the shape of the fields, (..., N, N)
+            generate: returns the phase screens of the fields shape
+
+        Yields:
+            the fields after every phase screen and the phase screens,
+            the fields are valid until the next step
+
+        Returns:
+            the output fields as a new array
+        """
+        xp = gpu.get_xp()
+        path = self.channel.path
+        path.init_phase_screens()
+        deltas = self.plane_deltas()
+        # The quadratic phase of the scaled steps
+        expansion = (deltas[-1] - deltas[0]) / path.length
+        field = self.buffer('field', shape, np.complex64)
+        if hasattr(path, 'source_output'):
+            input = path.source_output()
+        field[...] = input
+        if expansion:
+            field *= self.quadratic_phase(deltas[0], -expansion / deltas[0])
+        phase = self.buffer('phase', shape, np.complex64)
+        for i, phase_screen in enumerate(path.phase_screens):
+            length = (path.positions[i] - path.positions[i - 1] if i > 0
+                      else path.positions[0])
+            phase_screens = generate(phase_screen)
+            self.vacuum(field, length, out=field, delta=deltas[i],
+                        scale=deltas[i + 1] / deltas[i])
+            xp.multiply(phase_screens, -1j, out=phase)
+            xp.exp(phase, out=phase)
+            field *= phase
+            # `PhaseScreensPath.append_losses` of the step
+            losses_db = (path.losses_db * length / path.length or
+                         path.losses_db)
+            if losses_db:
+                field *= 10**(-losses_db / 20)
+            yield field, phase_screens
+        output = self.vacuum(field, path.length - path.positions[-1],
+                             out=xp.empty(shape, dtype=np.complex64),
+                             delta=deltas[-2],
+                             scale=deltas[-1] / deltas[-2])
+        if expansion:
+            output *= self.quadratic_phase(deltas[-1],
+                                           expansion / deltas[-1])
+        return output
+
+    def generator(self, input, *args, **kwargs):
+        "`pyatmosphere.PhaseScreensPath.generator` of the channel path."
+        return (yield from self.steps(
+            input, self.channel.grid.shape[::-1],
+            lambda phase_screen: phase_screen.generate(*args, **kwargs)))
+
+
+def get_propagator(channel: pyatm.Channel) -> Propagator:
+    "The propagator of the channel, created once."
+    if channel not in _propagators:
+        _propagators[channel] = Propagator(channel)
+    return _propagators[channel]
+
+
+def release_propagator(channel: pyatm.Channel):
+    "Release the cached arrays of the channel propagator."
+    if channel in _propagators:
+        _propagators[channel].clear()
+
+
+class CachedPropagation:
+    """Mixin of `pyatmosphere.simulations.Simulation` propagating
+    the channels with their propagators.
+    """
+    def run(self, *args, **kwargs):
+        paths = [channel.path for channel in self.measures
+                 if isinstance(channel.path, pyatm.PhaseScreensPath) and
+                 'generator' not in vars(channel.path)]
+        for path in paths:
+            path.generator = get_propagator(path.channel).generator
+        try:
+            super().run(*args, **kwargs)
+        finally:
+            for path in paths:
+                del path.generator
+                release_propagator(path.channel)
@@ -0,0 +1,241 @@
+from pathlib import Path
+from typing import List, Optional
+
+from pyatmosphere import Channel, CirclePupil, simulations
+
+import config
+from lib.aperture_correlation import ApertureCorrelation
+from lib.batched import BatchedSimulation
+from lib.beam_moments import FusedBeamResult
+from lib.channel_group import SharedPhaseScreens
+from lib.checkpoint import CHECKPOINT_FILE, Checkpoint, Checkpointing
+from lib.convergence import CONVERGENCE_FILE, ConvergenceMonitor
+from lib.encircled_energy import ENCIRCLED_ENERGY_FILE, EncircledEnergyResult
+from lib.fft import default_workers, use_backend
+from lib.field_cache import SharedFieldCache, TrackedPDTResult
+from lib.frozen_flow import FrozenFlow
+from lib.parallel import ParallelMeasures
+from lib.phase_screens import FastPhaseScreens, PipelinedPhaseScreens
+from lib.profiling import PROFILE_FILE, Profiling, SimulationProfile
+from lib.propagation import CachedPropagation
+from lib.screen_bank import BANK_DRAWS_FILE, BankDraws, BankedPhaseScreens
+from lib.signals import SignalControl
+from lib.shifted_aperture import ApertureShifts, ShiftedTrackedPDTResult
+from lib.storage import (ChunkedBeamResult, ChunkedPDTResult,
+                         ChunkedShiftedTrackedPDTResult,
+                         ChunkedTrackedPDTResult, stored_tables)
+from lib.writer import BackgroundSaving
+
+
+def create_results(
+        channel_name: str,
+        channel: Channel,
+        aperture_radiuses: List[float],
+        aperture_shifts: ApertureShifts,
+        iterations: int,
+        semianalytical_iterations: int,
+        results_path: Optional[Path] = None,
+        shards: int = 1,
+        shard: int = 0,
+        adaptive_stopping: Optional[bool] = None
+        ) -> List[simulations.Result]:
+    """Declare the required results for a simultaion.
+
+    Args:
+        channel_name: the name of the folder where the results will be stored
+        channel: pyatmosphere.Channel which will be simulated
+        aperture_radiuses: list of aperture radiuses
+        aperture_shifts: list of r_0 values for
+                         the numerical total probability PDT models,
+                         the shifted aperture results are omitted if empty
+        iterations: the required number of simulation iterations
+        semianalytical_iterations: the required number of simulation iterations
+                                   for semianalytical models
+        results_path: the folder where the results will be stored,
+                      `config.DATA_PATH / channel_name` by default
+        shards: the number of the shards the channel simulation is split
+                into, for the adaptive stopping and the draws of the phase
+                screen banks
+        shard: the index of the shard, for the draws of the phase screen
+               banks
+        adaptive_stopping: stop the simulation when the results converge,
+                           `config.SIMULATION_ADAPTIVE_STOPPING` by default
+
+    Returns:
+        a list of pyatmosphere simulation results
+    """
+    results_path = results_path or Path(config.DATA_PATH) / channel_name
+    results_path.mkdir(parents=True, exist_ok=True)
+    (results_path / 'shifted_aperture').mkdir(exist_ok=True)
+
+    if config.SIMULATION_CHUNKED_STORAGE:
+        storage = {'dtype': config.STORAGE_DTYPE,
+                   'compression': config.STORAGE_COMPRESSION}
+        beam_result, pdt_result, tracked_pdt_result, shifted_result = (
+            ChunkedBeamResult, ChunkedPDTResult, ChunkedTrackedPDTResult,
+            ChunkedShiftedTrackedPDTResult)
+    else:
+        # The tables would be read instead of the CSV files, the encircled
+        # energy profiles are stored in a table anyway
+        if (set(stored_tables(results_path)) -
+                {results_path / ENCIRCLED_ENERGY_FILE} or
+                stored_tables(results_path / 'shifted_aperture')):
+            raise FileExistsError(
+                f"The results in {results_path} are stored in the chunked "
+                "tables, set SIMULATION_CHUNKED_STORAGE or export them with "
+                "export_csv.py and remove the tables")
+        storage = {}
+        beam_result, pdt_result, tracked_pdt_result, shifted_result = (
+            FusedBeamResult, simulations.PDTResult, TrackedPDTResult,
+            ShiftedTrackedPDTResult)
+
+    apertures = [CirclePupil(radius=r) for r in aperture_radiuses]
+    # The intensity spectrum is shared by the shifted aperture results
+    correlation = (ApertureCorrelation(channel.grid, aperture_radiuses)
+                   if config.SHIFTED_APERTURE_CORRELATION and aperture_radiuses
+                   else None)
+    if config.SIMULATION_ENCIRCLED_ENERGY:
+        # The transmittance files are derived from the profiles
+        transmittance_results = [
+            EncircledEnergyResult(
+                channel,
+                aperture_radiuses=aperture_radiuses,
+                points=config.ENCIRCLED_ENERGY_POINTS,
+                dtype=config.ENCIRCLED_ENERGY_DTYPE,
+                save_path=(results_path / ENCIRCLED_ENERGY_FILE),
+                max_size=iterations
+            )
+        ]
+    else:
+        transmittance_results = [
+            pdt_result(
+                channel,
+                pupils=apertures,
+                save_path=(results_path / 'transmittance.csv'),
+                max_size=iterations,
+                **storage
+            ),
+            tracked_pdt_result(
+                channel,
+                pupils=apertures,
+                save_path=(results_path / 'tracked_transmittance.csv'),
+                max_size=iterations,
+                **storage
+            ),
+        ]
+    results = [
+        beam_result(
+            channel, save_path=(results_path / 'beam.csv'),
+            max_size=iterations, **storage
+        ),
+        *transmittance_results,
+        *[shifted_result(
+            channel,
+            aperture=aperture,
+            aperture_shifts=aperture_shifts,
+            correlation=correlation,
+            save_path=(results_path / 'shifted_aperture' /
+                       f"transmittance_{aperture.radius}.csv"),
+            max_size=semianalytical_iterations,
+            **storage
+            )
+            # No shifted aperture results until the shifts are chosen
+            for aperture in (apertures if aperture_shifts else [])]
+    ]
+    if (config.SIMULATION_ADAPTIVE_STOPPING if adaptive_stopping is None
+            else adaptive_stopping):
+        results.append(ConvergenceMonitor(
+            channel,
+            results=list(results),
+            tolerance=config.CONVERGENCE_TOLERANCE,
+            confidence=config.CONVERGENCE_CONFIDENCE,
+            ks_tolerance=config.CONVERGENCE_KS_TOLERANCE,
+            min_iterations=config.CONVERGENCE_MIN_ITERATIONS,
+            time_budget=config.SIMULATION_TIME_BUDGET,
+            shards=shards,
+            save_path=(results_path / CONVERGENCE_FILE)
+        ))
+    if config.SIMULATION_PROFILING:
+        results.append(SimulationProfile(
+            channel, save_path=(results_path / PROFILE_FILE)))
+    if config.SIMULATION_SCREEN_BANK:
+        results.append(BankDraws(
+            channel, shard=shard, shards=shards,
+            save_path=(results_path / BANK_DRAWS_FILE)))
+    if config.SIMULATION_CHECKPOINT:
+        # The last one to be saved after the results
+        results.append(Checkpoint(
+            channel,
+            results=list(results),
+            aperture_radiuses=aperture_radiuses,
+            aperture_shifts=aperture_shifts,
+            save_path=(results_path / CHECKPOINT_FILE)
+        ))
+    return results
+
+
+def create_simulation(results: List[simulations.Result],
+                      time_series: bool = False) -> simulations.Simulation:
+    """Create a simulation of the results according to the config.
+
+    Args:
+        results: the results of the simulation
+        time_series: simulate the frozen flow time series without batches,
+                     an iteration for a time step
+    """
+    use_backend(config.FFT_BACKEND,
+                config.FFT_WORKERS or
+                default_workers(config.SIMULATION_PROCESSES),
+                config.FFT_WISDOM_PATH,
+                single=config.SIMULATION_SINGLE_PRECISION)
+    # The mixins of the simulation class and their arguments
+    bases, kwargs = [], {}
+    if config.SIMULATION_HEADLESS:
+        bases.append(SignalControl)
+    if config.SIMULATION_CHECKPOINT:
+        bases.append(Checkpointing)
+    # The cache binds the output of all the measures evaluated after it
+    if config.SIMULATION_FIELD_CACHE:
+        bases.append(SharedFieldCache)
+    if config.SIMULATION_PARALLEL_MEASURES:
+        bases.append(ParallelMeasures)
+        kwargs['measure_threads'] = (
+            config.MEASURE_THREADS or
+            default_workers(config.SIMULATION_PROCESSES))
+    if config.SIMULATION_PROFILING:
+        bases.append(Profiling)
+        kwargs['print_step'] = config.PROFILING_PRINT_STEP
+    if config.SIMULATION_BACKGROUND_SAVING:
+        bases.append(BackgroundSaving)
+        kwargs['max_pending_saves'] = config.SIMULATION_PENDING_SAVES
+    # The screens of the series and the ones drawn from the banks are not
+    # synthesized by the others
+    if time_series:
+        bases.append(FrozenFlow)
+        kwargs['wind'] = config.TIME_SERIES_WIND
+        kwargs['time_step'] = config.TIME_SERIES_TIME_STEP
+        kwargs['series_steps'] = config.TIME_SERIES_STEPS
+    elif config.SIMULATION_SCREEN_BANK:
+        bases.append(BankedPhaseScreens)
+        kwargs['screen_bank_path'] = config.SCREEN_BANK_PATH
+        kwargs['screen_bank_margin'] = config.SCREEN_BANK_MARGIN
+        kwargs['screen_bank_symmetries'] = config.SCREEN_BANK_SYMMETRIES
+    if config.SIMULATION_PIPELINED_PHASE_SCREENS:
+        bases.append(PipelinedPhaseScreens)
+        kwargs['pipeline_depth'] = config.PHASE_SCREEN_PIPELINE_DEPTH
+    if config.SIMULATION_BATCH_SIZE > 1 and not time_series:
+        bases.append(BatchedSimulation)
+        args = (config.SIMULATION_BATCH_SIZE,
+                config.SIMULATION_BATCH_MEMORY_LIMIT)
+    else:
+        if config.SIMULATION_CACHED_PROPAGATION:
+            bases.append(CachedPropagation)
+        if config.SIMULATION_FAST_PHASE_SCREENS:
+            bases.append(FastPhaseScreens)
+        if config.SIMULATION_CHANNEL_GROUPS:
+            bases.append(SharedPhaseScreens)
+        bases.append(simulations.Simulation)
+        args = ()
+    simulation = (type(bases[-1].__name__, tuple(bases), {})
+                  if len(bases) > 1 else bases[0])
+    return simulation(results, *args, **kwargs)
@@ -0,0 +1,70 @@
+"""Propagation on the grids scaled along the path.
+
+A beam expanding along a long path needs a grid step resolving it at
+the source and a grid side holding it at the receiver, so the grid of
+the whole path is much finer than any of its planes needs. On
+the `ScaledPhaseScreensPath` the grid step grows linearly from
+the `source_delta` of the source plane to the channel grid step of
+the receiver plane, with the same resolution, and every phase screen is
+generated on the grid of its plane. The steps between the planes are
+the scaled vacuum steps of `lib.propagation.Propagator`.
+
+The output and the measures of the channel are on the channel grid, but
+the fields yielded between the phase screens are on the scaled grids and
+carry the quadratic phase of the scaled steps.
+"""
+
+from typing import List
+
+import pyatmosphere as pyatm
+
+from lib.propagation import get_propagator
+
+
+class ScaledPhaseScreensPath(pyatm.IdenticalPhaseScreensPath):
+    """`pyatmosphere.IdenticalPhaseScreensPath` with the grid step growing
+    from the source plane to the receiver plane.
+
+    The source must have the `amplitude` of the squared radius, as
+    `pyatmosphere.GaussianSource`.
+
+    Args:
+        source_delta: the grid step of the source plane, m
+    """
+    def __init__(self, *args, source_delta: float, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.source_delta = source_delta
+
+    def plane_deltas(self) -> List[float]:
+        """The grid steps of the source, the phase screen and the receiver
+        planes.
+        """
+        delta = self.channel.grid.delta
+        return [self.source_delta +
+                (delta - self.source_delta) * position / self.length
+                for position in (0, *self.positions, self.length)]
+
+    @property
+    def source_grid(self) -> pyatm.RectGrid:
+        return pyatm.RectGrid(resolution=self.channel.grid.resolution,
+                              delta=self.source_delta)
+
+    def source_output(self):
+        "The source output on the source grid."
+        return self.channel.source.amplitude(self.source_grid.get_rho2())
+
+    def init_phase_screens(self):
+        super().init_phase_screens()
+        resolution = self.channel.grid.resolution
+        for phase_screen, delta in zip(self.phase_screens,
+                                       self.plane_deltas()[1:-1]):
+            grid = vars(phase_screen).get('grid')
+            if (grid is None or grid.delta != delta or
+                    grid.resolution != resolution):
+                phase_screen.grid = pyatm.RectGrid(resolution=resolution,
+                                                   delta=delta)
+
+    def generator(self, input, *args, **kwargs):
+        "Propagate by the scaled steps of the channel propagator."
+        return (yield from get_propagator(self.channel).generator(
+            input, *args, **kwargs))
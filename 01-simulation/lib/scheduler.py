@@ -0,0 +1,219 @@
+"""Concurrent simulation of all the channels on a common pool of processes.
+
+Each channel is split into shards of about `config.SIMULATION_TASK_ITERATIONS`
+iterations (see `lib.sharding`). Whenever a worker process is free, it gets
+a shard of the channel with the largest remaining work per already running
+shard, so the workers are shared between the channels in proportion to their
+remaining work. The cost of an iteration is estimated from the channel
+parameters at first and then replaced by the measured one. Cheap channels
+finish early and their workers go to the expensive ones.
+"""
+
+import math
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pyatmosphere as pyatm
+
+import config
+from lib import signals
+from lib.sharding import (Shard, channel_shards, is_shard_done,
+                          load_spawn_keys, merge_shards, record_spawn_key,
+                          simulate_shard)
+from lib.shifted_aperture import ApertureShifts
+
+ChannelApertures = Tuple[List[float], ApertureShifts]
+
+
+def estimate_iteration_cost(channel: pyatm.Channel, apertures_count: int,
+                            shifts_count: int,
+                            semianalytical_fraction: float) -> float:
+    """Estimate the number of floating-point operations of one iteration.
+
+    The estimation takes into account the sparse spectrum phase screens
+    synthesis, the propagation FFTs and the aperture measures.
+    """
+    resolution = np.prod(channel.grid.resolution)
+    screens_count = len(channel.path.phase_screens)
+    points = channel.path.phase_screen.f_grid.points
+    phase_screens = screens_count * resolution * points * 8
+    propagation = ((screens_count + 1) * 2 * 5 * resolution *
+                   math.log2(resolution))
+    if config.SHIFTED_APERTURE_CORRELATION:
+        # An inverse FFT of the about twice padded grid and the bicubic
+        # interpolation per aperture
+        shifted_apertures = apertures_count * (
+            5 * 4 * resolution * math.log2(4 * resolution) +
+            32 * shifts_count)
+    else:
+        shifted_apertures = apertures_count * (shifts_count + 2) * resolution
+    measures = (resolution * (6 + 2 * apertures_count) +
+                semianalytical_fraction * shifted_apertures)
+    return phase_screens + propagation + measures
+
+
+def estimate_task_memory(channel: pyatm.Channel) -> float:
+    """Estimate the peak memory of one worker process in bytes.
+
+    It counts about a dozen complex128 temporary arrays of the propagation
+    and the complex64 plane wave matrices of the phase screens synthesis.
+    """
+    resolution_x, resolution_y = channel.grid.resolution
+    points = channel.path.phase_screen.f_grid.points
+    return (12 * 16 * resolution_x * resolution_y +
+            2 * 8 * points * (resolution_x + resolution_y))
+
+
+@dataclass
+class ChannelTasks:
+    "The shards of a channel and the state of their simulation."
+    name: str
+    apertures: ChannelApertures
+    shards: List[Shard]
+    estimated_cost: float
+    memory: float
+    pending: List[Shard] = field(default_factory=list)
+    running: int = 0
+    iterations: int = 0
+    seconds: float = 0
+
+    @property
+    def measured_cost(self) -> Optional[float]:
+        "Measured seconds per iteration."
+        return self.seconds / self.iterations if self.iterations else None
+
+    @property
+    def is_done(self) -> bool:
+        return not self.pending and not self.running
+
+    def remaining_work(self, seconds_per_estimated_cost: float) -> float:
+        "Estimated seconds of the not yet started shards."
+        cost = (self.measured_cost or
+                self.estimated_cost * seconds_per_estimated_cost)
+        return cost * sum(shard.iterations for shard in self.pending)
+
+
+def _seconds_per_estimated_cost(tasks: Dict[str, ChannelTasks]) -> float:
+    "The median ratio of the measured to the estimated cost."
+    ratios = [channel_tasks.measured_cost / channel_tasks.estimated_cost
+              for channel_tasks in tasks.values()
+              if channel_tasks.measured_cost is not None]
+    return float(np.median(ratios)) if ratios else 1
+
+
+def _next_channel(tasks: Dict[str, ChannelTasks],
+                  free_memory: float) -> Optional[ChannelTasks]:
+    """Choose the channel whose shard will be started next.
+
+    Every channel gets one worker first, then the workers are distributed
+    in proportion to the remaining work of the channels.
+    """
+    scale = _seconds_per_estimated_cost(tasks)
+    candidates = [channel_tasks for channel_tasks in tasks.values()
+                  if channel_tasks.pending and
+                  channel_tasks.memory <= free_memory]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda channel_tasks: (
+        channel_tasks.running == 0,
+        channel_tasks.remaining_work(scale) / (channel_tasks.running + 1)))
+
+
+def create_channel_tasks(channel_name: str,
+                         apertures: ChannelApertures) -> ChannelTasks:
+    "Split the channel simulation into shards for the scheduler."
+    channel_config = config.CHANNELS[channel_name]
+    iterations = channel_config['iterations']
+    shards = channel_shards(channel_name)
+    aperture_radiuses, aperture_shifts = apertures
+    return ChannelTasks(
+        name=channel_name,
+        apertures=apertures,
+        shards=shards,
+        estimated_cost=estimate_iteration_cost(
+            channel_config['channel'], len(aperture_radiuses),
+            len(aperture_shifts),
+            min(1, config.SEMIANALYTICAL_ITERATIONS / iterations)),
+        memory=estimate_task_memory(channel_config['channel']),
+        pending=[shard for shard in shards
+                 if not is_shard_done(channel_name, shard)],
+    )
+
+
+def run_scheduled(channels: Dict[str, ChannelApertures], processes: int,
+                  memory_limit: Optional[float] = None) -> bool:
+    """Simulate all the channels at once with a common pool of processes.
+
+    Args:
+        channels: aperture radiuses and aperture shifts by the channel names
+        processes: the number of worker processes
+        memory_limit: the memory available for the workers in bytes,
+                      unlimited if None
+
+    Returns:
+        True if all the channels are completely simulated
+    """
+    tasks = {channel_name: create_channel_tasks(channel_name, apertures)
+             for channel_name, apertures in channels.items()}
+    spawn_keys = {channel_name: load_spawn_keys(channel_name)
+                  for channel_name in channels}
+    memory_limit = memory_limit or math.inf
+
+    is_interrupted = False
+    running: Dict = {}
+    with ProcessPoolExecutor(max_workers=processes,
+                             initializer=signals.init_worker,
+                             initargs=(signals.stop_event(),)) as executor:
+        try:
+            while True:
+                while (len(running) < processes and
+                       not signals.stop_requested()):
+                    used_memory = sum(tasks[name].memory
+                                      for name, _ in running.values())
+                    # Start at least one shard regardless of the memory limit
+                    free_memory = (memory_limit - used_memory
+                                   if running else math.inf)
+                    channel_tasks = _next_channel(tasks, free_memory)
+                    if channel_tasks is None:
+                        break
+                    shard = channel_tasks.pending.pop(0)
+                    channel_tasks.running += 1
+                    aperture_radiuses, aperture_shifts = \
+                        channel_tasks.apertures
+                    future = executor.submit(
+                        simulate_shard, channel_tasks.name, shard,
+                        record_spawn_key(spawn_keys[channel_tasks.name],
+                                         channel_tasks.name, shard),
+                        aperture_radiuses, aperture_shifts)
+                    running[future] = (channel_tasks.name, shard)
+
+                if not running:
+                    break
+                done, _ = signals.wait_polling(running, FIRST_COMPLETED)
+                for future in done:
+                    channel_name, _ = running.pop(future)
+                    channel_tasks = tasks[channel_name]
+                    iterations, seconds = future.result()
+                    channel_tasks.running -= 1
+                    channel_tasks.iterations += iterations
+                    channel_tasks.seconds += seconds
+                    if channel_tasks.is_done:
+                        merge_shards(channel_name, channel_tasks.shards,
+                                     spawn_keys[channel_name])
+                        print(f"'{channel_name}' channel simulation is done.")
+        except KeyboardInterrupt:
+            # The workers store their results on interruption by themselves
+            is_interrupted = True
+            signals.cancel_pending(running)
+            executor.shutdown(wait=True)
+
+    for channel_name, channel_tasks in tasks.items():
+        if not channel_tasks.is_done:
+            merge_shards(channel_name, channel_tasks.shards,
+                         spawn_keys[channel_name])
+    return not is_interrupted and not signals.stop_requested() and all(
+        is_shard_done(channel_name, shard)
+        for channel_name, channel_tasks in tasks.items()
+        for shard in channel_tasks.shards)
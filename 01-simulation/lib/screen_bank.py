@@ -0,0 +1,406 @@
+"""Banks of pregenerated sparse spectrum phase screens.
+
+The phase screens of the same statistics (the model, the grid, the frequency
+grid, the wavelength and the thickness) are generated once and stored in
+the bank folder named by the hash of the parameters, so every simulation of
+these statistics finds them. The screens are stored in the `.npy` chunks
+listed in the `manifest.json` file with the parameters, and the chunks are
+read memory-mapped. Fill the banks of the channels with
+`generate_screen_bank.py`. The phase screens of a scaled path (see
+`lib/scaled_propagation.py`) are on the grids of their planes, so each of
+them has its own bank.
+
+`BankSampler` draws the screens of a bank in the random order of
+a permutation of its draws, each one once. By default a draw is a stored
+screen. Optionally the screens of the bank are drawn rotated by the right
+angles and reflected too, which keeps the statistics of the isotropic
+turbulence, and cut out of the screens stored with a margin around the grid
+at a random offset, so a bank gives several times more draws than it
+stores. The transformed draws of a screen are correlated with each other,
+which the statistics of the mean values over many draws tolerate, but
+not the variance of a single draw, so the transforms are opt-in.
+`BankedPhaseScreens` makes the simulation draw its phase screens from
+the banks.
+
+The `BankDraws` result stores the seed of the permutation and the number of
+the draws taken of every bank in the `screen_bank.json` file next to
+the results, so a continued simulation goes on with the draws its previous
+runs have not taken. The shards of a channel (see lib/sharding.py) draw
+the disjoint parts of the draws, every `shards`-th draw starting from
+the shard index.
+"""
+
+import hashlib
+import json
+import os
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pyatmosphere as pyatm
+from pyatmosphere.gpu import get_array, get_xp
+
+from lib.phase_screens import generate_phase_screen
+
+MANIFEST_FILE = 'manifest.json'
+BANK_DRAWS_FILE = 'screen_bank.json'
+# The rotations by the right angles with and without the reflection
+SYMMETRIES = 8
+
+
+def bank_phase_screen(channel: pyatm.Channel,
+                      phase_screen: pyatm.SSPhaseScreen,
+                      margin: int = 0) -> pyatm.SSPhaseScreen:
+    """A standalone phase screen of the statistics of the channel phase
+    screen on its grid extended by the margin.
+    """
+    # The phase screens of the scaled paths have their own grids
+    channel.path.init_phase_screens()
+    Nx, Ny = phase_screen.grid.resolution
+    return pyatm.SSPhaseScreen(
+        model=phase_screen.model, f_grid=phase_screen.f_grid,
+        thickness=phase_screen.thickness, wvl=channel.source.wvl,
+        grid=pyatm.RectGrid(resolution=(Nx + margin, Ny + margin),
+                            delta=phase_screen.grid.delta))
+
+
+def _scalars(obj) -> Dict:
+    return {'type': type(obj).__name__, **{
+        name: value for name, value in sorted(vars(obj).items())
+        if isinstance(value, (bool, int, float, str))}}
+
+
+def bank_parameters(phase_screen: pyatm.SSPhaseScreen) -> Dict:
+    "The parameters the phase screens statistics depend on."
+    return {
+        'model': _scalars(phase_screen.model),
+        'f_grid': _scalars(phase_screen.f_grid),
+        'resolution': list(phase_screen.grid.resolution),
+        'delta': phase_screen.grid.delta,
+        'wvl': phase_screen.wvl,
+        'thickness': phase_screen.thickness,
+        'dtype': 'float32',
+    }
+
+
+def bank_key(parameters: Dict) -> str:
+    "The content address of the bank of the parameters."
+    return hashlib.sha256(json.dumps(
+        parameters, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class PhaseScreenBank:
+    """The phase screens of the statistics of `phase_screen` stored in
+    the `root` folder.
+    """
+    def __init__(self, root: Path, phase_screen: pyatm.SSPhaseScreen):
+        self.phase_screen = phase_screen
+        self.parameters = bank_parameters(phase_screen)
+        self.key = bank_key(self.parameters)
+        self.path = Path(root) / self.key
+        self.chunks: List[Dict] = []
+        # The memory-mapped chunks by their files
+        self._arrays: Dict[str, np.ndarray] = {}
+        try:
+            with open(self.path / MANIFEST_FILE, 'r',
+                      encoding='utf-8') as file:
+                manifest = json.load(file)
+        except FileNotFoundError:
+            return
+        if manifest['parameters'] != json.loads(json.dumps(self.parameters)):
+            raise ValueError(f"The parameters of the {self.path} bank differ "
+                             "from the phase screen ones")
+        self.chunks = manifest['chunks']
+
+    def __len__(self) -> int:
+        return sum(chunk['screens'] for chunk in self.chunks)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        "The shape of the stored screens."
+        Nx, Ny = self.phase_screen.grid.resolution
+        return Ny, Nx
+
+    def _save_manifest(self):
+        manifest_path = self.path / MANIFEST_FILE
+        tmp_path = manifest_path.with_name(MANIFEST_FILE + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({'parameters': self.parameters,
+                       'chunks': self.chunks}, file, indent=4)
+        os.replace(tmp_path, manifest_path)
+
+    def generate(self, count: int, chunk_size: int = 256):
+        "Generate and store `count` more screens."
+        self.path.mkdir(parents=True, exist_ok=True)
+        for start in range(0, count, chunk_size):
+            screens_count = min(chunk_size, count - start)
+            file_name = f"{len(self.chunks):06d}.npy"
+            tmp_path = self.path / (file_name + '.tmp')
+            screens = np.lib.format.open_memmap(
+                tmp_path, mode='w+', dtype=np.float32,
+                shape=(screens_count, *self.shape))
+            for i in range(screens_count):
+                screens[i] = get_array(
+                    generate_phase_screen(self.phase_screen))
+            screens.flush()
+            del screens
+            os.replace(tmp_path, self.path / file_name)
+            # A chunk is a part of the bank only after the manifest is saved
+            self.chunks.append({'file': file_name, 'screens': screens_count})
+            self._save_manifest()
+
+    def screen(self, index: int) -> np.ndarray:
+        "The memory-mapped screen of the index."
+        for chunk in self.chunks:
+            if index < chunk['screens']:
+                if chunk['file'] not in self._arrays:
+                    self._arrays[chunk['file']] = np.load(
+                        self.path / chunk['file'], mmap_mode='r')
+                return self._arrays[chunk['file']][index]
+            index -= chunk['screens']
+        raise IndexError(f"No screen {index} in the {self.path} bank")
+
+
+def _write_json(data: Dict, path: Path):
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(data, file, indent=4)
+    os.replace(tmp_path, path)
+
+
+class BankSampler:
+    """Draws the screens of the `shape` from the bank in the random order,
+    each transformed screen once.
+
+    The order is a permutation of the draws of the shard, and the draws
+    added to the bank after the start of the order follow it in their own
+    permutation.
+
+    Args:
+        bank: the bank of the screens
+        shape: the shape of the drawn screens, the stored screens are cut
+               at the offsets up to the difference of their shapes
+        symmetries: draw the rotated and reflected screens too
+        seed: the seed of the order, a random one if None
+        drawn: the number of the already taken draws of the order
+        sizes: the numbers of the draws of the bank the order was extended
+               with, the current one if None
+        shard: the index of the shard drawing every `shards`-th draw
+        shards: the number of the shards
+    """
+    def __init__(self, bank: PhaseScreenBank, shape: Tuple[int, int],
+                 symmetries: bool = False, seed: Optional[int] = None,
+                 drawn: int = 0, sizes: Optional[List[int]] = None,
+                 shard: int = 0, shards: int = 1):
+        self.bank = bank
+        self.shape = tuple(shape)
+        self.offsets = tuple(size - drawn + 1
+                             for size, drawn in zip(bank.shape, self.shape))
+        if min(self.offsets) < 1:
+            raise ValueError(f"The screens of the {bank.path} bank are "
+                             f"smaller than {self.shape}")
+        self.symmetries = (SYMMETRIES if symmetries and
+                           self.shape[0] == self.shape[1] else 1)
+        # The transforms of a stored screen
+        self.transforms = self.symmetries * self.offsets[0] * self.offsets[1]
+        self.seed = (int(np.random.randint(2**32)) if seed is None
+                     else seed)
+        self.drawn = drawn
+        self.sizes = list(sizes or [])
+        if self.sizes and self.sizes[-1] > self.draws:
+            raise ValueError(f"The {bank.path} bank has less than "
+                             f"{self.sizes[-1]} draws it was drawn from")
+        if not self.sizes or self.sizes[-1] < self.draws:
+            self.sizes.append(self.draws)
+        self.shard = shard
+        self.shards = shards
+        self.order = self._order()
+
+    @property
+    def draws(self) -> int:
+        "The number of the different draws."
+        return len(self.bank) * self.transforms
+
+    def _order(self) -> np.ndarray:
+        "The permutations of the draws of the shard added with the sizes."
+        rng = np.random.default_rng(self.seed)
+        parts, start = [], 0
+        for size in self.sizes:
+            first = start + (self.shard - start) % self.shards
+            parts.append(rng.permutation(
+                np.arange(first, size, self.shards)))
+            start = size
+        return np.concatenate(parts)
+
+    def state(self) -> Dict:
+        "The state of the order to continue it with."
+        return {'seed': self.seed, 'drawn': self.drawn, 'sizes': self.sizes}
+
+    def draw(self) -> int:
+        "Draw the next transformed screen of the order."
+        if self.drawn >= len(self.order):
+            raise RuntimeError(f"All the {len(self.order)} draws of the "
+                               f"{self.bank.path} bank are used")
+        draw = int(self.order[self.drawn])
+        self.drawn += 1
+        return draw
+
+    def screen(self, draw: int):
+        "The transformed screen of the draw."
+        index, transform = divmod(draw, self.transforms)
+        symmetry, offset = divmod(transform,
+                                  self.offsets[0] * self.offsets[1])
+        offset_y, offset_x = divmod(offset, self.offsets[1])
+        screen = self.bank.screen(index)[
+            offset_y:offset_y + self.shape[0],
+            offset_x:offset_x + self.shape[1]]
+        if symmetry >= 4:
+            screen = screen.T
+        screen = np.rot90(screen, symmetry % 4)
+        return get_xp().asarray(np.ascontiguousarray(screen))
+
+    def __call__(self, *args, **kwargs):
+        return self.screen(self.draw())
+
+
+class BankDraws(pyatm.simulations.Result):
+    """A result without measures, which stores the states of the orders of
+    the bank samplers of the channel in the `save_path` JSON file.
+
+    Args:
+        channel: the simulated channel
+        shard: the index of the shard of the channel simulation
+        shards: the number of the shards
+    """
+    def __init__(self, channel: pyatm.Channel, shard: int = 0,
+                 shards: int = 1, **kwargs):
+        self.shard = shard
+        self.shards = shards
+        # The loaded states by the bank keys
+        self.states: Dict[str, Dict] = {}
+        # The samplers of the channel by the bank keys
+        self.samplers: Dict[str, BankSampler] = {}
+        super().__init__(channel, [], **kwargs)
+
+    def report(self) -> Dict:
+        return {
+            'shard': self.shard,
+            'shards': self.shards,
+            'banks': {**self.states, **{
+                key: sampler.state()
+                for key, sampler in self.samplers.items()}},
+        }
+
+    def snapshot_output(self) -> Optional[Callable[[], None]]:
+        if not self.save_path or not self.samplers:
+            return None
+        return partial(_write_json, self.report(), Path(self.save_path))
+
+    def save_output(self):
+        write = self.snapshot_output()
+        if write:
+            write()
+
+    def load_output(self):
+        with open(self.save_path, 'r', encoding='utf-8') as file:
+            draws = json.load(file)
+        if (draws['shard'], draws['shards']) != (self.shard, self.shards):
+            raise ValueError(f"The draws of {self.save_path} are of the shard "
+                             f"{draws['shard']} of {draws['shards']}")
+        self.states = draws['banks']
+
+    def print_output(self):
+        for sampler in self.samplers.values():
+            print(f"Drew {sampler.drawn} of {len(sampler.order)} phase "
+                  f"screens of the {sampler.bank.path} bank")
+
+
+class BankedPhaseScreens:
+    """Mixin of `pyatmosphere.simulations.Simulation` and
+    `lib.batched.BatchedSimulation` drawing the `SSPhaseScreen` phase
+    screens of the channels from the banks. The samplers continue the orders
+    stored by the `BankDraws` results of the channels.
+
+    Args:
+        screen_bank_path: the folder of the banks
+        screen_bank_margin: the margin of the stored screens around the grid
+        screen_bank_symmetries: draw the rotated and reflected screens too
+    """
+    def __init__(self, *args, screen_bank_path: str = './data/screen_bank',
+                 screen_bank_margin: int = 0,
+                 screen_bank_symmetries: bool = False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.screen_bank_path = Path(screen_bank_path)
+        self.screen_bank_margin = screen_bank_margin
+        self.screen_bank_symmetries = screen_bank_symmetries
+        # The samplers by the phase screens
+        self._samplers: Dict[int, BankSampler] = {}
+        self.bank_draws = {result.channel: result
+                           for result in self.results_list or []
+                           if isinstance(result, BankDraws)}
+
+    def _sampler(self, channel: pyatm.Channel,
+                 phase_screen: pyatm.SSPhaseScreen,
+                 banks: Dict[str, BankSampler]) -> BankSampler:
+        bank = PhaseScreenBank(self.screen_bank_path, bank_phase_screen(
+            channel, phase_screen, self.screen_bank_margin))
+        if not len(bank):
+            raise FileNotFoundError(
+                f"No phase screens in the {bank.path} bank, "
+                "generate them with generate_screen_bank.py")
+        bank_draws = self.bank_draws.get(channel)
+        if bank.key not in banks:
+            Nx, Ny = channel.grid.resolution
+            # The channels drawing from the same bank store the same state
+            states = [draws.states[bank.key]
+                      for draws in self.bank_draws.values()
+                      if bank.key in draws.states]
+            shard = ((bank_draws.shard, bank_draws.shards) if bank_draws
+                     else (0, 1))
+            banks[bank.key] = BankSampler(
+                bank, (Ny, Nx), self.screen_bank_symmetries,
+                **(states[0] if states else {}),
+                shard=shard[0], shards=shard[1])
+        if bank_draws:
+            bank_draws.samplers[bank.key] = banks[bank.key]
+        return banks[bank.key]
+
+    def _generate(self, phase_screen: pyatm.SSPhaseScreen,
+                  shift: Tuple[float, float] = (0, 0), wind: bool = False):
+        if tuple(shift) != (0, 0):
+            # The banks have no time series of the screens
+            return pyatm.SSPhaseScreen.generate_phase_screen(
+                phase_screen, shift, wind)
+        return self._samplers[id(phase_screen)]()
+
+    def generate_phase_screens(self, phase_screen: pyatm.PhaseScreen,
+                               batch_size: int):
+        "`lib.batched.BatchedSimulation.generate_phase_screens`."
+        if id(phase_screen) not in self._samplers:
+            return super().generate_phase_screens(phase_screen, batch_size)
+        sampler = self._samplers[id(phase_screen)]
+        return get_xp().stack([sampler() for _ in range(batch_size)])
+
+    def run(self, *args, **kwargs):
+        banks: Dict[str, BankSampler] = {}
+        phase_screens = []
+        for channel in self.measures:
+            for phase_screen in getattr(channel.path, 'phase_screens', []):
+                if (type(phase_screen) is pyatm.SSPhaseScreen and
+                        'generate_phase_screen' not in vars(phase_screen)):
+                    self._samplers[id(phase_screen)] = self._sampler(
+                        channel, phase_screen, banks)
+                    phase_screens.append(phase_screen)
+        is_batched = hasattr(super(), 'generate_phase_screens')
+        if not is_batched:
+            for phase_screen in phase_screens:
+                phase_screen.generate_phase_screen = partial(
+                    self._generate, phase_screen)
+        try:
+            super().run(*args, **kwargs)
+        finally:
+            if not is_batched:
+                for phase_screen in phase_screens:
+                    del phase_screen.generate_phase_screen
+            self._samplers.clear()
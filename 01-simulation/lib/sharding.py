@@ -0,0 +1,331 @@
+"""Multi-process simulation of a single channel.
+
+The iterations of a channel are split into shards. Every shard is simulated
+by a separate worker process with its own random stream spawned from a common
+`numpy.random.SeedSequence`, and the shard results are stored in the
+`shards/<index>` subfolder of the channel data folder. The shard files are then
+merged into the usual `beam.csv`, `transmittance.csv`, ... layout, and the
+`shards.json` file records which seed produced which rows. A shard with
+a checkpoint continues the random stream stored in it (see `lib.checkpoint`).
+"""
+
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pyatmosphere as pyatm
+from pyatmosphere import gpu
+
+import config
+from lib import signals
+from lib.checkpoint import (CHECKPOINT_FILE, load_checkpoint,
+                            merge_checkpoints, stored_rows)
+from lib.convergence import load_convergence
+from lib.profiling import PROFILE_FILE, PROFILE_TABLE, merge_profiles
+from lib.results import create_results, create_simulation
+from lib.shifted_aperture import ApertureShifts
+from lib.storage import TABLE_SUFFIX, merge_tables, stored_results
+
+SHARDS_FOLDER = 'shards'
+SHARDS_MANIFEST = 'shards.json'
+
+
+@dataclass
+class Shard:
+    "A part of the channel iterations simulated by one worker process."
+    index: int
+    entropy: int
+    iterations: int
+    semianalytical_iterations: int
+    # the number of the shards of the channel
+    count: int = 1
+
+    @property
+    def path(self) -> Path:
+        return Path(SHARDS_FOLDER) / str(self.index)
+
+
+def split_iterations(iterations: int, parts: int) -> List[int]:
+    "Split the number of iterations into `parts` nearly equal parts."
+    return [iterations // parts + (i < iterations % parts)
+            for i in range(parts)]
+
+
+def spawn_shards(channel_name: str, processes: int, iterations: int,
+                 semianalytical_iterations: int,
+                 entropy: Optional[int] = None) -> List[Shard]:
+    """Split the channel simulation into shards.
+
+    The root entropy and the number of shards of an existing sharded
+    simulation are reused, so the continued simulation stays reproducible.
+
+    Args:
+        channel_name: the name of the channel data folder
+        processes: the number of shards
+        iterations: the total number of simulation iterations
+        semianalytical_iterations: the total number of simulation iterations
+                                   for semianalytical models
+        entropy: the root entropy, a new one is generated if None
+
+    Returns:
+        a list of shards
+    """
+    manifest = load_shards_manifest(channel_name)
+    if manifest:
+        entropy = manifest['entropy']
+        processes = len(manifest['shards'])
+    if entropy is None:
+        entropy = np.random.SeedSequence().entropy
+    return [
+        Shard(index=i, entropy=entropy, iterations=shard_iterations,
+              semianalytical_iterations=shard_semianalytical_iterations,
+              count=processes)
+        for i, (shard_iterations, shard_semianalytical_iterations) in
+        enumerate(zip(split_iterations(iterations, processes),
+                      split_iterations(semianalytical_iterations, processes)))
+    ]
+
+
+def channel_shards(channel_name: str) -> List[Shard]:
+    "Split the channel simulation into shards according to the config."
+    iterations = config.CHANNELS[channel_name]['iterations']
+    if config.SIMULATION_CONCURRENT_CHANNELS:
+        processes = max(
+            1, math.ceil(iterations / config.SIMULATION_TASK_ITERATIONS))
+    else:
+        processes = config.SIMULATION_PROCESSES
+    return spawn_shards(channel_name, processes, iterations,
+                        config.SEMIANALYTICAL_ITERATIONS,
+                        entropy=config.SIMULATION_SEED)
+
+
+def seed_random(seed_sequence: np.random.SeedSequence):
+    "Seed the global random generators used by pyatmosphere."
+    np.random.seed(seed_sequence.generate_state(4))
+    if gpu.config['use_gpu']:
+        gpu.get_xp().random.seed(int(seed_sequence.generate_state(1)[0]))
+
+
+def shard_spawn_key(channel_name: str, shard: Shard) -> List[int]:
+    """Return the spawn key of the random stream for the shard.
+
+    The key consists of the shard index and the number of the already stored
+    iterations, so the continued simulation never repeats the turbulence
+    realizations of the stored ones.
+    """
+    shard_path = Path(config.DATA_PATH) / channel_name / shard.path
+    return [shard.index, stored_rows(shard_path, 'beam.csv')]
+
+
+def is_shard_done(channel_name: str, shard: Shard) -> bool:
+    "Check whether all the shard iterations are already stored."
+    shard_path = Path(config.DATA_PATH) / channel_name / shard.path
+    convergence = load_convergence(shard_path)
+    if convergence.get('timeout'):
+        return True
+    if (not convergence.get('converged') and
+            stored_rows(shard_path, 'beam.csv') < shard.iterations):
+        return False
+    return all(stored_rows(shard_path, path.relative_to(shard_path).as_posix())
+               >= shard.semianalytical_iterations
+               for path in stored_results(shard_path / 'shifted_aperture'))
+
+
+def simulate_shard(channel_name: str, shard: Shard, spawn_key: List[int],
+                   aperture_radiuses: List[float],
+                   aperture_shifts: ApertureShifts) -> Tuple[int, float]:
+    """Simulate (or continue to simulate) one shard in the current process.
+
+    Returns:
+        the number of the simulated iterations and the elapsed time in seconds
+    """
+    channel = config.CHANNELS[channel_name]['channel']
+    results = create_results(
+        channel_name, channel, aperture_radiuses, aperture_shifts,
+        shard.iterations, shard.semianalytical_iterations,
+        results_path=Path(config.DATA_PATH) / channel_name / shard.path,
+        shards=shard.count, shard=shard.index)
+    seed_random(np.random.SeedSequence(shard.entropy, spawn_key=spawn_key))
+    start_iterations = len(results[0].measures[0])
+    start_time = time.perf_counter()
+    create_simulation(results).run(save_step=config.SIMULATION_SAVE_STEP)
+    return (len(results[0].measures[0]) - start_iterations,
+            time.perf_counter() - start_time)
+
+
+def simulate_first_shard(
+        channel_name: str, aperture_radiuses: List[float],
+        iterations: int) -> pyatm.simulations.BeamResult:
+    """Simulate the first iterations of the first shard of the channel
+    without the shifted aperture results, which require the beam wandering
+    value, and merge the shards.
+
+    Returns:
+        the beam result of the first shard
+    """
+    shards = channel_shards(channel_name)
+    shard = shards[0]
+    spawn_keys = load_spawn_keys(channel_name)
+    results = create_results(
+        channel_name, config.CHANNELS[channel_name]['channel'],
+        aperture_radiuses, [], min(iterations, shard.iterations), 0,
+        results_path=Path(config.DATA_PATH) / channel_name / shard.path,
+        shards=shard.count, shard=shard.index)
+    seed_random(np.random.SeedSequence(
+        shard.entropy,
+        spawn_key=record_spawn_key(spawn_keys, channel_name, shard)))
+    create_simulation(results).run(save_step=config.SIMULATION_SAVE_STEP)
+    merge_shards(channel_name, shards, spawn_keys)
+    return results[0]
+
+
+def _merge_csv(paths: List[Path], merged_path: Path) -> List[List[int]]:
+    "Concatenate CSV files with the same header, return the rows ranges."
+    rows = []
+    tmp_path = merged_path.with_name(merged_path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as merged_file:
+        for path in paths:
+            start = rows[-1][1] if rows else 0
+            if not path.exists():
+                rows.append([start, start])
+                continue
+            with open(path, 'r', encoding='utf-8') as file:
+                header = file.readline()
+                if merged_file.tell() == 0:
+                    merged_file.write(header)
+                count = 0
+                for line in file:
+                    merged_file.write(line)
+                    count += 1
+            rows.append([start, start + count])
+    os.replace(tmp_path, merged_path)
+    return rows
+
+
+def load_shards_manifest(channel_name: str) -> Optional[Dict]:
+    "Load the record of the shards of the channel if exists."
+    try:
+        path = Path(config.DATA_PATH) / channel_name / SHARDS_MANIFEST
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def load_spawn_keys(channel_name: str) -> Dict[int, List[List[int]]]:
+    "Load the spawn keys used by each shard in the previous runs."
+    manifest = load_shards_manifest(channel_name) or {'shards': []}
+    return {shard['index']: shard['spawn_keys']
+            for shard in manifest['shards']}
+
+
+def record_spawn_key(spawn_keys: Dict[int, List[List[int]]],
+                     channel_name: str, shard: Shard) -> List[int]:
+    """Return the spawn key for the next shard run and add it to `spawn_keys`
+    unless the shard continues the random stream of its checkpoint.
+    """
+    spawn_key = shard_spawn_key(channel_name, shard)
+    spawn_keys.setdefault(shard.index, [])
+    shard_path = Path(config.DATA_PATH) / channel_name / shard.path
+    if load_checkpoint(shard_path).get('random_state'):
+        return spawn_key
+    if spawn_key not in spawn_keys[shard.index]:
+        spawn_keys[shard.index].append(spawn_key)
+    return spawn_key
+
+
+def merge_shards(channel_name: str, shards: List[Shard],
+                 spawn_keys: Dict[int, List[List[int]]]):
+    """Merge the shard results into the channel data folder.
+
+    Args:
+        channel_name: the name of the channel data folder
+        shards: the list of the channel shards
+        spawn_keys: the spawn keys used by each shard in this and
+                    the previous runs
+    """
+    channel_path = Path(config.DATA_PATH) / channel_name
+    file_names = sorted({
+        str(path.relative_to(channel_path / shard.path))
+        for shard in shards
+        for pattern in ['*.csv', '*' + TABLE_SUFFIX]
+        for path in (channel_path / shard.path).rglob(pattern)
+        # Skip the chunks of the tables and the profiles
+        if not path.parent.name.endswith(TABLE_SUFFIX) and
+        path.name != PROFILE_TABLE})
+
+    manifest = {'entropy': shards[0].entropy, 'shards': []}
+    rows = {}
+    for file_name in file_names:
+        (channel_path / file_name).parent.mkdir(parents=True, exist_ok=True)
+        merge = (merge_tables if file_name.endswith(TABLE_SUFFIX)
+                 else _merge_csv)
+        rows[file_name] = merge(
+            [channel_path / shard.path / file_name for shard in shards],
+            channel_path / file_name)
+    for i, shard in enumerate(shards):
+        manifest['shards'].append({
+            'index': shard.index,
+            'path': str(shard.path),
+            # Each spawn key produces the shard rows starting from its
+            # second element
+            'spawn_keys': spawn_keys.get(shard.index, []),
+            'rows': {file_name: rows[file_name][i] for file_name in file_names}
+        })
+    with open(channel_path / SHARDS_MANIFEST, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=4)
+    merge_profiles([channel_path / shard.path / PROFILE_FILE
+                    for shard in shards], channel_path / PROFILE_FILE)
+    merge_checkpoints([channel_path / shard.path / CHECKPOINT_FILE
+                       for shard in shards], channel_path / CHECKPOINT_FILE)
+
+
+def run_sharded(channel_name: str, aperture_radiuses: List[float],
+                aperture_shifts: ApertureShifts, processes: int) -> bool:
+    """Simulate the channel with several worker processes.
+
+    Args:
+        channel_name: the name of the channel in `config.CHANNELS`
+        aperture_radiuses: list of aperture radiuses
+        aperture_shifts: list of r_0 values for
+                         the numerical total probability PDT models
+        processes: the number of worker processes
+
+    Returns:
+        True if all the shards are completely simulated
+    """
+    channel_config = config.CHANNELS[channel_name]
+    shards = spawn_shards(channel_name, processes,
+                          channel_config['iterations'],
+                          config.SEMIANALYTICAL_ITERATIONS,
+                          entropy=config.SIMULATION_SEED)
+    spawn_keys = load_spawn_keys(channel_name)
+
+    is_done = True
+    with ProcessPoolExecutor(max_workers=processes,
+                             initializer=signals.init_worker,
+                             initargs=(signals.stop_event(),)) as executor:
+        futures = [
+            executor.submit(simulate_shard, channel_name, shard,
+                            record_spawn_key(spawn_keys, channel_name, shard),
+                            aperture_radiuses, aperture_shifts)
+            for shard in shards]
+        try:
+            signals.wait_polling(futures)
+            for future in futures:
+                future.result()
+        except KeyboardInterrupt:
+            # The workers store their results on interruption by themselves
+            is_done = False
+            signals.cancel_pending(futures)
+            executor.shutdown(wait=True)
+
+    merge_shards(channel_name, shards, spawn_keys)
+    return is_done and all(is_shard_done(channel_name, shard)
+                           for shard in shards)
@@ -1,8 +1,12 @@
-from functools import partial
 from typing import List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 import pyatmosphere as pyatm
+from pyatmosphere.gpu import get_array
+
+from lib import field_cache
+from lib.aperture_correlation import ApertureCorrelation
 
 ApertureShifts = List[Tuple[float, float]]
 
@@ -11,47 +15,74 @@ class ShiftedTrackedPDTResult(pyatm.simulations.Result):
     """Represents a simulation results of transmittance of ligth propagation
     through the `channel` throug the `aperture` that is placed with
     the `aperture_shifts` offsets relative to the beam centroid of the sample.
+
+    The transmittance for all the shifts is a single measure, stored as
+    a column per shift. If the `correlation` is given, it is read off the FFT
+    cross-correlation of the intensity with the aperture, otherwise each
+    shifted aperture is applied to the output.
     """
     def __init__(self,
                  channel: pyatm.Channel,
                  aperture: Optional[pyatm.CirclePupil] = None,
                  aperture_shifts: Optional[ApertureShifts] = None,
+                 correlation: Optional[ApertureCorrelation] = None,
                  **kwargs):
         self.aperture = aperture or None
         self.aperture_shifts = aperture_shifts or [(0, 0)]
+        self.correlation = correlation
         measures = [
             pyatm.simulations.Measure(
-                channel, "atmosphere", pyatm.measures.mean_x),
+                channel, "atmosphere", field_cache.mean_x),
+            pyatm.simulations.Measure(
+                channel, "atmosphere", field_cache.mean_y),
             pyatm.simulations.Measure(
-                channel, "atmosphere", pyatm.measures.mean_y),
-            *[pyatm.simulations.Measure(channel, "atmosphere",
-              partial(self._append_pupil, shift),
-              pyatm.measures.eta,
-              name=self._col_name(shift)
-              )
-              for shift in self.aperture_shifts]
+                channel, "atmosphere", self.shifted_transmittance,
+                name="transmittance"),
             ]
         super().__init__(channel, measures, **kwargs)
 
     def _col_name(self, shift):
         return '_'.join([f'{n:.3e}' for n in shift])
 
-    def _append_pupil(self, shift, channel, output):
-        init_pupil = channel.pupil
-        if self.aperture:
-            channel.pupil = self.aperture
+    def shifted_transmittance(self, channel, output) -> np.ndarray:
+        "Return the transmittance for each of the aperture shifts."
         beam_x = self.measures[0].iteration_data
         beam_y = self.measures[1].iteration_data
-        output = channel.pupil.output(
-            output, shift=(beam_x + shift[0], beam_y + shift[1]))
-        if self.aperture:
-            channel.pupil = init_pupil
-        return output
+        shifts = np.asarray(self.aperture_shifts, dtype=float)
+        aperture = self.aperture or channel.pupil
+        if self.correlation:
+            intensity = field_cache.intensity(channel, output)
+            # The results of one realization share the output the field
+            # cache is bound to, the spectrum is recomputed without it
+            cache = field_cache.get_cache(output)
+            return get_array(self.correlation.transmittance(
+                intensity, aperture.radius, beam_x + shifts[:, 0],
+                beam_y + shifts[:, 1],
+                key=cache and cache.output_key(output)))
+        init_pupil = channel.pupil
+        # The pupil gets the channel grid as the channel attribute
+        channel.pupil = aperture
+        transmittance = np.array([
+            pyatm.measures.eta(channel, channel.pupil.output(
+                output, shift=(beam_x + shift_x, beam_y + shift_y)))
+            for shift_x, shift_y in shifts])
+        channel.pupil = init_pupil
+        return transmittance
+
+    def as_df(self):
+        df = pd.DataFrame(
+            np.asarray(self.measures[2].data, dtype=float).reshape(
+                -1, len(self.aperture_shifts)),
+            columns=[self._col_name(shift) for shift in self.aperture_shifts])
+        df.insert(0, 'mean_x', self.measures[0].data)
+        df.insert(1, 'mean_y', self.measures[1].data)
+        return df
 
     def load_output(self):
-        for measures, data in zip(self.measures,
-                                  pd.read_csv(self.save_path).T.values):
-            measures.data = data.tolist()
+        data = pd.read_csv(self.save_path).values
+        self.measures[0].data = data[:, 0].tolist()
+        self.measures[1].data = data[:, 1].tolist()
+        self.measures[2].data = list(data[:, 2:])
 
     def plot_output(self):
         print(len(self.measures[0]))
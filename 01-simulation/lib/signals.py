@@ -0,0 +1,143 @@
+"""Control of an unattended simulation by signals.
+
+Within `handle_signals` SIGINT and SIGTERM request a stop: the simulations
+stop between two iterations, save their results and return, so the stored
+data is consistent and the simulation is continued by the next run. A second
+SIGINT interrupts the simulation at once. SIGUSR1 requests a summary:
+the simulation saves its results and the summary callback is called without
+stopping.
+
+The worker processes share the stop request through a `multiprocessing`
+event given to `init_worker`. A worker stops on the stop signals sent to it
+as well, and saves its results on SIGUSR1.
+"""
+
+import multiprocessing
+import signal
+from concurrent.futures import ALL_COMPLETED, wait
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+# the interval of the summary requests checks while waiting for the workers
+POLL_INTERVAL = 1
+
+_stop_requested = False
+_summary_requested = False
+_stop_event = None
+_summary_callback: Optional[Callable[[], None]] = None
+
+
+def stop_requested() -> bool:
+    return _stop_requested or bool(_stop_event and _stop_event.is_set())
+
+
+def stop_event():
+    "The event shared with the worker processes, None if not handled."
+    return _stop_event
+
+
+def _request_stop(signum, frame):
+    global _stop_requested
+    if _stop_requested and signum == signal.SIGINT:
+        raise KeyboardInterrupt
+    _stop_requested = True
+    if _stop_event is not None:
+        _stop_event.set()
+    print(f"\n{signal.Signals(signum).name} received, stopping...")
+
+
+def _request_summary(signum, frame):
+    global _summary_requested
+    _summary_requested = True
+
+
+def _install_handlers():
+    signal.signal(signal.SIGINT, _request_stop)
+    signal.signal(signal.SIGTERM, _request_stop)
+    if hasattr(signal, 'SIGUSR1'):  # not on Windows
+        signal.signal(signal.SIGUSR1, _request_summary)
+
+
+@contextmanager
+def handle_signals(summary: Optional[Callable[[], None]] = None):
+    """Handle the stop and summary signals in the block.
+
+    Args:
+        summary: the function writing the summary on SIGUSR1
+    """
+    global _stop_requested, _summary_requested, _stop_event, \
+        _summary_callback
+    handled = [signal.SIGINT, signal.SIGTERM]
+    if hasattr(signal, 'SIGUSR1'):
+        handled.append(signal.SIGUSR1)
+    handlers = {signum: signal.getsignal(signum) for signum in handled}
+    _stop_requested = _summary_requested = False
+    _stop_event = multiprocessing.Event()
+    _summary_callback = summary
+    _install_handlers()
+    try:
+        yield
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+        _stop_event = _summary_callback = None
+
+
+def init_worker(event):
+    "Handle the signals in a worker process if they are handled by the main."
+    global _stop_event
+    if event is None:
+        return
+    _stop_event = event
+    _install_handlers()
+
+
+def poll():
+    "Write the summary if requested."
+    global _summary_requested
+    if _summary_requested:
+        _summary_requested = False
+        if _summary_callback is not None:
+            _summary_callback()
+
+
+def wait_polling(futures, return_when=ALL_COMPLETED):
+    """`concurrent.futures.wait` the futures writing the requested summaries
+    meanwhile.
+    """
+    while True:
+        done, not_done = wait(futures, timeout=POLL_INTERVAL,
+                              return_when=return_when)
+        poll()
+        if not not_done or done and return_when != ALL_COMPLETED:
+            return done, not_done
+
+
+def cancel_pending(futures):
+    """Cancel the futures which have not started yet, as
+    `Executor.shutdown(cancel_futures=True)` of Python 3.9 does.
+    """
+    for future in futures:
+        future.cancel()
+
+
+class SignalControl:
+    """Mixin of `pyatmosphere.simulations.Simulation` stopping the simulation
+    between the iterations on a stop request and saving the results on
+    a summary request.
+    """
+    def flush(self):
+        "Save the results and wait until they are written."
+        self.process_output(0, plot_step=None, save_step=1)
+        writer = getattr(self, 'writer', None)
+        if writer is not None:
+            writer.flush()
+
+    def iter(self):
+        if stop_requested():
+            # The simulation saves the results on the interruption
+            raise KeyboardInterrupt
+        super().iter()
+        if _summary_requested:
+            self.flush()
+            poll()
@@ -0,0 +1,313 @@
+"""Append-only chunked binary storage of the simulation results.
+
+A table is stored in the `<name>.chunks` folder next to the `<name>.csv`
+file the result would be stored in. The folder contains `.npy` (or
+compressed `.npz`) chunks of rows and the `manifest.json` file with
+the columns, the dtype and the list of chunks. Each save appends only
+the rows simulated since the previous save as a new chunk, and the `.npy`
+chunks are read memory-mapped.
+
+The tables are converted to the CSV files with `export_csv.py`.
+"""
+
+import json
+import os
+import shutil
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyatmosphere as pyatm
+
+from lib.beam_moments import FusedBeamResult
+from lib.field_cache import TrackedPDTResult
+from lib.shifted_aperture import ShiftedTrackedPDTResult
+from lib.tables import (MANIFEST_FILE, TABLE_SUFFIX, read_chunk,
+                        read_manifest, stored_results, table_path)
+
+
+class ChunkedTable:
+    """A table of float rows stored in chunks.
+
+    The columns, the dtype and the compression of an existing table are
+    taken from its manifest.
+    """
+    def __init__(self, path: Path, columns: Optional[List[str]] = None,
+                 dtype: str = 'float64', compression: bool = False):
+        self.path = Path(path)
+        self.columns = list(columns or [])
+        self.dtype = dtype
+        self.compression = compression
+        self.chunks: List[Dict] = []
+        manifest = read_manifest(self.path)
+        if manifest is None:
+            return
+        if columns and manifest['columns'] != self.columns:
+            raise ValueError(f"The columns of the {self.path} table differ "
+                             "from the result ones")
+        self.columns = manifest['columns']
+        self.dtype = manifest['dtype']
+        self.compression = manifest['compression']
+        self.chunks = manifest['chunks']
+
+    @property
+    def exists(self) -> bool:
+        return (self.path / MANIFEST_FILE).exists()
+
+    @property
+    def rows(self) -> int:
+        return sum(chunk['rows'] for chunk in self.chunks)
+
+    def _save_manifest(self):
+        manifest_path = self.path / MANIFEST_FILE
+        tmp_path = manifest_path.with_name(MANIFEST_FILE + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({'columns': self.columns, 'dtype': self.dtype,
+                       'compression': self.compression,
+                       'chunks': self.chunks}, file, indent=4)
+        os.replace(tmp_path, manifest_path)
+
+    def append(self, rows: np.ndarray):
+        "Store the (rows, columns) array as a new chunk."
+        rows = np.asarray(rows, dtype=self.dtype).reshape(
+            -1, len(self.columns))
+        self.path.mkdir(parents=True, exist_ok=True)
+        file_name = (f"{len(self.chunks):06d}" +
+                     ('.npz' if self.compression else '.npy'))
+        tmp_path = self.path / (file_name + '.tmp')
+        with open(tmp_path, 'wb') as file:
+            if self.compression:
+                np.savez_compressed(file, rows=rows)
+            else:
+                np.save(file, rows)
+        os.replace(tmp_path, self.path / file_name)
+        # A chunk is a part of the table only after the manifest is saved
+        self.chunks.append({'file': file_name, 'rows': len(rows)})
+        self._save_manifest()
+
+    def truncate(self, rows: int):
+        "Drop the rows after the first `rows` ones."
+        kept, count = [], 0
+        for chunk in self.chunks:
+            if count >= rows:
+                break
+            if count + chunk['rows'] > rows:
+                # The shortened chunk gets a new file, so the manifest always
+                # describes the stored files
+                data = np.array(self._read_chunk(chunk)[:rows - count])
+                file_name = f"{len(kept):06d}.{len(data)}.npy"
+                tmp_path = self.path / (file_name + '.tmp')
+                with open(tmp_path, 'wb') as file:
+                    np.save(file, data)
+                os.replace(tmp_path, self.path / file_name)
+                chunk = {'file': file_name, 'rows': len(data)}
+            kept.append(chunk)
+            count += chunk['rows']
+        dropped = {chunk['file'] for chunk in self.chunks} - \
+            {chunk['file'] for chunk in kept}
+        self.chunks = kept
+        self._save_manifest()
+        for file_name in dropped:
+            (self.path / file_name).unlink(missing_ok=True)
+
+    def _read_chunk(self, chunk: Dict) -> np.ndarray:
+        return read_chunk(self.path / chunk['file'])
+
+    def read(self) -> np.ndarray:
+        "Return the (rows, columns) array, memory-mapped if possible."
+        arrays = [self._read_chunk(chunk) for chunk in self.chunks]
+        if not arrays:
+            return np.empty((0, len(self.columns)), dtype=self.dtype)
+        if len(arrays) == 1:
+            return arrays[0]
+        return np.concatenate(arrays)
+
+    def as_df(self) -> pd.DataFrame:
+        return pd.DataFrame(self.read(), columns=self.columns)
+
+
+def count_rows(path: Path) -> int:
+    "Count the stored rows of the result stored in the CSV file `path`."
+    table = ChunkedTable(table_path(path))
+    if table.exists:
+        return table.rows
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return max(sum(1 for _ in file) - 1, 0)
+    except FileNotFoundError:
+        return 0
+
+
+def read_columns(path: Path) -> List[str]:
+    """Return the column names of the result stored in the CSV file `path`.
+
+    Raises:
+        FileNotFoundError: if the result is not stored
+    """
+    table = ChunkedTable(table_path(path))
+    if table.exists:
+        return table.columns
+    with open(path, 'r', encoding='utf-8') as file:
+        return file.readline().strip().split(",")
+
+
+def stored_tables(folder: Path) -> List[Path]:
+    "Return the tables stored in the folder."
+    return sorted(Path(folder).glob('*' + TABLE_SUFFIX))
+
+
+def export_csv(path: Path,
+               float_format=pyatm.simulations.Result.save_float_format):
+    "Write the table of the result stored in the CSV file `path` to it."
+    table = ChunkedTable(table_path(path))
+    table.as_df().to_csv(path, index=False, float_format=float_format)
+
+
+def link_file(source: Path, destination: Path):
+    """Hard-link the file, copy it if the file system has no hard links.
+    The stored chunks are never modified, only replaced or removed, so
+    the linked tables do not change each other.
+    """
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+def merge_tables(paths: List[Path], merged_path: Path) -> List[List[int]]:
+    """Concatenate the tables with the same columns, return the rows
+    ranges. The merged table links the chunks of the tables.
+    """
+    tables = [ChunkedTable(path) for path in paths]
+    existing = [table for table in tables if table.exists]
+    rows = []
+    for table in tables:
+        start = rows[-1][1] if rows else 0
+        rows.append([start, start + table.rows])
+    if not existing:
+        return rows
+
+    tmp_path = merged_path.with_name(merged_path.name + '.tmp')
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    merged = ChunkedTable(tmp_path, existing[0].columns, existing[0].dtype,
+                          existing[0].compression)
+    merged.path.mkdir(parents=True)
+    for table in existing:
+        for chunk in table.chunks:
+            file_name = (f"{len(merged.chunks):06d}" +
+                         Path(chunk['file']).suffix)
+            link_file(table.path / chunk['file'], merged.path / file_name)
+            merged.chunks.append({'file': file_name, 'rows': chunk['rows']})
+    merged._save_manifest()
+    shutil.rmtree(merged_path, ignore_errors=True)
+    os.replace(tmp_path, merged_path)
+    return rows
+
+
+class ChunkedStorage:
+    """Mixin of `pyatmosphere.simulations.Result` storing the measures in
+    a chunked table instead of rewriting the whole CSV file on each save.
+
+    The `save_path` is the CSV path of the result. If only the CSV file is
+    stored, it is loaded and written to the table on the next save, and
+    the CSV file is removed then, so the data is stored once.
+    """
+    def __init__(self, *args, dtype: str = 'float64',
+                 compression: bool = False, **kwargs):
+        self.dtype = dtype
+        self.compression = compression
+        self._table: Optional[ChunkedTable] = None
+        # The number of the rows stored or queued to be stored
+        self._stored_rows: Optional[int] = None
+        # The loaded CSV file not yet written to the table
+        self._migrated_path: Optional[Path] = None
+        super().__init__(*args, **kwargs)
+
+    def table_columns(self) -> List[str]:
+        return [measures.name for measures in self.measures]
+
+    def set_table_data(self, data: np.ndarray):
+        "Set the measures data from the (rows, columns) array."
+        for measures, column in zip(self.measures, data.T):
+            measures.data = column.tolist()
+
+    @property
+    def table(self) -> ChunkedTable:
+        if self._table is None:
+            self._table = ChunkedTable(table_path(self.save_path),
+                                       self.table_columns(), self.dtype,
+                                       self.compression)
+        return self._table
+
+    def snapshot_output(self) -> Optional[Callable[[], None]]:
+        """Copy the rows simulated since the previous snapshot.
+
+        Returns:
+            a function appending the rows to the table, None if there are
+            no new rows
+        """
+        if not self.save_path:
+            return None
+        if self._stored_rows is None:
+            self._stored_rows = self.table.rows
+        start = self._stored_rows
+        stop = min(len(measures) for measures in self.measures)
+        if stop <= start:
+            return None
+        rows = np.concatenate([
+            np.asarray(measures.data[start:stop], dtype=float).reshape(
+                stop - start, -1)
+            for measures in self.measures], axis=1)
+        self._stored_rows = stop
+        return partial(self._append, rows)
+
+    def _append(self, rows: np.ndarray):
+        self.table.append(rows)
+        if self._migrated_path:
+            self._migrated_path.unlink(missing_ok=True)
+            self._migrated_path = None
+
+    def save_output(self):
+        write = self.snapshot_output()
+        if write:
+            write()
+
+    def truncate_output(self, rows: int):
+        "Drop the stored rows after the first `rows` ones."
+        if self.save_path and self.table.exists and self.table.rows > rows:
+            self.table.truncate(rows)
+        self._stored_rows = None
+
+    def load_output(self):
+        self._table = None
+        self._stored_rows = None
+        if not self.table.exists:
+            super().load_output()
+            self._migrated_path = Path(self.save_path)
+            return
+        self.set_table_data(np.array(self.table.read(), dtype=float))
+
+
+class ChunkedBeamResult(ChunkedStorage, FusedBeamResult):
+    pass
+
+
+class ChunkedPDTResult(ChunkedStorage, pyatm.simulations.PDTResult):
+    pass
+
+
+class ChunkedTrackedPDTResult(ChunkedStorage, TrackedPDTResult):
+    pass
+
+
+class ChunkedShiftedTrackedPDTResult(ChunkedStorage, ShiftedTrackedPDTResult):
+    def table_columns(self) -> List[str]:
+        return ['mean_x', 'mean_y',
+                *[self._col_name(shift) for shift in self.aperture_shifts]]
+
+    def set_table_data(self, data: np.ndarray):
+        self.measures[0].data = data[:, 0].tolist()
+        self.measures[1].data = data[:, 1].tolist()
+        self.measures[2].data = list(data[:, 2:])
@@ -0,0 +1,64 @@
+"""Reading of the chunked tables of `lib/storage.py`.
+
+The module depends only on numpy and pandas, so the analysis stages load
+it by its path to read the simulated data (see
+`02-analysis/models/storage.py`). A `<name>.chunks` table folder next to
+the `<name>.csv` path takes precedence over the CSV file. The `.npy` chunks
+are memory-mapped.
+"""
+
+import json
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+TABLE_SUFFIX = '.chunks'
+MANIFEST_FILE = 'manifest.json'
+
+
+def table_path(path: Path) -> Path:
+    "The table folder of the result stored in the CSV file `path`."
+    return Path(path).with_suffix(TABLE_SUFFIX)
+
+
+def read_manifest(path: Path) -> Optional[Dict]:
+    "The manifest of the table folder, None if the table is not stored."
+    try:
+        with open(Path(path) / MANIFEST_FILE, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def read_chunk(path: Path) -> np.ndarray:
+    "The rows of the chunk file, memory-mapped if it is not compressed."
+    path = Path(path)
+    if path.suffix == '.npz':
+        with np.load(path) as data:
+            return data['rows']
+    return np.load(path, mmap_mode='r')
+
+
+def read_table(path) -> pd.DataFrame:
+    "Read the result stored either in the CSV file `path` or in its table."
+    manifest = read_manifest(table_path(path))
+    if manifest is None:
+        return pd.read_csv(path, dtype=float)
+    chunks = [read_chunk(table_path(path) / chunk['file'])
+              for chunk in manifest['chunks']]
+    data = (np.concatenate(chunks) if chunks else
+            np.empty((0, len(manifest['columns']))))
+    return pd.DataFrame(data, columns=manifest['columns'], dtype=float,
+                        copy=False)
+
+
+def stored_results(folder: Path, pattern: str = '*') -> List[Path]:
+    """Return the CSV paths of the results stored in the folder either as
+    the CSV files or as the tables.
+    """
+    folder = Path(folder)
+    return sorted({path.with_suffix('.csv') for path in
+                   [*folder.glob(pattern + '.csv'),
+                    *folder.glob(pattern + TABLE_SUFFIX)]})
@@ -0,0 +1,137 @@
+"""Saving of the simulation results in a background thread.
+
+On each save step the simulation copies the new data of the results
+(a snapshot) and queues its writing, so the next iterations are computed
+while the files are written. The queue is bounded: if the writer falls
+behind by `max_pending` save steps, the simulation waits for it. The queue
+is flushed when the simulation stops, including on interruption.
+
+Every file is written to a temporary file first and then moved in place,
+so a crash never leaves a half-written file.
+
+The writes never change the results in use by the simulation: a result
+applying the outcome of its writes, such as the stop of the converged
+results, does it in `sync_output`, called on the simulation thread after
+each iteration.
+"""
+
+import os
+import queue
+import threading
+from functools import partial
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import pandas as pd
+import pyatmosphere as pyatm
+
+
+def _write_csv(df: pd.DataFrame, path: Path, float_format):
+    tmp_path = path.with_name(path.name + '.tmp')
+    df.to_csv(tmp_path, index=False, float_format=float_format)
+    os.replace(tmp_path, path)
+
+
+def snapshot_output(
+        result: pyatm.simulations.Result) -> Optional[Callable[[], None]]:
+    """Copy the data of the result to be saved.
+
+    Returns:
+        a function storing the copied data, None if there is nothing to save
+    """
+    if hasattr(result, 'snapshot_output'):
+        return result.snapshot_output()
+    if not result.save_path:
+        return None
+    return partial(_write_csv, result.as_df(), Path(result.save_path),
+                   result.save_float_format)
+
+
+class BackgroundWriter:
+    "A thread running the queued writes in order."
+    def __init__(self, max_pending: int = 2):
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._work, daemon=True)
+        self._thread.start()
+
+    def _work(self):
+        while True:
+            writes = self._queue.get()
+            try:
+                if writes is None:
+                    return
+                # Skip the writes after a failure, it is raised by submit
+                if self._error is None:
+                    for write in writes:
+                        write()
+            except BaseException as error:
+                self._error = error
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def submit(self, writes: List[Callable[[], None]]):
+        "Queue the writes, wait while the queue is full."
+        self._raise_error()
+        self._queue.put(writes)
+
+    def flush(self):
+        "Wait until the queued writes are done."
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        "Flush the queue and stop the thread."
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_error()
+
+
+class BackgroundSaving:
+    """Mixin of `pyatmosphere.simulations.Simulation` saving the results
+    with a `BackgroundWriter` during `run`.
+    """
+    def __init__(self, *args, max_pending_saves: int = 2, **kwargs):
+        self.max_pending_saves = max_pending_saves
+        self.writer: Optional[BackgroundWriter] = None
+        super().__init__(*args, **kwargs)
+
+    def save_output(self):
+        "Queue the snapshots of the results or save them if not running."
+        writes = [write for write in map(snapshot_output, self.results_list)
+                  if write]
+        if self.writer is None:
+            for write in writes:
+                write()
+            self.sync_output()
+        elif writes:
+            self.writer.submit(writes)
+
+    def sync_output(self):
+        """Apply the outcome of the written snapshots to the results on
+        the simulation thread, e.g. the stop of the converged results.
+        """
+        for result in self.results_list:
+            if hasattr(result, 'sync_output'):
+                result.sync_output()
+
+    def process_output(self, iteration, plot_step, save_step):
+        super().process_output(iteration, plot_step=plot_step,
+                               save_step=None)
+        if save_step and iteration % save_step == 0:
+            self.save_output()
+        self.sync_output()
+
+    def run(self, *args, **kwargs):
+        self.writer = BackgroundWriter(self.max_pending_saves)
+        try:
+            super().run(*args, **kwargs)
+        finally:
+            writer, self.writer = self.writer, None
+            writer.close()
+
@@ -1,107 +1,137 @@
 "Data simulation for channels of different turbulent scintillations."
 
+import sys
 from pathlib import Path
 from typing import List
 
+from lib.channel_group import channel_groups
+from lib.headless import INTERRUPTED_EXIT_CODE, write_summary
 from lib.parameters import (default_aperture_radiuses, default_aperture_shifts,
                             load_aperture_radiuses, load_aperture_shifts,
                             save_channel_parameters)
-from lib.shifted_aperture import ApertureShifts, ShiftedTrackedPDTResult
-from pyatmosphere import Channel, CirclePupil, simulations
+from lib.results import create_results, create_simulation
+from lib.scheduler import ChannelApertures, run_scheduled
+from lib.sharding import run_sharded
+from lib.signals import handle_signals, stop_requested
 
 import config
 
 
-def create_results(
-        channel_name: str,
-        channel: Channel,
-        aperture_radiuses: List[float],
-        aperture_shifts: ApertureShifts,
-        iterations: int,
-        semianalytical_iterations: int
-        ) -> List[simulations.Result]:
-    """Declare the required results for a simultaion.
-
-    Args:
-        channel_name: the name of the folder where the results will be stored
-        channel: pyatmosphere.Channel which will be simulated
-        aperture_radiuses: list of aperture radiuses
-        aperture_shifts: list of r_0 values for
-                         the numerical total probability PDT models
-        iterations: the required number of simulation iterations
-        semianalytical_iterations: the required number of simulation iterations
-                                   for semianalytical models
+def prepare_channel(channel_name: str) -> ChannelApertures:
+    """Load or generate the aperture parameters of the channel and store
+    the channel parameters.
 
     Returns:
-        a list of pyatmosphere simulation results
+        aperture radiuses and aperture shifts of the channel
+    """
+    channel_config = config.CHANNELS[channel_name]
+    # The transmittance for any aperture radius is read off the encircled
+    # energy profiles, so the configured ones are used
+    aperture_radiuses = (
+        (not config.SIMULATION_ENCIRCLED_ENERGY and
+         load_aperture_radiuses(channel_name)) or
+        default_aperture_radiuses(channel_name)
+        )
+    save_channel_parameters(channel_name, channel_config['channel'])
+    tracked_shifts = (
+        load_aperture_shifts(channel_name) or
+        default_aperture_shifts(channel_name, aperture_radiuses)
+        )
+    return aperture_radiuses, tracked_shifts
+
+
+def simulation_groups() -> List[List[str]]:
+    """The names of the channels simulated together, each channel alone
+    without the channel groups.
+    """
+    if not (config.SIMULATION_CHANNEL_GROUPS and
+            config.SIMULATION_PROCESSES == 1 and
+            config.SIMULATION_BATCH_SIZE == 1):
+        return [[channel_name] for channel_name in config.CHANNELS]
+    return channel_groups(
+        list(config.CHANNELS), config.CHANNEL_GROUPS,
+        {name: channel_config['channel']
+         for name, channel_config in config.CHANNELS.items()})
+
+
+def run() -> bool:
+    """Start a new or continue data simulation.
+
+    Returns:
+        True if all the channels are completely simulated
     """
-    results_path = Path(config.DATA_PATH) / channel_name
-    results_path.mkdir(exist_ok=True)
-    (results_path / 'shifted_aperture').mkdir(exist_ok=True)
-
-    apertures = [CirclePupil(radius=r) for r in aperture_radiuses]
-    return [
-        simulations.BeamResult(
-            channel, save_path=(results_path / 'beam.csv'), max_size=iterations
-        ),
-        simulations.PDTResult(
-            channel,
-            pupils=apertures,
-            save_path=(results_path / 'transmittance.csv'), max_size=iterations
-        ),
-        simulations.TrackedPDTResult(
-            channel,
-            pupils=apertures,
-            save_path=(results_path / 'tracked_transmittance.csv'),
-            max_size=iterations
-        ),
-        *[ShiftedTrackedPDTResult(
-            channel,
-            aperture=aperture,
-            aperture_shifts=aperture_shifts,
-            save_path=(results_path / 'shifted_aperture' /
-                       f"transmittance_{aperture.radius}.csv"),
-            max_size=semianalytical_iterations
-            )
-            for aperture in apertures]
-    ]
-
-
-def run():
-    "Start a new or continue data simulation"
     Path(config.DATA_PATH).mkdir(exist_ok=True)
-    for channel_name, channel_config in config.CHANNELS.items():
-        aperture_radiuses = (
-            load_aperture_radiuses(channel_name) or
-            default_aperture_radiuses(channel_name)
-            )
-        tracked_shifts = (
-            load_aperture_shifts(channel_name) or
-            default_aperture_shifts(channel_config['channel'])
-            )
-
-        save_channel_parameters(channel_name, channel_config['channel'])
-        results = create_results(channel_name, channel_config['channel'],
-                                 aperture_radiuses, tracked_shifts,
-                                 channel_config['iterations'],
-                                 config.SEMIANALYTICAL_ITERATIONS)
-        sim = simulations.Simulation(results)
+    if config.SIMULATION_CONCURRENT_CHANNELS:
+        channels = {}
+        for channel_name in config.CHANNELS:
+            channels[channel_name] = prepare_channel(channel_name)
+            if stop_requested():
+                return False
+        print(f"Runnig {len(channels)} channel simulations with "
+              f"{config.SIMULATION_PROCESSES} processes...")
+        if not run_scheduled(channels, config.SIMULATION_PROCESSES,
+                             config.SIMULATION_MEMORY_LIMIT):
+            print("Aborting...")
+            return False
+        return True
+
+    for channel_names in simulation_groups():
+        channels = {}
+        for channel_name in channel_names:
+            channels[channel_name] = prepare_channel(channel_name)
+            if stop_requested():
+                return False
+
+        if config.SIMULATION_PROCESSES > 1:
+            for channel_name, (aperture_radiuses,
+                               tracked_shifts) in channels.items():
+                print(f"Runnig '{channel_name}' channel simulation with "
+                      f"{config.SIMULATION_PROCESSES} processes...")
+                if not run_sharded(channel_name, aperture_radiuses,
+                                   tracked_shifts,
+                                   config.SIMULATION_PROCESSES):
+                    print("Aborting...")
+                    return False
+            continue
+
+        results = []
+        for channel_name, (aperture_radiuses,
+                           tracked_shifts) in channels.items():
+            channel_config = config.CHANNELS[channel_name]
+            results += create_results(channel_name, channel_config['channel'],
+                                      aperture_radiuses, tracked_shifts,
+                                      channel_config['iterations'],
+                                      config.SEMIANALYTICAL_ITERATIONS)
+        sim = create_simulation(results)
+        names = "', '".join(channels)
 
         # A loop for the ability to get an intermediate output plot with
         # the key combiation "Ctrl + C".
         while True:
-            print(f"Runnig '{channel_name}' channel simulation...")
+            print(f"Runnig '{names}' channel simulation...")
             sim.run(save_step=config.SIMULATION_SAVE_STEP)  # main sim loop
 
             if sim.is_measures_done():
                 break
+            if config.SIMULATION_HEADLESS:
+                print("Aborting...")
+                return False
 
-            for res in sim.results_list:
-                res.plot_output()
+            if config.SIMULATION_PROFILING:
+                sim.profile.print_output()
+            else:
+                for res in sim.results_list:
+                    res.plot_output()
             if input("\nAbort simulation? (y/N) ").lower().startswith('y'):
                 print("Aborting...")
-                return
+                return False
+    return True
 
 
 if __name__ == "__main__":
-    run()
+    if config.SIMULATION_HEADLESS:
+        with handle_signals(summary=write_summary):
+            if not run():
+                sys.exit(INTERRUPTED_EXIT_CODE)
+    else:
+        run()
@@ -0,0 +1,85 @@
+"""Grid and phase screens plan and cost of the channels.
+
+The configured grid and phase screens of every channel are compared with
+the coarsest ones satisfying the sampling criteria (see `lib/planner.py`),
+and the time of an iteration and the memory of both are predicted with
+the FFT backend of the simulation. The channels oversampled by more than
+`config.PLANNER_MAX_OVERSAMPLING` times the planned grid points or
+undersampled are reported.
+
+Plan all the channels with `python3 plan_channels.py` or the chosen ones with
+`python3 plan_channels.py strong_inf ...`. The exit code is 1 if a channel
+is reported and `config.PLANNER_STRICT` is set.
+"""
+
+import sys
+from typing import List
+
+from lib.fft import default_workers, use_backend
+from lib.parameters import default_aperture_radiuses, load_aperture_radiuses
+from lib.planner import (GridPlan, IterationCost, check_plan, configured_plan,
+                         plan_channel, planned_channel, screens_count)
+
+import config
+
+
+def describe(plan: GridPlan, iteration_time: float, memory: int) -> str:
+    return (f"{plan.resolution} x {plan.delta:.3g} m, "
+            f"{plan.count} phase screens, {iteration_time:.3g} s/iteration, "
+            f"{memory / 2**20:.0f} MiB")
+
+
+def run(channel_names: List[str]) -> bool:
+    """Plan the channels, all of them if no names are given.
+
+    Returns:
+        True if no configured channel is oversampled or undersampled
+    """
+    use_backend(config.FFT_BACKEND,
+                config.FFT_WORKERS or
+                default_workers(config.SIMULATION_PROCESSES),
+                config.FFT_WISDOM_PATH,
+                single=config.SIMULATION_SINGLE_PRECISION)
+    cost = IterationCost(config.PLANNER_TIMING_REPEATS)
+    is_valid = True
+    for channel_name in channel_names or config.CHANNELS:
+        channel_config = config.CHANNELS[channel_name]
+        channel = channel_config['channel']
+        aperture_radiuses = (load_aperture_radiuses(channel_name) or
+                             default_aperture_radiuses(channel_name))
+        planned = plan_channel(
+            channel, aperture_radiuses,
+            beam_points=config.PLANNER_BEAM_POINTS,
+            r0_points=config.PLANNER_R0_POINTS,
+            aperture_points=config.PLANNER_APERTURE_POINTS,
+            beam_radiuses=config.PLANNER_BEAM_RADIUSES,
+            slab_rytov=config.PLANNER_SLAB_RYTOV)
+        hours = {}
+        print(f"'{channel_name}' channel:")
+        for name, simulated in (
+                ('configured', channel),
+                ('planned', planned_channel(channel, planned))):
+            iteration_time = cost.iteration_time(simulated,
+                                                 len(aperture_radiuses))
+            hours[name] = (channel_config['iterations'] * iteration_time /
+                           config.SIMULATION_PROCESSES / 3600)
+            print(f"    {name:<10}: " + describe(
+                configured_plan(simulated), iteration_time,
+                cost.memory(simulated, config.SIMULATION_BATCH_SIZE)))
+        print(f"    {channel_config['iterations']} iterations with "
+              f"{config.SIMULATION_PROCESSES} processes: "
+              f"{hours['configured']:.3g} h configured, "
+              f"{hours['planned']:.3g} h planned")
+        configured = configured_plan(channel)
+        problems = check_plan(
+            configured, planned, config.PLANNER_MAX_OVERSAMPLING,
+            screens_count(channel, configured.resolution, configured.delta,
+                          config.PLANNER_SLAB_RYTOV))
+        for problem in problems:
+            print(f"    Warning: {problem}")
+        is_valid = is_valid and not problems
+    return is_valid
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run(sys.argv[1:]) or not config.PLANNER_STRICT else 1)
@@ -0,0 +1,64 @@
+"""Time series of the channels through the frozen flow turbulence.
+
+The phase screens of the channels are carried by the `TIME_SERIES_WIND` wind
+(see `lib/frozen_flow.py`), and the beam and the transmittance results are
+stored for every `TIME_SERIES_TIME_STEP` to the `time_series` folder of
+the channel data with the `time_series.json` file of the series parameters.
+The row i of a result is the time step i % TIME_SERIES_STEPS of the series
+i // TIME_SERIES_STEPS.
+
+Simulate all the channels with `python3 simulate_time_series.py` or
+the chosen ones with `python3 simulate_time_series.py weak_inf ...`.
+"""
+
+import json
+import sys
+from pathlib import Path
+from typing import List
+
+from lib.frozen_flow import TIME_SERIES_FILE, TIME_SERIES_FOLDER
+from lib.parameters import (default_aperture_radiuses, load_aperture_radiuses,
+                            save_channel_parameters)
+from lib.results import create_results, create_simulation
+
+import config
+
+
+def save_time_series_parameters(results_path: Path):
+    with open(results_path / TIME_SERIES_FILE, "w", encoding="utf-8") as file:
+        json.dump({"wind": config.TIME_SERIES_WIND,
+                   "time_step": config.TIME_SERIES_TIME_STEP,
+                   "steps": config.TIME_SERIES_STEPS}, file, indent=4)
+
+
+def run(channel_names: List[str]) -> bool:
+    """Start a new or continue the time series simulation of the channels,
+    all of them if no names are given.
+
+    Returns:
+        True if all the series are completely simulated
+    """
+    Path(config.DATA_PATH).mkdir(exist_ok=True)
+    for channel_name in channel_names or config.CHANNELS:
+        channel = config.CHANNELS[channel_name]['channel']
+        aperture_radiuses = (load_aperture_radiuses(channel_name) or
+                             default_aperture_radiuses(channel_name))
+        save_channel_parameters(channel_name, channel)
+        results_path = (Path(config.DATA_PATH) / channel_name /
+                        TIME_SERIES_FOLDER)
+        results = create_results(
+            channel_name, channel, aperture_radiuses, [],
+            config.TIME_SERIES_STEPS * config.TIME_SERIES_COUNT, 0,
+            results_path=results_path, adaptive_stopping=False)
+        save_time_series_parameters(results_path)
+        sim = create_simulation(results, time_series=True)
+        print(f"Runnig '{channel_name}' channel time series...")
+        sim.run(save_step=config.SIMULATION_SAVE_STEP)
+        if not sim.is_measures_done():
+            print("Aborting...")
+            return False
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run(sys.argv[1:]) else 1)
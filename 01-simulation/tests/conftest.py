@@ -0,0 +1,39 @@
+import sys
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pyatmosphere as pyatm
+import pytest
+
+# The tests import the simulation modules as the scripts do
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from lib.scaled_propagation import ScaledPhaseScreensPath  # noqa: E402
+
+
+def small_channel(resolution: int = 64, delta: float = 0.0024,
+                  count: int = 3,
+                  source_delta: Optional[float] = None) -> pyatm.Channel:
+    """A short channel on a small grid for the fast tests, on the grids
+    scaled from the `source_delta` step if given.
+    """
+    path_type, path_kwargs = pyatm.IdenticalPhaseScreensPath, {}
+    if source_delta is not None:
+        path_type = ScaledPhaseScreensPath
+        path_kwargs = {'source_delta': source_delta}
+    return pyatm.Channel(
+        grid=pyatm.RectGrid(resolution=resolution, delta=delta),
+        source=pyatm.GaussianSource(wvl=809e-9, w0=0.02, F0=np.inf),
+        path=path_type(
+            phase_screen=pyatm.SSPhaseScreen(
+                model=pyatm.MVKModel(Cn2=1.5e-14, l0=1e-3, L0=80),
+                f_grid=pyatm.RandLogPolarGrid(
+                    points=2**8, f_min=1 / 80 / 15, f_max=1 / 1e-3 * 2)),
+            length=1.6e3, count=count, **path_kwargs),
+        pupil=pyatm.CirclePupil(radius=0.04))
+
+
+@pytest.fixture
+def channel() -> pyatm.Channel:
+    return small_channel()
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+from lib.aperture_correlation import ApertureCorrelation
+
+# The largest difference of the correlation and the pupil mask powers as
+# a fraction of the beam power, the mask differs from the disc by the pixels
+# along the aperture edge
+MASK_TOLERANCE = 1e-2
+SHIFTS = np.array([(0, 0), (0.005, -0.01), (0.0123, 0.0041), (-0.02, 0.017)])
+
+
+@pytest.mark.parametrize('radius', [0.0048, 0.01, 0.03])
+def test_correlation_matches_mask(channel, radius):
+    np.random.seed(0)
+    intensity = abs(channel.run(pupil=False))**2
+    x, y = channel.grid.get_xy()
+    delta2 = channel.grid.delta**2
+    # The `pyatmosphere.CirclePupil` masks of the shifted apertures
+    mask_power = np.array([
+        (intensity * ((x - shift_x)**2 + (y + shift_y)**2 <= radius**2)
+         ).sum() * delta2 for shift_x, shift_y in SHIFTS])
+    power = ApertureCorrelation(channel.grid, [radius]).transmittance(
+        intensity, radius, SHIFTS[:, 0], SHIFTS[:, 1])
+    assert np.abs(power - mask_power).max() <= (
+        MASK_TOLERANCE * intensity.sum() * delta2)
+
@@ -0,0 +1,22 @@
+import numpy as np
+import pyatmosphere as pyatm
+
+from lib.beam_moments import BEAM_MOMENTS, FusedBeamResult
+
+# The relative difference of the moments accumulated in float32
+MOMENTS_TOLERANCE = 1e-5
+
+
+def test_fused_moments_match_pyatmosphere(channel):
+    np.random.seed(0)
+    output = channel.run(pupil=False)
+    result = pyatm.simulations.BeamResult(channel)
+    for measures in result.measures:
+        measures.iteration_data = measures.operations[0](
+            channel, output=output)
+    moments = FusedBeamResult(channel).moments(channel, output)
+    for name, measures, moment in zip(BEAM_MOMENTS, result.measures,
+                                      moments):
+        assert measures.name == name
+        assert np.isclose(moment, measures.iteration_data,
+                          rtol=MOMENTS_TOLERANCE, atol=0)
@@ -0,0 +1,29 @@
+import numpy as np
+
+from lib.results import create_results, create_simulation
+
+from conftest import small_channel
+
+RADIUSES = [0.01, 0.02]
+ITERATIONS = 12
+SAVE_STEP = 4
+FILES = ['beam.csv', 'transmittance.csv', 'tracked_transmittance.csv']
+
+
+def simulate(results_path, iterations: int):
+    results = create_results('small', small_channel(), RADIUSES, [],
+                             iterations, 0, results_path=results_path)
+    create_simulation(results).run(save_step=SAVE_STEP)
+
+
+def test_resume_equals_uninterrupted_run(tmp_path):
+    np.random.seed(0)
+    simulate(tmp_path / 'uninterrupted', ITERATIONS)
+    np.random.seed(0)
+    simulate(tmp_path / 'resumed', ITERATIONS // 2)
+    # The random state is restored from the checkpoint
+    np.random.seed(1)
+    simulate(tmp_path / 'resumed', ITERATIONS)
+    for file_name in FILES:
+        assert ((tmp_path / 'resumed' / file_name).read_text() ==
+                (tmp_path / 'uninterrupted' / file_name).read_text())
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from lib.frozen_flow import FrozenFlowScreen
+
+# The time steps of the moved screens compared
+STEPS = 10
+
+
+@pytest.mark.parametrize('shift, period', [
+    (3, 1), (10 / 3, 3), (-2.5, 2), (np.sqrt(2), None)])
+def test_moved_screen_equals_synthesis(channel, shift, period):
+    channel.path.init_phase_screens()
+    phase_screen = channel.path.phase_screens[0]
+    delta = phase_screen.grid.delta
+    np.random.seed(0)
+    layer = FrozenFlowScreen(phase_screen, phase_screen.grid,
+                             velocity=(-shift * delta / 1e-4, 0),
+                             time_step=1e-4)
+    assert layer.period == period
+    layer.start()
+    for step in range(1, STEPS):
+        layer.move(step)
+        offset = tuple(value * step for value in layer.shift)
+        screen = np.asarray(layer.screen)
+        synthesized = np.asarray(layer._synthesize(offset))
+        # The float32 rounding of the screens of tens of radians
+        assert np.allclose(screen, synthesized, rtol=0, atol=1e-4)
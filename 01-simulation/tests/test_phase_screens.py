@@ -0,0 +1,42 @@
+import numpy as np
+
+from lib.phase_screens import ScreenPipeline, draw_spectrum, synthesize
+
+# The passes over the path, an iteration each
+PASSES = 4
+
+
+def _pass_screens(channel, generate):
+    "The screens of a pass as the simulation iteration generates them."
+    for phase_screen in channel.path.phase_screens:
+        phase_screen.cache_clear()
+    return [np.array(generate(phase_screen, wind=True))
+            for phase_screen in channel.path.phase_screens]
+
+
+def test_pipeline_equals_sequential_synthesis(channel):
+    channel.path.init_phase_screens()
+    np.random.seed(0)
+    sequential = [
+        _pass_screens(channel, lambda phase_screen, **kwargs: synthesize(
+            *draw_spectrum(phase_screen, **kwargs)))
+        for _ in range(PASSES)]
+    sequential_state = np.random.get_state()
+
+    np.random.seed(0)
+    pipeline = ScreenPipeline(channel.path.phase_screens, draw_spectrum,
+                              depth=2)
+    try:
+        pipelined = []
+        for _ in range(PASSES):
+            pipelined.append(_pass_screens(channel, pipeline))
+            # The spectra of the next pass are drawn ahead
+            assert pipeline._ahead is not None
+    finally:
+        pipeline.close()
+    for screens, pipelined_screens in zip(sequential, pipelined):
+        for screen, pipelined_screen in zip(screens, pipelined_screens):
+            assert np.array_equal(screen, pipelined_screen)
+    state = np.random.get_state()
+    assert np.array_equal(state[1], sequential_state[1])
+    assert state[2:] == sequential_state[2:]
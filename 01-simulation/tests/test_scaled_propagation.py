@@ -0,0 +1,12 @@
+import pytest
+
+import config
+from validate_scaled_propagation import vacuum_error
+
+from conftest import small_channel
+
+
+@pytest.mark.parametrize('source_delta', [None, 0.0016])
+def test_vacuum_matches_gaussian_beam(source_delta):
+    channel = small_channel(source_delta=source_delta)
+    assert vacuum_error(channel) <= config.VALIDATION_VACUUM_TOLERANCE
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from conftest import small_channel
+from lib.screen_bank import BankSampler, PhaseScreenBank, bank_phase_screen
+
+# The stored screens of the test bank
+BANK_SIZE = 12
+
+
+@pytest.fixture
+def bank(tmp_path) -> PhaseScreenBank:
+    channel = small_channel(resolution=16)
+    bank = PhaseScreenBank(tmp_path, bank_phase_screen(
+        channel, channel.path.phase_screens[0]))
+    np.random.seed(0)
+    bank.generate(BANK_SIZE, chunk_size=5)
+    return bank
+
+
+def _draws(sampler: BankSampler, count: int):
+    return [sampler.draw() for _ in range(count)]
+
+
+def test_sampler_draws_the_stored_screens_once(bank):
+    sampler = BankSampler(bank, (16, 16), seed=1)
+    # Without the opted-in transforms a draw is a stored screen
+    assert sampler.draws == BANK_SIZE
+    draws = _draws(sampler, BANK_SIZE)
+    assert sorted(draws) == list(range(BANK_SIZE))
+    assert draws != sorted(draws)
+    with pytest.raises(RuntimeError):
+        sampler.draw()
+    assert np.array_equal(sampler.screen(draws[0]),
+                          bank.screen(draws[0]))
+
+
+def test_sampler_transforms_are_opt_in(bank):
+    sampler = BankSampler(bank, (16, 16), symmetries=True, seed=1)
+    assert sampler.draws == BANK_SIZE * 8
+    assert sorted(_draws(sampler, sampler.draws)) == list(
+        range(sampler.draws))
+
+
+def test_resumed_sampler_continues_the_order(bank):
+    uninterrupted = _draws(BankSampler(bank, (16, 16), seed=2), BANK_SIZE)
+    sampler = BankSampler(bank, (16, 16), seed=2)
+    draws = _draws(sampler, 5)
+    resumed = BankSampler(bank, (16, 16), **sampler.state())
+    assert draws + _draws(resumed, BANK_SIZE - 5) == uninterrupted
+
+
+def test_extended_bank_follows_the_order(bank):
+    sampler = BankSampler(bank, (16, 16), seed=3)
+    draws = _draws(sampler, 4)
+    bank.generate(4)
+    resumed = BankSampler(bank, (16, 16), **sampler.state())
+    draws += _draws(resumed, BANK_SIZE)
+    assert sorted(draws[:BANK_SIZE]) == list(range(BANK_SIZE))
+    assert sorted(draws[BANK_SIZE:]) == list(range(BANK_SIZE,
+                                                   BANK_SIZE + 4))
+
+
+@pytest.mark.parametrize('shards', [2, 5])
+def test_shards_draw_disjoint_parts(bank, shards):
+    samplers = [BankSampler(bank, (16, 16), seed=4, shard=shard,
+                            shards=shards) for shard in range(shards)]
+    draws = [_draws(sampler, len(sampler.order)) for sampler in samplers]
+    for shard, shard_draws in enumerate(draws):
+        assert all(draw % shards == shard for draw in shard_draws)
+    assert sorted(sum(draws, [])) == list(range(BANK_SIZE))
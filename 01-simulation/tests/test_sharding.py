@@ -0,0 +1,45 @@
+import json
+
+import config
+from lib.sharding import (SHARDS_MANIFEST, channel_shards, load_spawn_keys,
+                          merge_shards, run_sharded)
+
+from conftest import small_channel
+
+RADIUSES = [0.01, 0.02]
+PROCESSES = 2
+SEED = 1234
+FILES = ['beam.csv', 'transmittance.csv', 'tracked_transmittance.csv',
+         SHARDS_MANIFEST]
+
+
+def simulate(monkeypatch, data_path):
+    monkeypatch.setattr(config, 'DATA_PATH', str(data_path))
+    run_sharded('small', RADIUSES, [], PROCESSES)
+
+
+def test_sharded_run_is_reproducible(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, 'CHANNELS', {'small': {
+        'channel': small_channel(), 'iterations': 8,
+        'aperture_range': RADIUSES}})
+    monkeypatch.setattr(config, 'SEMIANALYTICAL_ITERATIONS', 0)
+    monkeypatch.setattr(config, 'SIMULATION_SEED', SEED)
+    monkeypatch.setattr(config, 'SIMULATION_PROCESSES', PROCESSES)
+    for name in ['first', 'second']:
+        simulate(monkeypatch, tmp_path / name)
+    first, second = tmp_path / 'first' / 'small', tmp_path / 'second' / 'small'
+    for file_name in FILES:
+        assert ((first / file_name).read_text() ==
+                (second / file_name).read_text())
+    manifest = json.loads((first / SHARDS_MANIFEST).read_text())
+    assert manifest['entropy'] == SEED
+    assert sum(rows[1] - rows[0] for rows in (
+        shard['rows']['beam.csv'] for shard in manifest['shards'])) == 8
+
+    # Merging the shards again gives the same rows and the same spawn keys
+    manifest_text = (first / SHARDS_MANIFEST).read_text()
+    monkeypatch.setattr(config, 'DATA_PATH', str(tmp_path / 'first'))
+    merge_shards('small', channel_shards('small'), load_spawn_keys('small'))
+    assert (first / SHARDS_MANIFEST).read_text() == manifest_text
+    assert ((first / 'beam.csv').read_text() ==
+            (second / 'beam.csv').read_text())
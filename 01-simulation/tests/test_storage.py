@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from lib.storage import ChunkedTable, merge_tables
+from lib.tables import read_table
+
+COLUMNS = ['mean_x', 'mean_y', '0.01']
+
+
+def rows(start, stop):
+    return np.arange(start * len(COLUMNS), stop * len(COLUMNS),
+                     dtype=float).reshape(-1, len(COLUMNS))
+
+
+@pytest.mark.parametrize('compression', [False, True])
+def test_append_truncate_read(tmp_path, compression):
+    path = tmp_path / 'beam.chunks'
+    table = ChunkedTable(path, COLUMNS, compression=compression)
+    table.append(rows(0, 3))
+    table.append(rows(3, 5))
+    table.append(rows(5, 5))
+    np.testing.assert_array_equal(table.read(), rows(0, 5))
+
+    # The shortened chunk is rewritten, the dropped ones are removed
+    table.truncate(4)
+    stored = ChunkedTable(path)
+    assert stored.columns == COLUMNS and stored.compression == compression
+    assert stored.rows == 4
+    np.testing.assert_array_equal(stored.read(), rows(0, 4))
+    assert ({file.name for file in path.iterdir()} ==
+            {chunk['file'] for chunk in stored.chunks} | {'manifest.json'})
+
+    stored.append(rows(4, 6))
+    np.testing.assert_array_equal(ChunkedTable(path).read(), rows(0, 6))
+    data = read_table(tmp_path / 'beam.csv')
+    assert list(data.columns) == COLUMNS
+    np.testing.assert_array_equal(data.values, rows(0, 6))
+
+    with pytest.raises(ValueError):
+        ChunkedTable(path, ['mean_x'])
+
+
+def test_merge_tables(tmp_path):
+    first = ChunkedTable(tmp_path / '0' / 'beam.chunks', COLUMNS)
+    first.append(rows(0, 2))
+    first.append(rows(2, 3))
+    second = ChunkedTable(tmp_path / '1' / 'beam.chunks', COLUMNS)
+    second.append(rows(3, 7))
+    merged_path = tmp_path / 'beam.chunks'
+    paths = [first.path, tmp_path / '2' / 'beam.chunks', second.path]
+    assert merge_tables(paths, merged_path) == [[0, 3], [3, 3], [3, 7]]
+    np.testing.assert_array_equal(ChunkedTable(merged_path).read(),
+                                  rows(0, 7))
+
+    # The merged table does not change with the shards
+    second.truncate(1)
+    first.append(rows(7, 8))
+    merged = ChunkedTable(merged_path)
+    np.testing.assert_array_equal(merged.read(), rows(0, 7))
+
+    # Merging again replaces the merged table
+    assert merge_tables(paths, merged_path) == [[0, 4], [4, 4], [4, 5]]
+    np.testing.assert_array_equal(
+        ChunkedTable(merged_path).read(),
+        np.concatenate([rows(0, 3), rows(7, 8), rows(3, 4)]))
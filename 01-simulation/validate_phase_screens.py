@@ -0,0 +1,64 @@
+"""Structure function check of the fast phase screens synthesis.
+
+The phase screens of the channels are generated by pyatmosphere and by
+`lib.phase_screens.synthesize` from the same seed, and their mean phase
+structure functions along the rows are compared with each other and with
+the theoretical one, as in `06-appendix/structure-function.ipynb`.
+
+Check all the channels with `python3 validate_phase_screens.py` or the chosen
+ones with `python3 validate_phase_screens.py weak_inf ...`. The exit code is 1
+if the structure functions of the two syntheses differ by more than
+`config.VALIDATION_SF_TOLERANCE`.
+"""
+
+import sys
+from typing import List
+
+import numpy as np
+from pyatmosphere.gpu import get_array
+from pyatmosphere.theory.phase_screens.sf import calculate_sf
+
+import config
+from lib.phase_screens import channel_phase_screen, generate_phase_screen
+
+
+def structure_function(generate) -> np.ndarray:
+    "The mean structure function of the generated phase screens."
+    np.random.seed(config.VALIDATION_SEED)
+    return np.mean([
+        get_array(calculate_sf(generate()).mean(axis=1))
+        for _ in range(config.VALIDATION_PHASE_SCREENS)], axis=0)
+
+
+def run(channel_names: List[str]) -> bool:
+    """Check the channels, all of them if no names are given.
+
+    Returns:
+        True if the structure functions of the syntheses agree
+    """
+    is_valid = True
+    for channel_name in channel_names or config.CHANNELS:
+        phase_screen = channel_phase_screen(
+            config.CHANNELS[channel_name]['channel'],
+            config.VALIDATION_PHASE_SCREEN_RESOLUTION)
+        print(f"Checking '{channel_name}' channel: "
+              f"{config.VALIDATION_PHASE_SCREENS} phase screens of "
+              f"{config.VALIDATION_PHASE_SCREEN_RESOLUTION} points...")
+        reference = structure_function(phase_screen.generate)
+        fast = structure_function(
+            lambda: generate_phase_screen(phase_screen))
+        r = np.arange(1, len(reference) + 1) * phase_screen.grid.delta
+        theory = get_array(phase_screen.model.sf_phi_numeric(
+            r, 2 * np.pi / phase_screen.wvl, phase_screen.thickness))
+        deviation = np.max(np.abs(fast / reference - 1))
+        theory_deviation = np.max(np.abs(fast / theory - 1))
+        passed = deviation <= config.VALIDATION_SF_TOLERANCE
+        print(f"{'Passed' if passed else 'FAILED'}: the largest relative "
+              f"deviation is {deviation:.3e} from pyatmosphere and "
+              f"{theory_deviation:.3e} from the theory")
+        is_valid = is_valid and passed
+    return is_valid
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run(sys.argv[1:]) else 1)
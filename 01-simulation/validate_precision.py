@@ -0,0 +1,93 @@
+"""Accuracy of the single precision simulation.
+
+Each channel is simulated in the double and in the single precision
+(`config.SIMULATION_SINGLE_PRECISION`) from the same seed, and
+the transmittance samples of every aperture are compared: the two-sample KS
+distance between them and the difference of the KS distances of
+the lognormal and beta fits, which the models are compared by.
+
+Validate all the channels with `python3 validate_precision.py` or the chosen
+ones with `python3 validate_precision.py weak_inf ...`. The exit code is 1 if
+any distance exceeds `config.VALIDATION_KS_TOLERANCE`.
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+from scipy.stats import ks_2samp
+
+import config
+from lib.convergence import fits_ks_distance, result_transmittance
+from lib.results import create_results, create_simulation
+
+
+def simulate(channel_name: str, single: bool) -> Dict[str, np.ndarray]:
+    "Return the transmittance samples of the channel by the aperture names."
+    channel_config = config.CHANNELS[channel_name]
+    single_precision = config.SIMULATION_SINGLE_PRECISION
+    config.SIMULATION_SINGLE_PRECISION = single
+    try:
+        with tempfile.TemporaryDirectory() as results_path:
+            results = create_results(
+                channel_name, channel_config['channel'],
+                channel_config['aperture_range'], [],
+                config.VALIDATION_ITERATIONS, 0,
+                results_path=Path(results_path))
+            np.random.seed(config.VALIDATION_SEED)
+            create_simulation(results).run(
+                save_step=config.SIMULATION_SAVE_STEP)
+    finally:
+        config.SIMULATION_SINGLE_PRECISION = single_precision
+    samples = {}
+    for result in results:
+        samples.update(result_transmittance(result))
+    return samples
+
+
+def compare(reference: Dict[str, np.ndarray],
+            samples: Dict[str, np.ndarray]) -> pd.DataFrame:
+    "Compare the single precision samples with the double precision ones."
+    rows = []
+    for name, reference_samples in reference.items():
+        reference_fit = fits_ks_distance(reference_samples)
+        rows.append({
+            'aperture': name,
+            'mean': reference_samples.mean(),
+            'mean_error': samples[name].mean() - reference_samples.mean(),
+            'ks': ks_2samp(reference_samples, samples[name],
+                           method='asymp').statistic,
+            'fit_ks': reference_fit,
+            'fit_ks_error': fits_ks_distance(samples[name]) - reference_fit,
+        })
+    return pd.DataFrame(rows)
+
+
+def run(channel_names: List[str]) -> bool:
+    """Validate the channels, all of them if no names are given.
+
+    Returns:
+        True if the single precision distributions agree with the double
+        precision ones
+    """
+    is_valid = True
+    for channel_name in channel_names or config.CHANNELS:
+        print(f"Validating '{channel_name}' channel: "
+              f"{config.VALIDATION_ITERATIONS} iterations, "
+              f"seed {config.VALIDATION_SEED}...")
+        df = compare(simulate(channel_name, single=False),
+                     simulate(channel_name, single=True))
+        print(df.to_string(index=False, float_format='{:.3e}'.format))
+        deviation = max(df['ks'].max(), df['fit_ks_error'].abs().max())
+        passed = deviation <= config.VALIDATION_KS_TOLERANCE
+        print(f"{'Passed' if passed else 'FAILED'}: the largest KS "
+              f"deviation is {deviation:.3e}")
+        is_valid = is_valid and passed
+    return is_valid
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run(sys.argv[1:]) else 1)
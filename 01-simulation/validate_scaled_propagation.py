@@ -0,0 +1,125 @@
+"""Accuracy of the propagation on the grids scaled along the path.
+
+Each channel of `config.VALIDATION_SCALED_CHANNELS` (see
+`lib/scaled_propagation.py`) is compared with the channel of
+`config.CHANNELS` it replaces:
+
+- the vacuum output intensities of both are compared with the Gaussian beam
+  intensity, by the power fraction of their difference,
+- both are simulated, and the transmittance samples of every aperture are
+  compared by the two-sample KS distance and the difference of the means.
+
+The apertures of a few grid steps of the coarser receiver grid of a scaled
+channel differ by their pixelated area rather than by the propagation.
+
+Validate all the scaled channels with `python3 validate_scaled_propagation.py`
+or the chosen ones with `python3 validate_scaled_propagation.py strong_inf
+...`. The exit code is 1 if any error exceeds
+`config.VALIDATION_VACUUM_TOLERANCE` or
+`config.VALIDATION_SCALED_KS_TOLERANCE`.
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+import numpy as np
+import pandas as pd
+import pyatmosphere as pyatm
+from pyatmosphere.gpu import get_array
+from scipy.stats import ks_2samp
+
+import config
+from lib.convergence import result_transmittance
+from lib.propagation import get_propagator, release_propagator
+from lib.results import create_results, create_simulation
+
+
+def vacuum_error(channel: pyatm.Channel) -> float:
+    """The power fraction of the difference of the vacuum output intensity
+    and the Gaussian beam one.
+    """
+    propagator = get_propagator(channel)
+    steps = propagator.steps(channel.source.output(),
+                             channel.grid.shape[::-1],
+                             lambda phase_screen: 0)
+    try:
+        while True:
+            next(steps)
+    except StopIteration as stop:
+        intensity = get_array(abs(stop.value)**2)
+    release_propagator(channel)
+    source = channel.source
+    power = get_array(abs(source.output())**2).sum() * channel.grid.delta**2
+    beam_radius = source.get_w(channel.path.length)
+    reference = power * 2 / (np.pi * beam_radius**2) * np.exp(
+        -2 * get_array(channel.grid.get_rho2()) / beam_radius**2)
+    return (abs(intensity - reference).sum() * channel.grid.delta**2 /
+            power)
+
+
+def simulate(channel_name: str, channel: pyatm.Channel,
+             aperture_radiuses: Sequence[float]) -> Dict[str, np.ndarray]:
+    "Return the transmittance samples of the channel by the aperture names."
+    with tempfile.TemporaryDirectory() as results_path:
+        results = create_results(
+            channel_name, channel, aperture_radiuses, [],
+            config.VALIDATION_ITERATIONS, 0,
+            results_path=Path(results_path))
+        np.random.seed(config.VALIDATION_SEED)
+        create_simulation(results).run(save_step=config.SIMULATION_SAVE_STEP)
+    samples = {}
+    for result in results:
+        samples.update(result_transmittance(result))
+    return samples
+
+
+def compare(reference: Dict[str, np.ndarray],
+            samples: Dict[str, np.ndarray]) -> pd.DataFrame:
+    "Compare the scaled channel samples with the replaced channel ones."
+    return pd.DataFrame([{
+        'aperture': name,
+        'mean': reference_samples.mean(),
+        'mean_error': samples[name].mean() - reference_samples.mean(),
+        'ks': ks_2samp(reference_samples, samples[name],
+                       method='asymp').statistic,
+    } for name, reference_samples in reference.items()])
+
+
+def run(channel_names: List[str]) -> bool:
+    """Validate the scaled channels, all of them if no names of the replaced
+    channels are given.
+
+    Returns:
+        True if the scaled channels agree with the replaced ones
+    """
+    is_valid = True
+    for channel_name in channel_names or config.VALIDATION_SCALED_CHANNELS:
+        channel_config = config.CHANNELS[channel_name]
+        reference = channel_config['channel']
+        scaled = config.VALIDATION_SCALED_CHANNELS[channel_name]
+        print(f"Validating the scaled '{channel_name}' channel: "
+              f"{max(scaled.grid.resolution)} instead of "
+              f"{max(reference.grid.resolution)} grid points...")
+        errors = {name: vacuum_error(channel) for name, channel in (
+            ('replaced', reference), ('scaled', scaled))}
+        print(f"Vacuum output power error: {errors['replaced']:.3e} "
+              f"replaced, {errors['scaled']:.3e} scaled")
+        print(f"{config.VALIDATION_ITERATIONS} iterations, "
+              f"seed {config.VALIDATION_SEED}...")
+        df = compare(
+            simulate(channel_name, reference,
+                     channel_config['aperture_range']),
+            simulate(channel_name, scaled, channel_config['aperture_range']))
+        print(df.to_string(index=False, float_format='{:.3e}'.format))
+        passed = (errors['scaled'] <= config.VALIDATION_VACUUM_TOLERANCE and
+                  df['ks'].max() <= config.VALIDATION_SCALED_KS_TOLERANCE)
+        print(f"{'Passed' if passed else 'FAILED'}: the largest KS "
+              f"distance is {df['ks'].max():.3e}")
+        is_valid = is_valid and passed
+    return is_valid
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run(sys.argv[1:]) else 1)
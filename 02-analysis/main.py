@@ -89,7 +89,7 @@ def process_channel(channel_name, eta_bins=200, r0_iterations=100000,
     ks_df.to_csv(results_path / 'ks_values.csv', float_format='%.3e')
 
     # Store beam params
-    beam_data = pd.read_csv(beam_data_path)
+    beam_data = models.read_table(beam_data_path)
     pd.DataFrame({
         "bw2": (beam_data.mean_x**2).mean(),
         "st2": 4 * (beam_data.mean_x2.mean() - (beam_data.mean_x**2).mean()),
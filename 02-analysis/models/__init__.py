@@ -5,6 +5,7 @@ from .model import AnalyticalModel, Model, NDArrayByAperture
 from .numerical import NumericalModel, TrackedNumericalModel
 from .semianalytical import (NumBetaTotalProbabilityModel,
                              NumEllipticalBeamModel, NumTotalProbabilityModel)
+from .storage import read_table
 
 __all__ = [
     'Model',
@@ -21,4 +22,5 @@ __all__ = [
     'NumTotalProbabilityModel',
     'NumBetaTotalProbabilityModel',
     'NDArrayByAperture',
+    'read_table',
     ]
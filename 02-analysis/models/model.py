@@ -4,6 +4,8 @@ import numpy as np
 import numpy.typing as npt
 import pandas as pd
 
+from .storage import read_table
+
 NDArrayByAperture = Dict[float, npt.NDArray]
 
 class Model:
@@ -77,7 +79,7 @@ class NumericalModel(Model):
     @property
     def beam_data(self) -> pd.DataFrame:
         if self._beam_data is None:
-            self._beam_data = pd.read_csv(self.beam_data_path, dtype=float)
+            self._beam_data = read_table(self.beam_data_path)
         return self._beam_data
 
     @property
@@ -94,7 +96,7 @@ class NumericalModel(Model):
         if self._transmittance is not None:
             return self._transmittance
 
-        transmittance = pd.read_csv(self.transmittance_path, dtype=float)
+        transmittance = read_table(self.transmittance_path)
         transmittance.columns = transmittance.columns.astype('float')
         self._transmittance = cast(NDArrayByAperture, transmittance.to_dict('list'))
         return self._transmittance
@@ -1,8 +1,7 @@
 from typing import cast
 
-import pandas as pd
-
 from .model import NDArrayByAperture, NumericalModel
+from .storage import read_table
 
 
 class TrackedNumericalModel(NumericalModel):
@@ -11,7 +10,7 @@ class TrackedNumericalModel(NumericalModel):
         if self._transmittance is not None:
             return self._transmittance
 
-        transmittance = pd.read_csv(self.transmittance_path, dtype=float)
+        transmittance = read_table(self.transmittance_path)
         transmittance.drop(columns=['mean_x', 'mean_y'], inplace=True)
         transmittance.columns = transmittance.columns.astype('float')
         self._transmittance = cast(NDArrayByAperture, transmittance.to_dict('list'))
@@ -1,10 +1,10 @@
 import numpy as np
-import pandas as pd
 from pyatmosphere.theory.pdt import (beta_pdt,
                                      elliptic_beam_numerical_transmission,
                                      lognormal_pdt)
 
 from .model import AnalyticalModel
+from .storage import read_table, stored_results
 
 
 class NumEllipticalBeamModel(AnalyticalModel):
@@ -44,13 +44,15 @@ class NumTotalProbabilityModel(AnalyticalModel):
 
         print("calc pdt")
         transmittance = {}
-        for aperture_path in self.totprob_path.glob('transmittance_*.csv'):
+        for aperture_path in stored_results(self.totprob_path,
+                                            'transmittance_*'):
             aperture = float(
                 '.'.join(aperture_path.name.split('_')[1].split('.')[:-1]))
-            transmittance[aperture] = pd.read_csv(aperture_path).drop(['mean_x', 'mean_y'], axis=1)
+            transmittance[aperture] = read_table(aperture_path).drop(['mean_x', 'mean_y'], axis=1)
 
         pdt = {}
-        for aperture_path in self.totprob_path.glob('transmittance_*.csv'):
+        for aperture_path in stored_results(self.totprob_path,
+                                            'transmittance_*'):
             aperture = float(
                 '.'.join(aperture_path.name.split('_')[1].split('.')[:-1]))
             pdt[aperture] = np.asarray([
@@ -0,0 +1,26 @@
+"""Reading of the simulated data stored either as the CSV files or as
+the chunked tables of `01-simulation/lib/storage.py`.
+
+The tables are read by `01-simulation/lib/tables.py`, which is loaded by
+its path.
+"""
+
+import importlib.util
+from pathlib import Path
+
+TABLES_MODULE_PATH = (Path(__file__).resolve().parents[2] /
+                      '01-simulation' / 'lib' / 'tables.py')
+
+
+def _load_tables():
+    spec = importlib.util.spec_from_file_location('simulation_tables',
+                                                  TABLES_MODULE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+_tables = _load_tables()
+
+read_table = _tables.read_table
+stored_results = _tables.stored_results
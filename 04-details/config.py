@@ -5,6 +5,7 @@ from matplotlib.colors import LinearSegmentedColormap
 
 DATA_PATH = Path('../01-simulation/data')
 RESULTS_PATH = Path('../02-analysis/results')
+TABLES_MODULE_PATH = Path('../01-simulation/lib/tables.py')
 PLOTS_PATH = Path('./plots')
 
 plt.rcParams['axes.axisbelow'] = True
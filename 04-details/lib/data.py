@@ -1,4 +1,5 @@
 from functools import lru_cache
+import importlib.util
 import json
 
 import numpy as np
@@ -7,15 +8,27 @@ import pandas as pd
 import config
 
 
+def _load_tables():
+    # The simulated data is read by the reader of its tables
+    spec = importlib.util.spec_from_file_location('simulation_tables',
+                                                  config.TABLES_MODULE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+read_table = _load_tables().read_table
+
+
 @lru_cache(maxsize=None)
 def _get_data(channel_name):
     with open(config.DATA_PATH / channel_name / 'params.json', 'r') as f:
         channel = json.load(f)
-    beam = pd.read_csv(config.DATA_PATH / channel_name / 'beam.csv')
+    beam = read_table(config.DATA_PATH / channel_name / 'beam.csv')
     beam_params = pd.read_csv(config.RESULTS_PATH / channel_name / 'beam_params.csv')
-    eta = pd.read_csv(config.DATA_PATH / channel_name / 'transmittance.csv')
+    eta = read_table(config.DATA_PATH / channel_name / 'transmittance.csv')
     eta.columns = pd.to_numeric(eta.columns)
-    tracked_eta = pd.read_csv(config.DATA_PATH / channel_name / 'tracked_transmittance.csv')
+    tracked_eta = read_table(config.DATA_PATH / channel_name / 'tracked_transmittance.csv')
     tracked_eta = tracked_eta.drop(['mean_x', 'mean_y'], axis=1)
     tracked_eta.columns = pd.to_numeric(tracked_eta.columns)
     return {'channel': channel, 'beam': beam, 'beam_params': beam_params,